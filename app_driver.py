@@ -1,10 +1,21 @@
 import streamlit as st
 import pandas as pd
-import io
+import os
+import hashlib
 from datetime import datetime
-import pyxlsb
+import numpy as np
 import folium
+import pydeck as pdk
 from streamlit_folium import st_folium
+from driver_engine import (
+    CACHE_DIR, CACHE_VERSION, DEFAULT_EXCEPTIONS, EXCEL_EXTENSIONS, MERGED_SHEET_NAME, MergedWorkbook,
+    add_geographic_coordinates, address_counts, in_poland, cluster_points_within,
+    extract_driver_name, find_date_column, visible_columns, file_content_hash, filter_stage, driver_summary,
+    open_merged_workbook, open_workbook, parse_tracking_numbers, write_export,
+    StageProfiler, profile_stage, set_profiler, USED_COLUMNS, projection_key, READER_ENGINES,
+    StreamedDataset, open_streamed_workbook, CACHE, EXPORT_FILES, remove_file,
+    EXPORT_DIR_NAME, prune_disk_cache, temporary_path, ROW_READER_MIN_BYTES,
+)
 
 # Konfiguracja strony
 st.set_page_config(
@@ -20,340 +31,1141 @@ st.title("📊 :dagger: Nożyk App :dagger:")
 st.markdown("---")
 
 
-def fix_problematic_columns(df):
-    """Naprawia problematyczne kolumny w DataFrame"""
-    # Lista znanych problematycznych kolumn
-    problematic_columns = ['Street Num', 'Numer', 'Postal', 'Exception',
-                           'OPLD Consignee Name', 'Consignee Name', 'Consignee']
+def cached_frame(key, build):
+    """Ramka z CACHE (wspólna dla sesji, liczona do budżetu pamięci) jako płytki widok.
 
-    # Sprawdź wszystkie kolumny pod kątem mieszanych typów
-    for col in df.columns:
-        try:
-            # Sprawdź czy kolumna ma mieszane typy danych
-            if df[col].dtype == 'object':
-                # Sprawdź czy są różne typy w kolumnie
-                non_null_values = df[col].dropna()
-                if len(non_null_values) > 0:
-                    types_in_col = non_null_values.apply(type).unique()
-                    if len(types_in_col) > 1:
-                        # Konwertuj wszystko na string
-                        df[col] = df[col].astype(str)
-        except Exception:
-            # Jeśli nie można sprawdzić typów, po prostu konwertuj na string
-            try:
-                df[col] = df[col].astype(str)
-            except Exception:
-                pass
+    key to krotka zaczynająca się od rodzaju wyniku, a dalej stan filtrów z ('file', klucz
+    pliku) - przycisk czyszczenia cache usuwa po nim wyniki danego pliku. Wyniki są
+    kluczowane stanem filtrów, a nie zawartością ramki - ramka wejściowa nie jest hashowana.
+    """
+    return CACHE.get(key, build).copy(deep=False)
 
-    # Konwertuj znane problematyczne kolumny
-    for col in problematic_columns:
-        if col in df.columns:
-            try:
-                df[col] = df[col].astype(str)
-            except Exception:
-                pass
 
-    return df
+def run_filter_stage(df, input_key, stage, params):
+    """Jeden etap filtrowania (driver_engine.filter_stage) z cache po stanie sprzed etapu"""
+    def build():
+        with profile_stage(f'filter:{stage}') as record:
+            record['frame'] = result = filter_stage(df, stage, params)
+        return result
 
+    return cached_frame(('filter',) + input_key + (stage, params), build)
 
-def extract_driver_name(driver_id):
-    """Wyciąga część nazwy Driver ID od 6 do 8 znaku"""
-    driver_str = str(driver_id)
-    if len(driver_str) >= 8:
-        return driver_str[5:8]  # od 6 do 8 znaku (indeksy 5-7)
-    elif len(driver_str) >= 5:
-        return driver_str[5:]   # od 6 znaku do końca
-    else:
-        return driver_str       # cała nazwa jeśli krótsza niż 5 znaków
 
+def apply_filter_stage(df, filter_state, stage, params):
+    """Filtruje df etapem stage i dopisuje jego parametry do filter_state"""
+    input_key = tuple(filter_state.items())
+    filter_state[stage] = params
+    return run_filter_stage(df, input_key, stage, params)
 
-def create_gps_map(df):
-    """Tworzy mapę z punktami GPS na podstawie kolumn GPSX i GPSY"""
-    # Sprawdź czy istnieją kolumny GPS
-    if 'GPSX' not in df.columns or 'GPSY' not in df.columns:
-        return None
 
-    # Filtruj dane z prawidłowymi współrzędnymi GPS
-    gps_data = df[(df['GPSX'].notna()) & (df['GPSY'].notna()) &
-                  (df['GPSX'] != '') & (df['GPSY'] != '')]
+def build_driver_summary(df, filter_key):
+    """Podsumowanie kierowców (driver_engine.driver_summary) w cache po stanie filtrów"""
+    def build():
+        with profile_stage('summary') as record:
+            record['frame'] = summary = driver_summary(df)
+        return summary
 
-    if len(gps_data) == 0:
-        return None
+    return cached_frame(('summary',) + filter_key, build)
 
-    # Konwertuj współrzędne na liczby
-    try:
-        gps_data = gps_data.copy()
-        gps_data['GPSX'] = pd.to_numeric(gps_data['GPSX'], errors='coerce')
-        gps_data['GPSY'] = pd.to_numeric(gps_data['GPSY'], errors='coerce')
 
-        # Usuń wiersze z nieprawidłowymi współrzędnymi
-        gps_data = gps_data.dropna(subset=['GPSX', 'GPSY'])
+def show_notice(notices, kind, message):
+    """Komunikat ('info'/'warning') od razu w UI albo - gdy notices to lista - dopisany do
+    niej, żeby wynik z cache pokazał go ponownie (show_notices)"""
+    if notices is None:
+        getattr(st, kind)(message)
+    else:
+        notices.append((kind, message))
 
-        if len(gps_data) == 0:
-            return None
 
-    except Exception as e:
-        st.warning(f"⚠️ Błąd podczas konwersji współrzędnych GPS: {str(e)}")
-        return None
+def show_notices(notices):
+    """Wyświetla komunikaty zebrane przez show_notice"""
+    for kind, message in notices:
+        getattr(st, kind)(message)
 
-    # Sprawdź czy współrzędne wyglądają jak UTM (duże liczby) czy geograficzne (małe liczby)
-    sample_x = gps_data['GPSX'].iloc[0] if len(gps_data) > 0 else 0
-    sample_y = gps_data['GPSY'].iloc[0] if len(gps_data) > 0 else 0
 
-    # Sprawdź czy GPSX to szerokość (latitude) czy długość (longitude)
-    # Jeśli GPSX jest w zakresie 49-55, to prawdopodobnie to jest latitude (szerokość)
-    # Jeśli GPSX jest w zakresie 14-24, to prawdopodobnie to jest longitude (długość)
-    is_gpsx_latitude = (sample_x >= 49 and sample_x <= 55)
-    is_gpsx_longitude = (sample_x >= 14 and sample_x <= 24)
+def prepare_gps_points(df, notices=None):
+    """Zwraca wiersze z prawidłowymi współrzędnymi i kolumnami latitude/longitude albo None"""
+    # Sprawdź czy istnieją kolumny GPS
+    if 'GPSX' not in df.columns or 'GPSY' not in df.columns:
+        return None
 
-    # Jeśli współrzędne są duże (prawdopodobnie UTM), skonwertuj je
-    if abs(sample_x) > 180 or abs(sample_y) > 90:
-        st.info("🔄 Wykryto współrzędne UTM - konwertuję na współrzędne geograficzne...")
+    # Kolumny latitude/longitude liczone przy ładowaniu - brak tylko dla arkuszy wczytanych jako tekst
+    if 'latitude' not in df.columns or 'longitude' not in df.columns:
+        try:
+            df = add_geographic_coordinates(df.copy())
+        except Exception as e:
+            show_notice(notices, 'warning', f"⚠️ Błąd podczas konwersji współrzędnych GPS: {str(e)}")
+            return None
 
-        # Konwersja UTM na geograficzne (przybliżona dla Polski)
-        # Użyj przybliżonej konwersji UTM (bez pyproj dla kompatybilności z Streamlit Cloud)
-        st.info("🔄 Używam przybliżonej konwersji UTM → geograficzne")
+    # Filtruj dane z prawidłowymi współrzędnymi GPS
+    gps_data = df[df['latitude'].notna() & df['longitude'].notna()]
 
-        # Przybliżona konwersja dla Polski (UTM Zone 33N)
-        # To jest przybliżone, ale wystarczające dla większości przypadków w Polsce
-        # Przybliżenie dla Polski
-        gps_data['longitude'] = (gps_data['GPSX'] - 500000) / 111320 + 15.0
-        # Przybliżenie dla Polski
-        gps_data['latitude'] = (gps_data['GPSY'] - 5000000) / 110540 + 52.0
+    if len(gps_data) == 0:
+        return None
 
+    # Sprawdź czy współrzędne są w rozsądnym zakresie dla Polski
+    plausible = in_poland(gps_data['latitude'], gps_data['longitude'])
+
+    if not plausible.any():
+        show_notice(notices, 'warning',
+                    "⚠️ Współrzędne nie wyglądają na polskie - sprawdź format danych")
+        return gps_data
+
+    return gps_data[plausible]
+
+
+# Kolory punktów na mapie według Exception info (pierwsze dopasowanie wygrywa)
+EXCEPTION_COLORS = [('DR RELEASED', 'green'),
+                    ('COMM INS REL', 'blue'),
+                    ('SIG OBTAINED', 'orange')]
+DEFAULT_POINT_COLOR = 'red'
+DECK_COLORS = {'green': [0, 128, 0], 'blue': [0, 0, 255],
+               'orange': [255, 165, 0], 'red': [255, 0, 0]}
+# Kolory kierowców (paleta tab20) - przypisane po kolejności Driver ID w arkuszu
+DRIVER_COLORS = ['#1f77b4', '#aec7e8', '#ff7f0e', '#ffbb78', '#2ca02c',
+                 '#98df8a', '#d62728', '#ff9896', '#9467bd', '#c5b0d5',
+                 '#8c564b', '#c49c94', '#e377c2', '#f7b6d2', '#7f7f7f',
+                 '#c7c7c7', '#bcbd22', '#dbdb8d', '#17becf', '#9edae5']
+# Tryby kolorowania punktów: wartość -> etykieta w UI
+MAP_COLOR_MODES = {'exception': 'Exception info', 'driver': 'Kierowca'}
+# Powyżej tylu punktów mapa pokazuje grupy zamiast pojedynczych punktów
+MAP_MAX_MARKERS = 3000
+
+# Pola popupu: (kolumna, etykieta)
+POPUP_FIELDS = [('Numer', 'Numer monitorowania'),
+                ('Driver ID:', 'Driver ID'),
+                ('DATA', 'Data'),
+                ('City Name', 'Miasto'),
+                ('Exception info', 'Exception info')]
+
+
+def exception_colors(df):
+    """Wektorowo przypisuje kolor punktu na podstawie Exception info"""
+    if 'Exception info' not in df.columns:
+        return np.full(len(df), DEFAULT_POINT_COLOR, dtype=object)
+
+    exception_info = df['Exception info'].astype(str)
+    conditions = [exception_info.str.contains(value, regex=False).to_numpy()
+                  for value, _ in EXCEPTION_COLORS]
+    colors = [color for _, color in EXCEPTION_COLORS]
+    return np.select(conditions, colors, default=DEFAULT_POINT_COLOR).astype(object)
+
+
+def driver_colors(df):
+    """Kolor punktu według kierowcy - stały dla kierowcy niezależnie od filtrów"""
+    driver_ids = df['Driver ID:']
+    if isinstance(driver_ids.dtype, pd.CategoricalDtype):
+        # Kategorie pochodzą z całego arkusza, więc kody nie zmieniają się po filtrowaniu
+        codes = driver_ids.cat.codes.to_numpy()
     else:
-        # Współrzędne już są geograficzne - sprawdź kolejność
-        if is_gpsx_latitude:
-            # GPSX to latitude (szerokość), GPSY to longitude (długość)
-            st.info(
-                "🔍 Wykryto: GPSX = szerokość geograficzna, GPSY = długość geograficzna")
-            gps_data['latitude'] = gps_data['GPSX']
-            gps_data['longitude'] = gps_data['GPSY']
-        elif is_gpsx_longitude:
-            # GPSX to longitude (długość), GPSY to latitude (szerokość)
-            st.info(
-                "🔍 Wykryto: GPSX = długość geograficzna, GPSY = szerokość geograficzna")
-            gps_data['longitude'] = gps_data['GPSX']
-            gps_data['latitude'] = gps_data['GPSY']
+        codes = pd.Categorical(driver_ids, categories=sorted(
+            driver_ids.dropna().unique(), key=str)).codes
+    colors = np.array(DRIVER_COLORS, dtype=object)[codes % len(DRIVER_COLORS)]
+    colors[codes < 0] = DEFAULT_POINT_COLOR
+    return colors
+
+
+def point_colors(df, color_by='exception'):
+    """Kolory punktów według Exception info albo kierowcy"""
+    if color_by == 'driver' and 'Driver ID:' in df.columns:
+        return driver_colors(df)
+    return exception_colors(df)
+
+
+def deck_color(color):
+    """Kolor jako [R, G, B] dla pydeck (nazwa z DECK_COLORS albo #rrggbb)"""
+    if color in DECK_COLORS:
+        return DECK_COLORS[color]
+    return [int(color[i:i + 2], 16) for i in (1, 3, 5)]
+
+
+def map_legend(df, color_by='exception'):
+    """Legenda mapy: lista (etykieta, kolor)"""
+    if color_by == 'driver' and 'Driver ID:' in df.columns:
+        drivers = df.drop_duplicates('Driver ID:').dropna(subset=['Driver ID:'])
+        drivers = drivers.assign(_color=driver_colors(drivers))
+        labels = drivers['Driver ID:'].astype(str).map(extract_driver_name)
+        return sorted(zip(labels, drivers['_color']))
+    return [(value, color) for value, color in EXCEPTION_COLORS] + [('Inne', DEFAULT_POINT_COLOR)]
+
+
+def gps_point_properties(gps_data, color_by='exception'):
+    """Właściwości punktów (tekst popupu + kolor) jako ramka stringów"""
+    properties = pd.DataFrame(index=gps_data.index)
+    for col, _ in POPUP_FIELDS:
+        if col in gps_data.columns:
+            properties[col] = gps_data[col].astype(str)
         else:
-            # Nie można określić - użyj domyślnej kolejności
-            st.warning(
-                "⚠️ Nie można określić kolejności współrzędnych - używam domyślnej kolejności")
-            gps_data['longitude'] = gps_data['GPSX']
-            gps_data['latitude'] = gps_data['GPSY']
-
-    # Sprawdź czy współrzędne są w rozsądnym zakresie dla Polski
-    valid_coords = gps_data[
-        (gps_data['longitude'] >= 14) & (gps_data['longitude'] <= 24) &
-        (gps_data['latitude'] >= 49) & (gps_data['latitude'] <= 55)
-    ]
-
-    if len(valid_coords) == 0:
-        st.warning(
-            "⚠️ Współrzędne nie wyglądają na polskie - sprawdź format danych")
-        # Użyj oryginalnych współrzędnych jako fallback
-        gps_data['longitude'] = gps_data['GPSX']
-        gps_data['latitude'] = gps_data['GPSY']
+            properties[col] = 'Brak'
+    properties['coordinates'] = (gps_data['latitude'].map('{:.6f}'.format) + ', ' +
+                                 gps_data['longitude'].map('{:.6f}'.format))
+    properties['color'] = point_colors(gps_data, color_by)
+    return properties
+
+
+def clustered_point_properties(gps_data, max_markers, color_by='exception'):
+    """Punkty zgrupowane w siatce (najwyżej max_markers znaczników) jako ramka właściwości.
+
+    Znacznik grupy leży w środku ciężkości jej punktów, ma najczęstszy kolor w grupie
+    i liczbę punktów; grupy jednoelementowe zachowują pełny popup.
+    """
+    labels, counts, cluster_latitude, cluster_longitude = cluster_points_within(
+        gps_data['latitude'].to_numpy(), gps_data['longitude'].to_numpy(), max_markers)[1]
+
+    # Najczęstszy kolor w grupie
+    color_codes, color_names = pd.factorize(point_colors(gps_data, color_by))
+    color_counts = np.zeros((len(counts), len(color_names)), dtype=np.int64)
+    np.add.at(color_counts, (labels, color_codes), 1)
+
+    # Pierwszy punkt każdej grupy - źródło popupu dla grup jednoelementowych
+    order = np.argsort(labels, kind='stable')
+    first_rows = order[np.concatenate(([0], np.cumsum(counts)[:-1]))]
+
+    properties = gps_point_properties(
+        gps_data.iloc[first_rows], color_by).reset_index(drop=True)
+    grouped = counts > 1
+    properties.loc[grouped, [col for col, _ in POPUP_FIELDS]] = '—'
+    properties['latitude'] = cluster_latitude
+    properties['longitude'] = cluster_longitude
+    properties.loc[grouped, 'coordinates'] = (
+        properties.loc[grouped, 'latitude'].map('{:.6f}'.format) + ', ' +
+        properties.loc[grouped, 'longitude'].map('{:.6f}'.format))
+    properties['color'] = np.array(color_names, dtype=object)[color_counts.argmax(axis=1)]
+    properties['count'] = counts
+    return properties
+
+
+def marker_radius(counts):
+    """Promień znacznika w pikselach - rośnie logarytmicznie z liczbą punktów w grupie"""
+    return np.minimum(6 + 3 * np.log2(counts), 24).round(1)
+
+
+def create_gps_map(df, backend='folium', full_resolution=False, max_markers=MAP_MAX_MARKERS,
+                   color_by='exception', notices=None):
+    """Tworzy mapę z punktami GPS na podstawie kolumn GPSX i GPSY.
+
+    Wszystkie punkty trafiają do jednej warstwy (GeoJSON dla folium, ScatterplotLayer
+    dla pydeck), a popupy budowane są dopiero po kliknięciu z właściwości punktu.
+    Powyżej max_markers punkty są grupowane po stronie serwera w siatce, chyba że
+    full_resolution=True. Kolor punktów według color_by ('exception' albo 'driver').
+    Komunikaty (grupowanie, błędne współrzędne) trafiają do listy notices, jeśli podano.
+    Zwraca (mapa, liczba znaczników) albo (None, 0), gdy brak danych GPS.
+    """
+    gps_data = prepare_gps_points(df, notices)
+    if gps_data is None:
+        return None, 0
+
+    clustered = not full_resolution and len(gps_data) > max_markers
+    if clustered:
+        properties = clustered_point_properties(gps_data, max_markers, color_by)
+        show_notice(notices, 'info',
+                    f"🗺️ {len(gps_data)} punktów zgrupowano w {len(properties)} znacznikach "
+                    "(liczba punktów w popupie grupy)")
     else:
-        gps_data = valid_coords
+        properties = gps_point_properties(gps_data, color_by).reset_index(drop=True)
+        properties['latitude'] = gps_data['latitude'].to_numpy()
+        properties['longitude'] = gps_data['longitude'].to_numpy()
+        properties['count'] = 1
+    properties['radius'] = marker_radius(properties['count'].to_numpy())
 
     # Oblicz centrum mapy
     center_lat = gps_data['latitude'].mean()
     center_lon = gps_data['longitude'].mean()
 
-    # Utwórz mapę
+    if backend == 'pydeck':
+        points = properties.rename(columns={'Driver ID:': 'driver_id', 'City Name': 'city',
+                                            'Exception info': 'exception_info'})
+        points['rgb'] = properties['color'].map(deck_color)
+
+        layer = pdk.Layer(
+            'ScatterplotLayer',
+            data=points,
+            get_position=['longitude', 'latitude'],
+            get_fill_color='rgb',
+            get_line_color=[0, 0, 0],
+            get_radius='radius',
+            radius_units='pixels',
+            stroked=True,
+            line_width_min_pixels=1,
+            opacity=0.7,
+            pickable=True
+        )
+        return pdk.Deck(
+            layers=[layer],
+            initial_view_state=pdk.ViewState(
+                latitude=center_lat, longitude=center_lon, zoom=10),
+            tooltip={'html': '<b>Numer monitorowania:</b> {Numer}<br>'
+                             '<b>Driver ID:</b> {driver_id}<br>'
+                             '<b>Data:</b> {DATA}<br>'
+                             '<b>Miasto:</b> {city}<br>'
+                             '<b>Exception info:</b> {exception_info}<br>'
+                             '<b>Współrzędne:</b> {coordinates}' +
+                             ('<br><b>Liczba punktów:</b> {count}' if clustered else '')}
+        ), len(properties)
+
+    # Utwórz mapę (canvas zamiast SVG - tysiące punktów bez zacinania przeglądarki)
     m = folium.Map(
         location=[center_lat, center_lon],
         zoom_start=10,
-        tiles='OpenStreetMap'
+        tiles='OpenStreetMap',
+        prefer_canvas=True
     )
 
-    # Dodaj punkty na mapę
-    for idx, row in gps_data.iterrows():
-        # Przygotuj popup z informacjami
-        popup_text = f"""
-        <b>Numer monitorowania:</b> {row.get('Numer', 'Brak')}<br>
-        <b>Driver ID:</b> {row.get('Driver ID:', 'Brak')}<br>
-        <b>Data:</b> {row.get('DATA', 'Brak')}<br>
-        <b>Miasto:</b> {row.get('City Name', 'Brak')}<br>
-        <b>Exception info:</b> {row.get('Exception info', 'Brak')}<br>
-        <b>Współrzędne:</b> {row['latitude']:.6f}, {row['longitude']:.6f}
-        """
-
-        # Kolor punktu na podstawie Exception info
-        color = 'red'  # domyślnie czerwony
-        if 'Exception info' in row and pd.notna(row['Exception info']):
-            if 'DR RELEASED' in str(row['Exception info']):
-                color = 'green'
-            elif 'COMM INS REL' in str(row['Exception info']):
-                color = 'blue'
-            elif 'SIG OBTAINED' in str(row['Exception info']):
-                color = 'orange'
-
-        # Dodaj marker
-        folium.CircleMarker(
-            location=[row['latitude'], row['longitude']],
-            radius=6,
-            popup=folium.Popup(popup_text, max_width=300),
-            color='black',
-            weight=1,
-            fillColor=color,
-            fillOpacity=0.7
-        ).add_to(m)
-
-    return m
+    popup_fields = [col for col, _ in POPUP_FIELDS] + ['coordinates']
+    popup_aliases = [f"{label}:" for _, label in POPUP_FIELDS] + ['Współrzędne:']
+    property_columns = popup_fields + ['color', 'radius']
+    if clustered:
+        popup_fields.append('count')
+        popup_aliases.append('Liczba punktów:')
+        property_columns.append('count')
+
+    # Wszystkie punkty jako jedna kolekcja GeoJSON
+    features = [
+        {'type': 'Feature',
+         'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+         'properties': point_properties}
+        for lon, lat, point_properties in zip(properties['longitude'].tolist(),
+                                              properties['latitude'].tolist(),
+                                              properties[property_columns].to_dict('records'))
+    ]
+
+    folium.GeoJson(
+        {'type': 'FeatureCollection', 'features': features},
+        marker=folium.CircleMarker(
+            radius=6, color='black', weight=1, fillOpacity=0.7),
+        # Kolor i promień z właściwości punktu ustawiane w przeglądarce (bez stylu per punkt w HTML)
+        on_each_feature=folium.JsCode(
+            'function(feature, layer) {'
+            ' layer.setStyle({fillColor: feature.properties.color});'
+            ' layer.setRadius(feature.properties.radius); }'),
+        popup=folium.GeoJsonPopup(
+            fields=popup_fields,
+            aliases=popup_aliases,
+            max_width=300
+        )
+    ).add_to(m)
+
+    return m, len(properties)
+
+
+def show_gps_map(gps_map, width, height):
+    """Wyświetla mapę zbudowaną przez create_gps_map (folium lub pydeck)"""
+    if isinstance(gps_map, pdk.Deck):
+        st.pydeck_chart(gps_map, width=width, height=height)
+    else:
+        # Bez zwracania stanu mapy - przesunięcie/zoom nie przeładowuje całej strony
+        st_folium(gps_map, width=width, height=height, returned_objects=[])
+
+
+# Przybliżona pamięć jednego znacznika mapy w Pythonie (cecha GeoJSON folium albo rekord
+# warstwy pydeck z właściwościami popupu) - zmierzone tracemalloc: ~1.1 kB i ~0.85 kB.
+# Rozmiar mapy w cache to liczba znaczników z create_gps_map razy ta wartość
+MAP_POINT_BYTES = 1024
+
+
+@st.fragment
+def render_fleet_map(df, filter_state):
+    """Mapa wszystkich przefiltrowanych doręczeń, budowana raz na stan filtrów (fragment)"""
+    col1, col2 = st.columns([2, 1])
+    with col1:
+        color_by = st.radio(
+            "Kolor punktów:",
+            list(MAP_COLOR_MODES),
+            format_func=MAP_COLOR_MODES.get,
+            horizontal=True,
+            key='fleet_map_color_by'
+        )
+    with col2:
+        full_resolution = st.checkbox(
+            "🔎 Pełna rozdzielczość (wszystkie punkty)",
+            value=False,
+            key='fleet_map_full_resolution',
+            help=f"Powyżej {MAP_MAX_MARKERS} punktów mapa pokazuje grupy punktów z ich liczbą"
+        )
+
+    # Mapa w cache procesu (wspólna dla sesji z tym samym plikiem i filtrami, z budżetem
+    # pamięci) razem z komunikatami budowania - pokazywanymi także przy trafieniu w cache.
+    # W krotce, bo brak danych GPS (None) też jest wynikiem do zapamiętania
+    map_key = ('map',) + tuple(filter_state.items()) + (color_by, full_resolution)
+
+    def build_map():
+        notices = []
+        with st.spinner("🗺️ Ładowanie mapy floty..."), profile_stage('map'):
+            gps_map, markers = create_gps_map(df, full_resolution=full_resolution,
+                                              color_by=color_by, notices=notices)
+        return gps_map, notices, markers
+
+    fleet_map, notices, _ = CACHE.get(
+        map_key, build_map, size=lambda cached: cached[2] * MAP_POINT_BYTES)
+    show_notices(notices)
+    if fleet_map is None:
+        st.warning("⚠️ Brak danych GPS w przefiltrowanych danych")
+        return
+
+    st.markdown(
+        " ".join(f"<span style='color:{color}'>●</span> {label}"
+                 for label, color in map_legend(df, color_by)),
+        unsafe_allow_html=True)
+    show_gps_map(fleet_map, width=1200, height=600)
+
+
+def uploaded_file_hash(file):
+    """Hash zawartości wgranego pliku, liczony raz na plik (file_id) w sesji, nie przy
+    każdym przeładowaniu strony"""
+    hashes = st.session_state.setdefault('file_hashes', {})
+    if file.file_id not in hashes:
+        hashes[file.file_id] = file_content_hash(file)
+    return hashes[file.file_id]
 
 
 # Funkcja do ładowania pliku Excel
-@st.cache_data
-def load_excel_file(file):
-    """Ładuje plik Excel i zwraca słownik z arkuszami"""
+def load_excel_file(file, file_hash=None, columns=None, engine='auto'):
+    """Ładuje plik Excel jednym przebiegiem - pierwszy arkusz od razu, pozostałe na żądanie"""
     try:
-        # Sprawdź rozszerzenie pliku
-        file_extension = file.name.split('.')[-1].lower()
-
-        if file_extension == 'xlsb':
-            # Obsługa plików .xlsb
-            sheets_dict = {}
-            with pyxlsb.open_workbook(file) as wb:
-                for sheet_name in wb.sheets:
-                    try:
-                        dataframe = pd.read_excel(
-                            file, sheet_name=sheet_name, engine='pyxlsb')
-                        # Napraw problematyczne kolumny
-                        dataframe = fix_problematic_columns(dataframe)
-                        sheets_dict[sheet_name] = dataframe
-                    except Exception as e:
-                        st.warning(
-                            f"⚠️ Problem z arkuszem {sheet_name}: {str(e)}")
-                        # Spróbuj załadować z domyślnymi ustawieniami
-                        try:
-                            dataframe = pd.read_excel(
-                                file, sheet_name=sheet_name, engine='pyxlsb', dtype=str)
-                            sheets_dict[sheet_name] = dataframe
-                        except Exception:
-                            st.error(
-                                f"❌ Nie udało się załadować arkusza {sheet_name}")
-            return sheets_dict
-        else:
-            # Obsługa plików .xlsx i .xls
-            excel_file = pd.ExcelFile(file)
-            sheets_dict = {}
+        if file_hash is None:
+            file_hash = uploaded_file_hash(file)
+        workbook = open_workbook(file.getvalue(), file.name, file_hash=file_hash,
+                                 on_warning=st.warning, on_error=st.error, columns=columns,
+                                 engine=engine)
 
-            for sheet_name in excel_file.sheet_names:
-                try:
-                    dataframe = pd.read_excel(file, sheet_name=sheet_name)
-                    # Napraw problematyczne kolumny
-                    dataframe = fix_problematic_columns(dataframe)
-                    sheets_dict[sheet_name] = dataframe
-                except Exception as e:
-                    st.warning(f"⚠️ Problem z arkuszem {sheet_name}: {str(e)}")
-                    # Spróbuj załadować z domyślnymi ustawieniami
-                    try:
-                        dataframe = pd.read_excel(
-                            file, sheet_name=sheet_name, dtype=str)
-                        sheets_dict[sheet_name] = dataframe
-                    except Exception:
-                        st.error(
-                            f"❌ Nie udało się załadować arkusza {sheet_name}")
-
-            return sheets_dict
+        # Indeks numerów przesyłek dla wyszukiwania śladu (pierwszy wczytany arkusz)
+        if len(workbook) > 0:
+            workbook.tracking_index(next(iter(workbook)))
+
+        return workbook
+    except (ValueError, FileNotFoundError, PermissionError) as e:
+        st.error(f"Błąd podczas ładowania pliku: {str(e)}")
+        return None
+
+
+def load_excel_files(files, file_hashes, columns=None, engine='auto'):
+    """Ładuje równolegle wiele plików Excel i łączy ich pierwsze arkusze w jeden zbiór"""
+    try:
+        workbook = open_merged_workbook(
+            [(file.getvalue(), file.name, file_hash)
+             for file, file_hash in zip(files, file_hashes)],
+            on_warning=st.warning, on_error=st.error, columns=columns, engine=engine)
+
+        # Indeks numerów przesyłek dla wyszukiwania śladu
+        if workbook is not None:
+            workbook.tracking_index(next(iter(workbook)))
+
+        return workbook
+    except (ValueError, FileNotFoundError, PermissionError) as e:
+        st.error(f"Błąd podczas ładowania plików: {str(e)}")
+        return None
+
+
+def load_streamed_file(file, file_hash, columns=None):
+    """Ładuje plik strumieniowo do Parquet (albo bierze gotowy zbiór z cache) - w pamięci
+    zostają tylko metadane, dane wczytuje dopiero skan z filtrami"""
+    try:
+        dataset = open_streamed_workbook(file.getvalue(), file.name, file_hash=file_hash,
+                                         columns=columns)
+        # Indeks numerów przesyłek z samej kolumny 'Numer'
+        dataset.tracking_index(dataset.sheet_name)
+        return dataset
     except (ValueError, FileNotFoundError, PermissionError) as e:
         st.error(f"Błąd podczas ładowania pliku: {str(e)}")
         return None
 
 
+def scan_streamed_dataset(dataset, filter_key, stages):
+    """Przefiltrowane wiersze zbioru strumieniowego, cache'owane po stanie filtrów"""
+    def build():
+        with profile_stage('stream_scan') as record:
+            record['frame'] = df = dataset.scan(stages)
+        return df
+
+    return cached_frame(('stream_scan',) + filter_key, build)
+
+
+def render_stream_filters(dataset, filter_state):
+    """Filtry w pasku bocznym z metadanych zbioru strumieniowego i jeden skan z ich wynikiem.
+
+    Zwraca (przefiltrowana ramka, wybrany kierowca - skrócona nazwa albo 'Wszyscy').
+    """
+    stages = []
+
+    st.sidebar.markdown("---")
+    st.sidebar.header("📅 Wybór dat")
+    if dataset.date_column is not None and dataset.min_date is not None:
+        date_options = ["Wszystkie daty", "Tylko soboty", "Niestandardowy wybór"]
+        date_option = st.sidebar.radio(
+            "Wybierz opcję dat:", date_options,
+            index=date_options.index(st.session_state.get('date_option', date_options[0])),
+            help="Wybór zostanie zapamiętany")
+        st.session_state.date_option = date_option
+        if date_option == "Tylko soboty":
+            stages.append(('date', (dataset.date_column, date_option, None)))
+        elif date_option == "Niestandardowy wybór":
+            selected_dates = st.sidebar.date_input(
+                "Wybierz daty:", value=(dataset.min_date, dataset.max_date),
+                min_value=dataset.min_date, max_value=dataset.max_date,
+                help="Możesz wybrać pojedynczy dzień lub zakres dat")
+            stages.append(('date', (dataset.date_column, date_option, selected_dates)))
+    else:
+        st.sidebar.warning("⚠️ Nie znaleziono kolumny z datami")
+
+    selected_driver = 'Wszyscy'
+    if 'Driver ID:' in dataset.columns:
+        st.sidebar.markdown("---")
+        st.sidebar.header("🚗 Wybór Driver ID")
+        # Lista kierowców z całego pliku (bez wczytywania danych)
+        driver_mapping = {extract_driver_name(driver_id): driver_id
+                          for driver_id in dataset.drivers}
+        driver_options = ['Wszyscy'] + sorted(driver_mapping)
+        if st.session_state.get('selected_driver') not in driver_options:
+            st.session_state.selected_driver = 'Wszyscy'
+        selected_driver = st.sidebar.selectbox(
+            "Wybierz Driver ID:", options=driver_options,
+            index=driver_options.index(st.session_state.selected_driver),
+            help="Wybór zostanie zapamiętany")
+        st.session_state.selected_driver = selected_driver
+        if selected_driver != 'Wszyscy':
+            stages.append(('driver', driver_mapping[selected_driver]))
+
+    available_exceptions = [exc for exc in DEFAULT_EXCEPTIONS if exc in dataset.exceptions]
+    if available_exceptions:
+        st.sidebar.markdown("---")
+        st.sidebar.header("⚠️ Exception info")
+        selected_exceptions = st.sidebar.multiselect(
+            "Wybierz wartości Exception info:", options=available_exceptions,
+            default=available_exceptions,
+            help="Wszystkie wartości są domyślnie zaznaczone. Możesz odznaczyć niektóre.")
+        st.session_state.selected_exceptions = selected_exceptions
+        if selected_exceptions:
+            stages.append(('exceptions', tuple(selected_exceptions)))
+
+    for stage, params in stages:
+        filter_state[stage] = params
+    with st.spinner("Wczytywanie przefiltrowanych wierszy..."):
+        df = scan_streamed_dataset(dataset, tuple(filter_state.items()), tuple(stages))
+    st.info(f"🌊 Tryb strumieniowy: wczytano {len(df)} z {dataset.rows} wierszy")
+    return df, selected_driver
+
+
+def combined_hash(file_hashes):
+    """Klucz zestawu plików - hash pojedynczego pliku albo hash listy hashy"""
+    if len(file_hashes) == 1:
+        return file_hashes[0]
+    return hashlib.sha256('|'.join(file_hashes).encode('utf-8')).hexdigest()
+
+
+def load_summary_message(sheets_data, from_cache):
+    """Komunikat po załadowaniu pliku lub połączeniu wielu plików"""
+    how = "z cache" if from_cache else "pomyślnie"
+    if isinstance(sheets_data, StreamedDataset):
+        return (f"✅ Plik załadowany strumieniowo {how}! {sheets_data.rows} wierszy "
+                f"w arkuszu {sheets_data.sheet_name}.")
+    if isinstance(sheets_data, MergedWorkbook):
+        rows = len(sheets_data[MERGED_SHEET_NAME])
+        return (f"✅ Pliki połączone {how}! {len(sheets_data.file_names)} plików, {rows} wierszy, "
+                f"usunięto {sheets_data.duplicates} powtórzonych wierszy.")
+    return f"✅ Plik załadowany {how}! Znaleziono {len(sheets_data)} arkuszy."
+
+
+# Eksport - pliki budowane strumieniowo na dysku, raz na stan filtrów
+# W katalogu wersji cache - po aktualizacji stare eksporty (inny format) nie są podawane
+EXPORT_DIR = os.path.join(CACHE_DIR, f'v{CACHE_VERSION}', EXPORT_DIR_NAME)
+# format: (etykieta, rozszerzenie, typ MIME)
+EXPORT_FORMATS = {
+    'csv': ('CSV', 'csv', 'text/csv'),
+    'xlsx': ('Excel', 'xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'parquet': ('Parquet', 'parquet', 'application/vnd.apache.parquet'),
+}
+
+
+def export_file_path(export_key, export_format):
+    """Ścieżka pliku eksportu dla danego stanu filtrów i formatu"""
+    key_hash = hashlib.sha256(repr(export_key).encode('utf-8')).hexdigest()
+    return os.path.join(EXPORT_DIR, f"{key_hash}.{EXPORT_FORMATS[export_format][1]}")
+
+
+def prepare_export(df, export_key, export_format, sheet_name):
+    """Buduje plik eksportu na dysku (tylko raz dla danego klucza) i zwraca jego ścieżkę"""
+    path = export_file_path(export_key, export_format)
+
+    def build():
+        if os.path.exists(path):
+            return path
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        tmp_path = temporary_path(path)
+        try:
+            with profile_stage(f'export:{export_format}'):
+                write_export(df, tmp_path, export_format, sheet_name)
+            os.replace(tmp_path, path)
+        finally:
+            remove_file(tmp_path)
+        return path
+
+    # Blokada klucza w EXPORT_FILES - równoczesne żądania tego samego eksportu (inne sesje)
+    # czekają na jeden zapis. Plik liczony do budżetu eksportów, usuwany z dysku po wypadnięciu
+    return EXPORT_FILES.get(path, build, size=os.path.getsize, on_evict=remove_file)
+
+
+def cached_export_path(export_key, export_format):
+    """Ścieżka gotowego pliku eksportu albo None.
+
+    Plik z poprzedniego uruchomienia serwera (jeszcze nie w EXPORT_FILES) jest dopisywany
+    do cache przy pierwszym użyciu, więc też podlega budżetowi.
+    """
+    path = export_file_path(export_key, export_format)
+    return EXPORT_FILES.get(path, lambda: path if os.path.exists(path) else None,
+                            size=os.path.getsize, on_evict=remove_file)
+
+
+def render_export_buttons(df, export_key, label, file_prefix, sheet_name, horizontal=True):
+    """Przyciski eksportu: plik przygotowany raz na stan filtrów, potem od razu do pobrania"""
+    containers = st.columns(len(EXPORT_FORMATS)) if horizontal else [
+        st.container() for _ in EXPORT_FORMATS]
+
+    for container, (export_format, (format_label, extension, mime)) in zip(
+            containers, EXPORT_FORMATS.items()):
+        with container:
+            path = cached_export_path(export_key, export_format)
+            if path is None:
+                if not st.button(f"📥 Pobierz {label} ({format_label})",
+                                 key=f"export_{file_prefix}_{export_format}"):
+                    continue
+                try:
+                    with st.spinner("Przygotowywanie pliku..."):
+                        path = prepare_export(
+                            df, export_key, export_format, sheet_name)
+                except Exception as e:
+                    st.error(f"❌ Błąd podczas eksportu: {str(e)}")
+                    continue
+
+            try:
+                f = open(path, 'rb')
+            except FileNotFoundError:
+                # Plik usunięty z cache eksportów przez inną sesję - do przygotowania od nowa
+                EXPORT_FILES.discard(path)
+                st.rerun()
+            with f:
+                st.download_button(
+                    label=f"📥 Pobierz {format_label}",
+                    data=f,
+                    file_name=f"{file_prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}",
+                    mime=mime,
+                    # Pobranie nie przeładowuje strony
+                    on_click='ignore',
+                    key=f"download_{file_prefix}_{export_format}"
+                )
+
+
+# Tabela stronicowana - do przeglądarki trafia tylko bieżąca strona
+PAGE_SIZES = [50, 100, 500, 1000]
+NO_SORT = "(bez sortowania)"
+
+
+def column_contains(values, text):
+    """Maska wierszy, w których wartość kolumny zawiera text (bez rozróżniania wielkości liter)"""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # Dopasowanie tylko na kategoriach, potem wybór po kodach
+        matches = pd.Series(values.cat.categories.astype(str)).str.contains(
+            text, case=False, regex=False).to_numpy()
+        codes = values.cat.codes.to_numpy()
+        return np.where(codes >= 0, np.append(matches, False)[codes], False)
+    return values.astype(str).str.contains(text, case=False, regex=False).to_numpy()
+
+
+def table_view_positions(df, view_key, filter_column, filter_text, sort_column, ascending):
+    """Pozycje wierszy po filtrze kolumny i sortowaniu (z CACHE po stanie widoku, do odczytu)"""
+    def build():
+        positions = np.arange(len(df))
+        if filter_column and filter_text:
+            positions = positions[column_contains(df[filter_column], filter_text)]
+
+        if sort_column:
+            values = df[sort_column].iloc[positions].reset_index(drop=True)
+            try:
+                order = values.sort_values(ascending=ascending, kind='stable',
+                                           na_position='last').index.to_numpy()
+            except TypeError:
+                # Kolumna z mieszanymi typami - sortuj jako tekst
+                order = values.astype(str).sort_values(ascending=ascending,
+                                                       kind='stable').index.to_numpy()
+            positions = positions[order]
+        positions.flags.writeable = False
+        return positions
+
+    key = ('table',) + view_key + (filter_column, filter_text, sort_column, ascending)
+    return CACHE.get(key, build)
+
+
+@st.fragment
+def render_paged_table(df, view_key, key):
+    """Tabela ze stronicowaniem, sortowaniem i filtrem po stronie serwera.
+
+    Pełna tabela (cała ramka w przeglądarce) tylko po zaznaczeniu opcji.
+    Fragment - zmiana strony nie przelicza podsumowania nad tabelą.
+    """
+    columns = visible_columns(df)
+    if st.checkbox("📜 Pełna tabela (wszystkie wiersze naraz - wolne dla dużych danych)",
+                   value=False, key=f"{key}_full"):
+        st.dataframe(df, use_container_width=True, column_order=columns)
+        return
+
+    col1, col2, col3, col4 = st.columns([2, 2, 2, 1])
+    with col1:
+        filter_column = st.selectbox("Filtruj kolumnę:", columns, key=f"{key}_filter_column")
+    with col2:
+        filter_text = st.text_input("Zawiera:", key=f"{key}_filter_text").strip()
+    with col3:
+        sort_column = st.selectbox("Sortuj według:", [NO_SORT] + columns,
+                                   key=f"{key}_sort_column")
+    with col4:
+        ascending = st.radio("Kolejność:", ["Rosnąco", "Malejąco"],
+                             key=f"{key}_order") == "Rosnąco"
+
+    positions = table_view_positions(
+        df, view_key, filter_column, filter_text,
+        None if sort_column == NO_SORT else sort_column, ascending)
+
+    col1, col2 = st.columns([1, 3])
+    with col1:
+        page_size = st.selectbox("Wierszy na stronę:", PAGE_SIZES, key=f"{key}_page_size")
+    page_count = max(1, -(-len(positions) // page_size))
+    # Po zmianie filtrów zapamiętana strona może już nie istnieć
+    page_key = f"{key}_page"
+    if st.session_state.get(page_key, 1) > page_count:
+        st.session_state[page_key] = page_count
+    with col2:
+        page = st.number_input(f"Strona (z {page_count}):", min_value=1, max_value=page_count,
+                               step=1, key=page_key)
+
+    start = (page - 1) * page_size
+    page_df = df.iloc[positions[start:start + page_size]]
+    st.dataframe(page_df, use_container_width=True, column_order=columns)
+    st.caption(f"Wiersze {min(start + 1, len(positions))}–{start + len(page_df)} "
+               f"z {len(positions)} (wszystkich: {len(df)})")
+
+
+# Widoki strony - wykonywany jest tylko wybrany
+VIEWS = ["📊 Dane", "🗺️ Mapa floty", "🔍 Wyszukiwanie śladu"]
+
+
+@st.fragment
+def render_trace_view(df, sheets_data, sheet_name, filter_state):
+    """Wyszukiwanie śladu GPS - fragment, więc wpisanie numeru nie przelicza reszty strony"""
+    st.header("🔍 Wyszukiwanie śladu GPS")
+
+    if 'Numer' in df.columns and 'GPSX' in df.columns and 'GPSY' in df.columns:
+        search_mode = st.radio(
+            "Tryb wyszukiwania:",
+            ["Pojedynczy numer", "Lista numerów"],
+            horizontal=True,
+            help="Lista numerów - wklejona lista lub plik CSV, wyszukiwana jednym złączeniem"
+        )
+
+        if search_mode == "Lista numerów":
+            tracking_number = None
+
+            # Lista numerów wklejona lub z pliku CSV
+            numbers_text = st.text_area(
+                "Wklej numery przesyłek:",
+                placeholder="Jeden numer w linii (lub oddzielone przecinkami/średnikami)",
+                height=150
+            )
+            numbers_file = st.file_uploader(
+                "...lub wybierz plik CSV z numerami",
+                type=['csv', 'txt'],
+                help="Kolumna 'Numer' lub pierwsza kolumna pliku"
+            )
+
+            try:
+                batch_numbers = parse_tracking_numbers(
+                    numbers_text, numbers_file)
+            except Exception as e:
+                st.error(
+                    f"❌ Błąd podczas czytania listy numerów: {str(e)}")
+                batch_numbers = []
+
+            if batch_numbers:
+                # Wszystkie numery jednym złączeniem z indeksem arkusza
+                tracking_index = sheets_data.tracking_index(
+                    sheet_name)
+                batch_rows, in_workbook = tracking_index.find_many(
+                    batch_numbers)
+                batch_data = df.loc[df.index.intersection(
+                    batch_rows)]
+
+                # Które numery są w przefiltrowanych danych
+                found_keys = set(
+                    batch_data['Numer'].astype(str).str.strip().str.lower())
+                in_filtered = np.array([number.lower() in found_keys
+                                        for number in batch_numbers], dtype=bool)
+                missing_numbers = [number for number, found in zip(
+                    batch_numbers, in_workbook) if not found]
+                filtered_out_numbers = [number for number, found, visible in zip(
+                    batch_numbers, in_workbook, in_filtered) if found and not visible]
+
+                col1, col2, col3, col4 = st.columns(4)
+                col1.metric("Numery na liście", len(batch_numbers))
+                col2.metric("Znalezione", int(in_filtered.sum()))
+                col3.metric("Brak w pliku", len(missing_numbers))
+                col4.metric("Poza filtrami", len(
+                    filtered_out_numbers))
+
+                if missing_numbers:
+                    with st.expander(f"❌ Numery nieznalezione w pliku ({len(missing_numbers)})"):
+                        st.dataframe(pd.DataFrame({'Numer': missing_numbers}),
+                                     use_container_width=True)
+                if filtered_out_numbers:
+                    with st.expander(f"⚠️ Numery wykluczone przez filtry ({len(filtered_out_numbers)})"):
+                        st.dataframe(pd.DataFrame({'Numer': filtered_out_numbers}),
+                                     use_container_width=True)
+
+                if len(batch_data) > 0:
+                    st.subheader("🗺️ Mapa śladów")
+                    full_resolution = st.checkbox(
+                        "🔎 Pełna rozdzielczość (wszystkie punkty)",
+                        value=False,
+                        help=f"Powyżej {MAP_MAX_MARKERS} punktów mapa pokazuje grupy punktów z ich liczbą"
+                    )
+                    with st.spinner("🗺️ Ładowanie mapy śladów GPS..."):
+                        batch_map, _ = create_gps_map(
+                            batch_data, full_resolution=full_resolution)
+                        if batch_map:
+                            show_gps_map(
+                                batch_map, width=1000, height=500)
+                        else:
+                            st.warning(
+                                "⚠️ Brak danych GPS dla znalezionych numerów")
+
+                    st.subheader("📋 Dane śladów")
+                    st.dataframe(
+                        batch_data, use_container_width=True,
+                        column_order=visible_columns(batch_data))
+
+                    # Eksport śladów
+                    st.subheader("💾 Eksport śladów")
+                    render_export_buttons(
+                        batch_data,
+                        tuple(filter_state.items()) +
+                        ('batch', tuple(batch_numbers)),
+                        "ślady", "slady", "Slady")
+                else:
+                    st.error(
+                        "❌ Żaden numer z listy nie występuje w przefiltrowanych danych")
+        else:
+            # Pole do wklejenia numeru przesyłki
+            tracking_number = st.text_input(
+                "Wklej numer przesyłki:",
+                placeholder="Wprowadź numer przesyłki...",
+                help="Wklej numer przesyłki z kolumny 'Numer' aby znaleźć ślad GPS"
+            )
+
+        if tracking_number:
+            # Wyszukaj dane dla danego numeru przesyłki w indeksie arkusza
+            tracking_index = sheets_data.tracking_index(
+                sheet_name)
+            tracking_rows = tracking_index.find(tracking_number)
+            tracking_data = df.loc[df.index.intersection(
+                tracking_rows)]
+
+            if len(tracking_data) > 0:
+                st.success(
+                    f"✅ Znaleziono {len(tracking_data)} rekordów dla numeru: {tracking_number}")
+
+                # Sprawdź czy są dane GPS
+                gps_tracking_data = tracking_data[(tracking_data['GPSX'].notna()) &
+                                                  (tracking_data['GPSY'].notna()) &
+                                                  (tracking_data['GPSX'] != '') &
+                                                  (tracking_data['GPSY'] != '')]
+
+                if len(gps_tracking_data) > 0:
+                    # Wyświetl informacje o śladzie
+                    col1, col2 = st.columns(2)
+
+                    with col1:
+                        st.subheader("📊 Informacje o śladzie")
+                        st.metric("Liczba punktów GPS",
+                                  len(gps_tracking_data))
+
+                        # Wyświetl szczegóły pierwszego rekordu
+                        if len(gps_tracking_data) > 0:
+                            first_record = gps_tracking_data.iloc[0]
+                            st.write(
+                                f"**Driver ID:** {first_record.get('Driver ID:', 'Brak')}")
+                            st.write(
+                                f"**Data:** {first_record.get('DATA', 'Brak')}")
+                            st.write(
+                                f"**Miasto:** {first_record.get('City Name', 'Brak')}")
+                            st.write(
+                                f"**Exception info:** {first_record.get('Exception info', 'Brak')}")
+
+                            # Wyświetl informacje o współrzędnych
+                            st.write(
+                                f"**Współrzędne X:** {first_record.get('GPSX', 'Brak')}")
+                            st.write(
+                                f"**Współrzędne Y:** {first_record.get('GPSY', 'Brak')}")
+
+                            # Sprawdź format współrzędnych
+                            gps_x = first_record.get('GPSX', 0)
+                            gps_y = first_record.get('GPSY', 0)
+                            try:
+                                gps_x_num = float(gps_x)
+                                gps_y_num = float(gps_y)
+                                if abs(gps_x_num) > 180 or abs(gps_y_num) > 90:
+                                    st.info(
+                                        "🔍 Format UTM - będzie konwertowane na współrzędne geograficzne")
+                                else:
+                                    # Sprawdź kolejność współrzędnych
+                                    is_gpsx_lat = (
+                                        gps_x_num >= 49 and gps_x_num <= 55)
+                                    is_gpsx_lon = (
+                                        gps_x_num >= 14 and gps_x_num <= 24)
+
+                                    if is_gpsx_lat:
+                                        st.info(
+                                            f"🔍 GPSX to szerokość ({gps_x_num:.6f}), GPSY to długość ({gps_y_num:.6f})")
+                                    elif is_gpsx_lon:
+                                        st.info(
+                                            f"🔍 GPSX to długość ({gps_x_num:.6f}), GPSY to szerokość ({gps_y_num:.6f})")
+                                    else:
+                                        st.info(
+                                            "🔍 Format geograficzny - sprawdzam kolejność...")
+                            except Exception:
+                                st.warning(
+                                    "⚠️ Nie można określić formatu współrzędnych")
+
+                    with col2:
+                        st.subheader("🗺️ Mapa śladu")
+                        # Utwórz mapę dla tego konkretnego śladu (automatycznie gdy zakładka jest aktywna)
+                        with st.spinner("🗺️ Ładowanie mapy śladu GPS..."):
+                            tracking_map, _ = create_gps_map(
+                                gps_tracking_data)
+                            if tracking_map:
+                                show_gps_map(tracking_map,
+                                             width=500, height=400)
+                            else:
+                                st.warning(
+                                    "⚠️ Nie udało się utworzyć mapy śladu")
+
+                    # Wyświetl tabelę z danymi śladu
+                    st.subheader("📋 Dane śladu")
+                    st.dataframe(gps_tracking_data,
+                                 use_container_width=True,
+                                 column_order=visible_columns(gps_tracking_data))
+
+                    # Eksport śladu
+                    st.subheader("💾 Eksport śladu")
+                    render_export_buttons(
+                        gps_tracking_data,
+                        tuple(filter_state.items()) +
+                        ('trace', tracking_number),
+                        "ślad", f"slad_{tracking_number}", "Slad")
+                else:
+                    st.warning(
+                        "⚠️ Brak danych GPS dla tego numeru przesyłki")
+                    st.info("📋 Dostępne dane bez GPS:")
+                    st.dataframe(
+                        tracking_data, use_container_width=True,
+                        column_order=visible_columns(tracking_data))
+            else:
+                st.error(
+                    f"❌ Nie znaleziono żadnych rekordów dla numeru: {tracking_number}")
+
+                # Pokaż sugestie podobnych numerów (z całego arkusza, także spoza filtrów)
+                similar_numbers = tracking_index.suggest(
+                    tracking_number)
+
+                if similar_numbers:
+                    st.info("💡 Możliwe podobne numery:")
+                    # Pokaż maksymalnie 5 sugestii
+                    for num in similar_numbers[:5]:
+                        st.write(f"- {num}")
+    else:
+        st.warning(
+            "⚠️ Brak wymaganych kolumn: 'Numer', 'GPSX' lub 'GPSY'")
+
+
+def render_profiling_panel(profiler):
+    """Panel debug w pasku bocznym: pomiary etapów, suma na etap i eksport JSON"""
+    with st.sidebar.expander("🐞 Profilowanie etapów", expanded=True):
+        if not profiler.records:
+            st.caption("Brak pomiarów - etapy są mierzone przy następnym przeliczeniu")
+            return
+
+        records = pd.DataFrame(list(profiler.records))
+        columns = [col for col in ['stage', 'seconds', 'peak_mb', 'rows', 'frame_mb']
+                   if col in records.columns]
+        st.caption("Ostatnie etapy (najnowsze na górze)")
+        st.dataframe(records[columns].iloc[::-1].head(20), use_container_width=True,
+                     hide_index=True)
+
+        totals = records.groupby('stage', sort=False).agg(
+            count=('seconds', 'size'), seconds=('seconds', 'sum'))
+        st.caption("Łącznie na etap")
+        st.dataframe(totals.sort_values('seconds', ascending=False),
+                     use_container_width=True)
+
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button(
+                "📥 JSON", data=profiler.to_json(),
+                file_name=f"profil_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+                mime='application/json', on_click='ignore', key='profiling_download')
+        with col2:
+            if st.button("🧹 Wyczyść", key='profiling_clear'):
+                profiler.records.clear()
+                st.rerun()
+
+
 # Sidebar - ładowanie pliku
 st.sidebar.header("📁 Ładowanie pliku")
 
 # Przycisk do czyszczenia cache'a
 if st.sidebar.button("🗑️ Wyczyść cache", help="Usuń załadowane dane z pamięci"):
+    # Zbiór jest wspólny dla sesji - usunięcie z cache wymusza ponowne ładowanie
+    # (sesje, które już go mają, działają dalej na swoich referencjach)
     if 'cached_file_key' in st.session_state:
-        del st.session_state.cached_file_key
-    if 'cached_sheets_data' in st.session_state:
-        del st.session_state.cached_sheets_data
-
-    # Wyczyść wszystkie mapy GPS (stare i nowe)
-    keys_to_remove = []
-    for key in st.session_state.keys():
-        if key.startswith('gps_map_') or key.startswith('gps_loaded_'):
-            keys_to_remove.append(key)
-
-    for key in keys_to_remove:
-        del st.session_state[key]
+        file_key = st.session_state.pop('cached_file_key')
+        CACHE.discard(file_key)
+        # Wyniki liczone z tego zbioru - filtry, podsumowania, mapy (klucz zawiera stan
+        # filtrów z ('file', file_key))
+        for key in CACHE.keys():
+            if isinstance(key, tuple) and ('file', file_key) in key:
+                CACHE.discard(key)
 
     st.sidebar.success("✅ Cache wyczyszczony!")
     st.rerun()
 
-uploaded_file = st.sidebar.file_uploader(
-    "Wybierz plik Excel",
+with st.sidebar.expander("📦 Cache"):
+    for label, registry in (("Dane i mapy", CACHE), ("Pliki eksportu", EXPORT_FILES)):
+        stats = registry.stats()
+        st.caption(
+            f"**{label}:** {stats['bytes'] / (1024 * 1024):.0f} / "
+            f"{stats['max_bytes'] / (1024 * 1024):.0f} MB, wpisów: {stats['entries']}  \n"
+            f"trafienia: {stats['hits']}, chybienia: {stats['misses']}, "
+            f"usunięte: {stats['evictions']}")
+
+# Profilowanie (opt-in) - profiler żyje w sesji, pomiary pokazuje panel na dole paska bocznego
+if st.sidebar.toggle("🐞 Profilowanie", key='profiling',
+                     help="Czas, szczyt pamięci i pamięć ramek dla każdego etapu (spowalnia aplikację)"):
+    if 'profiler' not in st.session_state:
+        st.session_state.profiler = StageProfiler()
+elif 'profiler' in st.session_state:
+    st.session_state.pop('profiler').close()
+set_profiler(st.session_state.get('profiler'))
+
+# Projekcja kolumn - szybsze ładowanie i mniej pamięci, ale eksport zawiera tylko te kolumny
+only_used_columns = st.sidebar.checkbox(
+    "⚡ Wczytuj tylko używane kolumny",
+    value=False,
+    key='only_used_columns',
+    help="Tylko kolumny używane przez aplikację: " + ", ".join(USED_COLUMNS) +
+         " (oraz kolumny dat). Pozostałe kolumny nie trafią do tabel ani eksportu."
+)
+load_columns = USED_COLUMNS if only_used_columns else None
+
+# Silnik odczytu - 'auto' dobiera po typie i rozmiarze pliku
+reader_engine = st.sidebar.selectbox(
+    "Silnik odczytu:",
+    ['auto'] + sorted(READER_ENGINES),
+    key='reader_engine',
+    help=f"auto: .xls - xlrd, .xlsb - pyxlsb, .xlsx - rows od "
+         f"{ROW_READER_MIN_BYTES / (1024 * 1024):.0f} MB, mniejsze openpyxl. "
+         "rows - iterowanie wierszy (szybsze dla dużych plików)."
+)
+
+# Tryb strumieniowy - arkusz zapisywany kawałkami do Parquet, w pamięci tylko wynik filtrów
+stream_mode = st.sidebar.checkbox(
+    "🌊 Tryb strumieniowy (bardzo duże pliki)",
+    value=False,
+    key='stream_mode',
+    help="Jeden plik .xlsx/.xlsb czytany wiersz po wierszu do Parquet na dysku; filtry "
+         "wykonywane przy odczycie. Kolumny spoza dat, czasu i współrzędnych jako tekst."
+)
+
+uploaded_files = st.sidebar.file_uploader(
+    "Wybierz pliki Excel",
     type=None,  # Pozwól na wszystkie typy plików
-    accept_multiple_files=False,
-    help="Obsługiwane formaty: .xlsx, .xls, .xlsb"
+    accept_multiple_files=True,
+    help="Obsługiwane formaty: .xlsx, .xls, .xlsb - można wybrać kilka plików naraz (np. cały tydzień)"
 )
 
-if uploaded_file is not None:
-    # Sprawdź rozszerzenie pliku
-    file_extension = uploaded_file.name.split('.')[-1].lower()
-    if file_extension not in ['xlsx', 'xls', 'xlsb']:
+if uploaded_files:
+    # Sprawdź rozszerzenia plików
+    unsupported_extensions = [
+        file.name.split('.')[-1].lower() for file in uploaded_files
+        if file.name.split('.')[-1].lower() not in EXCEL_EXTENSIONS]
+    if unsupported_extensions:
         st.error(
-            f"❌ Nieobsługiwany format pliku: .{file_extension}. Obsługiwane formaty: .xlsx, .xls, .xlsb")
+            f"❌ Nieobsługiwany format pliku: {', '.join('.' + ext for ext in unsupported_extensions)}. Obsługiwane formaty: .xlsx, .xls, .xlsb")
     else:
-        # Sprawdź czy plik jest już w cache
-        file_key = f"{uploaded_file.name}_{uploaded_file.size}"
-
-        if 'cached_file_key' not in st.session_state or st.session_state.cached_file_key != file_key:
-            # Ładowanie danych
-            with st.spinner("Ładowanie pliku..."):
-                sheets_data = load_excel_file(uploaded_file)
+        # Sprawdź czy pliki są już w cache (klucz = hash zawartości, nie nazwa i rozmiar)
+        file_hashes = [uploaded_file_hash(file) for file in uploaded_files]
+        # Hashe plików już usuniętych z listy nie są potrzebne
+        current_ids = {file.file_id for file in uploaded_files}
+        st.session_state.file_hashes = {
+            file_id: file_hash for file_id, file_hash in st.session_state.file_hashes.items()
+            if file_id in current_ids}
+        file_key = combined_hash(file_hashes)
+        if load_columns is not None:
+            # Inna projekcja to inne dane - osobny klucz dla sesji, filtrów i eksportów
+            file_key = f'{file_key}_{projection_key(load_columns)}'
+        use_stream = stream_mode and len(uploaded_files) == 1 and \
+            uploaded_files[0].name.split('.')[-1].lower() in ('xlsx', 'xlsb')
+        if stream_mode and not use_stream:
+            st.info("💡 Tryb strumieniowy obsługuje jeden plik .xlsx lub .xlsb - ładowanie zwykłe")
+        if use_stream:
+            file_key = f'{file_key}_stream'
+        elif reader_engine != 'auto':
+            # Silniki mogą różnić się wynikiem - osobny zbiór dla wybranego wprost
+            file_key = f'{file_key}_{reader_engine}'
+
+        def load_dataset():
+            if use_stream:
+                return load_streamed_file(uploaded_files[0], file_hashes[0], columns=load_columns)
+            if len(uploaded_files) == 1:
+                return load_excel_file(
+                    uploaded_files[0], file_hash=file_hashes[0], columns=load_columns,
+                    engine=reader_engine)
+            return load_excel_files(
+                uploaded_files, file_hashes, columns=load_columns, engine=reader_engine)
+
+        # Dane w cache procesu (wspólne dla wszystkich sesji z tym samym plikiem) -
+        # w sesji zostaje tylko klucz zbioru i stan filtrów
+        from_cache = file_key in CACHE
+        if from_cache:
+            sheets_data = CACHE.get(file_key, load_dataset)
+        else:
+            with st.spinner("Ładowanie plików..." if len(uploaded_files) > 1 else "Ładowanie pliku..."), \
+                    profile_stage('load'):
+                sheets_data = CACHE.get(file_key, load_dataset)
+            # Nowe wpisy na dysku - stare wersje i najdawniej używane ponad budżet znikają
+            # (katalogi zbiorów w pamięci zostają)
+            prune_disk_cache()
 
-            if sheets_data:
-                st.success(
-                    f"✅ Plik załadowany pomyślnie! Znaleziono {len(sheets_data)} arkuszy.")
-                # Zapisz w session state
-                st.session_state.cached_file_key = file_key
-                st.session_state.cached_sheets_data = sheets_data
-            else:
-                st.error("❌ Nie udało się załadować pliku.")
-                sheets_data = None
+        if sheets_data:
+            st.success(load_summary_message(sheets_data, from_cache=from_cache))
+            st.session_state.cached_file_key = file_key
         else:
-            # Użyj danych z cache
-            sheets_data = st.session_state.cached_sheets_data
-            st.success(
-                f"✅ Plik załadowany z cache! Znaleziono {len(sheets_data)} arkuszy.")
+            st.error("❌ Nie udało się załadować pliku.")
+            sheets_data = None
 
         if sheets_data:
             # Automatycznie wybierz pierwszy arkusz
             first_sheet = list(sheets_data.keys())[0]
-            df = sheets_data[first_sheet]
-
-            # Konwertuj daty i czas przed filtrowaniem
-            for col in df.columns:
-                if col.upper() == 'DATA' and pd.api.types.is_numeric_dtype(df[col]):
-                    # Konwertuj daty Excel na prawidłowe daty
-                    df[col] = pd.to_datetime(
-                        '1900-01-01') + pd.to_timedelta(df[col] - 2, unit='D')
-                elif col.upper() == 'TIME' and pd.api.types.is_numeric_dtype(df[col]):
-                    # Konwertuj czas Excel na prawidłowy czas
-                    df[col] = pd.to_datetime(
-                        '1900-01-01') + pd.to_timedelta(df[col], unit='D')
-                    df[col] = df[col].dt.time
-
-            # Napraw problematyczne kolumny dla Streamlit (dodatkowa naprawa)
-            df = fix_problematic_columns(df)
+            # Zbiór strumieniowy nie jest wczytywany w całości - tylko wynik filtrów
+            df = None if isinstance(sheets_data, StreamedDataset) else sheets_data[first_sheet]
+
+            # Stan filtrów - klucz cache dla etapów filtrowania i wyników liczonych na ich wyjściu
+            filter_state = {'file': file_key, 'sheet': first_sheet}
 
+            if df is None:
+                df, selected_driver = render_stream_filters(sheets_data, filter_state)
             # Sprawdź czy istnieje kolumna "Driver ID:"
-            if 'Driver ID:' in df.columns:
+            elif 'Driver ID:' in df.columns:
                 # Kalendarz
                 st.sidebar.markdown("---")
                 st.sidebar.header("📅 Wybór dat")
 
-                # Znajdź kolumnę z datami
-                date_column = None
-                for col in df.columns:
-                    if col.upper() == 'DATA' or 'date' in col.lower():
-                        date_column = col
-                        break
+                # Znajdź kolumnę z datami (ta sama reguła co w silniku)
+                date_column = find_date_column(df)
 
                 if date_column is not None:
                     try:
@@ -390,7 +1202,8 @@ if uploaded_file is not None:
                         if date_option == "Tylko soboty":
                             # Filtruj tylko soboty
                             # 5 = sobota
-                            df = df[df[date_column].dt.dayofweek == 5]
+                            df = apply_filter_stage(
+                                df, filter_state, 'date', (date_column, date_option, None))
                             st.sidebar.success(
                                 f"📅 Wyświetlane tylko soboty: {len(df)} wierszy")
                         elif date_option == "Niestandardowy wybór":
@@ -404,13 +1217,8 @@ if uploaded_file is not None:
                             )
 
                             # Filtruj dane według wybranych dat
-                            if isinstance(selected_dates, tuple) and len(selected_dates) == 2:
-                                start_date, end_date = selected_dates
-                                df = df[(df[date_column].dt.date >= start_date) & (
-                                    df[date_column].dt.date <= end_date)]
-                            elif selected_dates:
-                                df = df[df[date_column].dt.date ==
-                                        selected_dates]
+                            df = apply_filter_stage(
+                                df, filter_state, 'date', (date_column, date_option, selected_dates))
 
                             st.sidebar.success(
                                 f"📅 Filtrowanie według dat: {len(df)} wierszy")
@@ -469,7 +1277,8 @@ if uploaded_file is not None:
                 if selected_driver != 'Wszyscy':
                     # Użyj oryginalnej nazwy Driver ID do filtrowania
                     original_driver_id = driver_mapping[selected_driver]
-                    df = df[df['Driver ID:'] == original_driver_id]
+                    df = apply_filter_stage(
+                        df, filter_state, 'driver', original_driver_id)
                     st.info(
                         f"📊 Wyświetlane dane dla Driver ID: {original_driver_id} (skrócone: {selected_driver})")
                 else:
@@ -482,8 +1291,7 @@ if uploaded_file is not None:
                 # Sprawdź czy istnieje kolumna Exception Info
                 if 'Exception info' in df.columns:
                     # Zahardkodowane wartości do wyboru
-                    hardcoded_exceptions = [
-                        "DR RELEASED", "COMM INS REL", "SIG OBTAINED"]
+                    hardcoded_exceptions = DEFAULT_EXCEPTIONS
 
                     # Sprawdź które z zahardkodowanych wartości są dostępne w danych
                     available_hardcoded = [
@@ -511,8 +1319,8 @@ if uploaded_file is not None:
 
                         if selected_exceptions:
                             # Filtruj dane według wybranych wartości
-                            df = df[df['Exception info'].isin(
-                                selected_exceptions)]
+                            df = apply_filter_stage(
+                                df, filter_state, 'exceptions', tuple(selected_exceptions))
                             st.info(
                                 f"⚠️ Wyświetlane wiersze z Exception info: {', '.join(selected_exceptions)}")
 
@@ -535,11 +1343,13 @@ if uploaded_file is not None:
             st.sidebar.markdown("---")
             st.sidebar.header("ℹ️ Informacje o danych")
             st.sidebar.metric("Liczba wierszy", len(df))
-            st.sidebar.metric("Liczba kolumn", len(df.columns))
+            st.sidebar.metric("Liczba kolumn", len(visible_columns(df)))
 
             # Wyświetl statystyki Exception info i City Name nad Driver ID
         if 'Exception info' in df.columns:
             exception_counts = df['Exception info'].value_counts()
+            # Kolumna kategoryczna zwraca też kategorie z zerową liczbą wystąpień
+            exception_counts = exception_counts[exception_counts > 0]
             total_exceptions = len(
                 df[df['Exception info'].notna() & (df['Exception info'] != '')])
 
@@ -554,66 +1364,24 @@ if uploaded_file is not None:
             with col2:
                 # Statystyki City Name - liczenie unikalnych adresów z datą
                 if 'City Name' in df.columns:
-                    # Sprawdź czy wszystkie wymagane kolumny adresowe istnieją
-                    address_columns = [
-                        'Postal', 'City Name', 'Street Name', 'Street Num']
-                    available_address_columns = [
-                        col for col in address_columns if col in df.columns]
-
-                    # Znajdź kolumnę z datą
-                    date_column = None
-                    for col in df.columns:
-                        if col.upper() == 'DATA' or 'date' in col.lower():
-                            date_column = col
-                            break
-
-                    # Minimum City Name + jedna inna kolumna adresowa
-                    if len(available_address_columns) >= 2:
-                        # Utwórz unikalne kombinacje adresów + data
-                        if date_column and len(available_address_columns) == 4:
-                            # Wszystkie kolumny adresowe + data dostępne
-                            unique_columns = address_columns + \
-                                [date_column]
-                            unique_addresses = df[unique_columns].drop_duplicates(
-                            )
-                        elif date_column:
-                            # Tylko dostępne kolumny + data
-                            unique_columns = available_address_columns + \
-                                [date_column]
-                            unique_addresses = df[unique_columns].drop_duplicates(
-                            )
-                        elif len(available_address_columns) == 4:
-                            # Wszystkie kolumny adresowe bez daty
-                            unique_addresses = df[address_columns].drop_duplicates(
-                            )
-                        else:
-                            # Tylko dostępne kolumny bez daty
-                            unique_addresses = df[available_address_columns].drop_duplicates(
-                            )
-
-                        # Policz miasta w unikalnych adresach
-                        city_counts = unique_addresses['City Name'].value_counts(
-                        )
-                        wroclaw_count = city_counts.get('WROCLAW', 0)
-                        other_count = len(unique_addresses) - wroclaw_count
+                    # Unikalne adresy po kluczu adresu z ładowania (+ data)
+                    home_count, address_count, count_mode = address_counts(df)
+                    other_count = address_count - home_count
 
-                        st.metric("WROCLAW (unikalne adresy)",
-                                  wroclaw_count)
+                    # Etykiety według tego, co address_counts faktycznie policzyło
+                    if count_mode != 'rows':
+                        st.metric("WROCLAW (unikalne adresy)", home_count)
                         st.metric(
                             "Inne miasta (unikalne adresy)", other_count)
-                        if date_column:
+                        if count_mode == 'address_date':
                             st.caption(
-                                f"Łącznie unikalnych adresów z datą: {len(unique_addresses)}")
+                                f"Łącznie unikalnych adresów z datą: {address_count}")
                         else:
                             st.caption(
-                                f"Łącznie unikalnych adresów: {len(unique_addresses)}")
+                                f"Łącznie unikalnych adresów: {address_count}")
                     else:
                         # Fallback - liczenie bezpośrednio z City Name
-                        city_counts = df['City Name'].value_counts()
-                        wroclaw_count = city_counts.get('WROCLAW', 0)
-                        other_count = len(df) - wroclaw_count
-
-                        st.metric("WROCLAW", wroclaw_count)
+                        st.metric("WROCLAW", home_count)
                         st.metric("Wioski", other_count)
                         st.caption("⚠️ Brak pełnych danych adresowych")
                 else:
@@ -622,350 +1390,86 @@ if uploaded_file is not None:
             with col3:
                 st.empty()  # Pusty placeholder
 
-            # Stwórz zakładki
-            tab1, tab2 = st.tabs(
-                ["📊 Dane", "🔍 Wyszukiwanie śladu"])
+            # Wybór widoku - liczony jest tylko aktywny widok (st.tabs wykonuje wszystkie zakładki)
+            active_view = st.segmented_control(
+                "Widok:", VIEWS, default=VIEWS[0], key='active_view',
+                label_visibility='collapsed') or VIEWS[0]
 
-            with tab1:
+            if active_view == VIEWS[0]:
                 # Główna zawartość
                 col1, col2 = st.columns([3, 1])
 
-            with col1:
-                if 'Driver ID:' in df.columns and selected_driver != 'Wszyscy':
-                    st.header(f"📊 Driver ID: {selected_driver}")
+                with col1:
+                    if 'Driver ID:' in df.columns and selected_driver != 'Wszyscy':
+                        st.header(f"📊 Driver ID: {selected_driver}")
 
-                    # Podgląd danych
-                    st.subheader("Podgląd danych")
-                    st.dataframe(df.head(10), use_container_width=True)
-                else:
-                    st.header("📊 Podsumowanie dla wszystkich kierowców")
-
-                    # Tabela podsumowująca dla wszystkich kierowców
-                    if 'Driver ID:' in df.columns:
-                        # Przygotuj dane do podsumowania
-                        summary_data = []
-
-                        for driver_id in df['Driver ID:'].dropna().unique():
-                            driver_df = df[df['Driver ID:'] == driver_id]
-
-                            # Liczba wyjątków
-                            exception_count = len(driver_df[driver_df['Exception info'].notna() & (
-                                driver_df['Exception info'] != '')])
-
-                            # Statystyki miast
-                            if 'City Name' in driver_df.columns:
-                                # Sprawdź czy wszystkie wymagane kolumny adresowe istnieją
-                                address_columns = [
-                                    'Postal', 'City Name', 'Street Name', 'Street Num']
-                                available_address_columns = [
-                                    col for col in address_columns if col in driver_df.columns]
-
-                                # Znajdź kolumnę z datą
-                                date_column = None
-                                for col in driver_df.columns:
-                                    if col.upper() == 'DATA' or 'date' in col.lower():
-                                        date_column = col
-                                        break
-
-                                # Minimum City Name + jedna inna kolumna adresowa
-                                if len(available_address_columns) >= 2:
-                                    # Utwórz unikalne kombinacje adresów + data
-                                    if date_column and len(available_address_columns) == 4:
-                                        # Wszystkie kolumny adresowe + data dostępne
-                                        unique_columns = address_columns + \
-                                            [date_column]
-                                        unique_addresses = driver_df[unique_columns].drop_duplicates(
-                                        )
-                                    elif date_column:
-                                        # Tylko dostępne kolumny + data
-                                        unique_columns = available_address_columns + \
-                                            [date_column]
-                                        unique_addresses = driver_df[unique_columns].drop_duplicates(
-                                        )
-                                    elif len(available_address_columns) == 4:
-                                        # Wszystkie kolumny adresowe bez daty
-                                        unique_addresses = driver_df[address_columns].drop_duplicates(
-                                        )
-                                    else:
-                                        # Tylko dostępne kolumny bez daty
-                                        unique_addresses = driver_df[available_address_columns].drop_duplicates(
-                                        )
-
-                                    # Policz miasta w unikalnych adresach
-                                    city_counts = unique_addresses['City Name'].value_counts(
-                                    )
-                                    wroclaw_count = city_counts.get(
-                                        'WROCLAW', 0)
-                                    other_count = len(
-                                        unique_addresses) - wroclaw_count
-                                else:
-                                    # Fallback - liczenie bezpośrednio z City Name
-                                    city_counts = driver_df['City Name'].value_counts(
-                                    )
-                                    wroclaw_count = city_counts.get(
-                                        'WROCLAW', 0)
-                                    other_count = len(
-                                        driver_df) - wroclaw_count
-                            else:
-                                wroclaw_count = 0
-                                other_count = 0
-
-                            # Dodaj dane do podsumowania z skróconą nazwą Driver ID
-                            short_driver_id = extract_driver_name(driver_id)
-                            summary_data.append({
-                                # Skrócona nazwa + oryginalna w nawiasach
-                                'Driver ID': f"{short_driver_id} ({driver_id})",
-                                'Exception Count': exception_count,
-                                'WROCLAW': wroclaw_count,
-                                'Wioski': other_count,
-                                'Total Rows': len(driver_df)
-                            })
-
-                        # Utwórz DataFrame z podsumowaniem
-                        summary_df = pd.DataFrame(summary_data)
-
-                        # Sortuj według skróconych nazw Driver ID alfabetycznie
-                        summary_df['Driver ID_short'] = summary_df['Driver ID'].apply(
-                            lambda x: x.split(' (')[0] if ' (' in str(x) else str(x))
-                        summary_df = summary_df.sort_values(
-                            'Driver ID_short').drop('Driver ID_short', axis=1)
-
-                        # Wyświetl tabelę podsumowującą
-                        st.subheader("📋 Podsumowanie kierowców")
-                        st.dataframe(summary_df, use_container_width=True)
-
-                        # Dodaj przycisk eksportu tabeli podsumowującej
-                        st.subheader("💾 Eksport podsumowania")
-                        col_export1, col_export2 = st.columns(2)
-
-                        with col_export1:
-                            if st.button("📥 Pobierz podsumowanie (CSV)"):
-                                csv_summary = summary_df.to_csv(index=False)
-                                st.download_button(
-                                    label="📥 Pobierz CSV",
-                                    data=csv_summary,
-                                    file_name=f"podsumowanie_kierowcow_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                                    mime="text/csv"
-                                )
-
-                        with col_export2:
-                            if st.button("📥 Pobierz podsumowanie (Excel)"):
-                                output_summary = io.BytesIO()
-                                with pd.ExcelWriter(output_summary, engine='openpyxl') as writer:
-                                    summary_df.to_excel(
-                                        writer, sheet_name='Podsumowanie', index=False)
-                                output_summary.seek(0)
-
-                                st.download_button(
-                                    label="📥 Pobierz Excel",
-                                    data=output_summary.getvalue(),
-                                    file_name=f"podsumowanie_kierowcow_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                                )
-
-                        st.markdown("---")
-                        st.subheader("📊 Szczegółowe dane")
-                        st.dataframe(df.head(10), use_container_width=True)
-
-                        # Wszystkie dane
-                        st.markdown("---")
-                        st.subheader("📋 Wszystkie dane")
-                        st.dataframe(df, use_container_width=True)
+                        # Podgląd danych
+                        st.subheader("Podgląd danych")
+                        st.dataframe(df.head(10), use_container_width=True,
+                                     column_order=visible_columns(df))
                     else:
-                        st.header("📊 Wszystkie dane")
-                        st.dataframe(df.head(10), use_container_width=True)
-
-                        # Wszystkie dane
-                        st.markdown("---")
-                        st.subheader("📋 Wszystkie dane")
-                        st.dataframe(df, use_container_width=True)
+                        st.header("📊 Podsumowanie dla wszystkich kierowców")
+
+                        # Tabela podsumowująca dla wszystkich kierowców
+                        if 'Driver ID:' in df.columns:
+                            summary_df = build_driver_summary(
+                                df, tuple(filter_state.items()))
+
+                            # Wyświetl tabelę podsumowującą
+                            st.subheader("📋 Podsumowanie kierowców")
+                            st.dataframe(summary_df, use_container_width=True)
+
+                            # Dodaj przycisk eksportu tabeli podsumowującej
+                            st.subheader("💾 Eksport podsumowania")
+                            render_export_buttons(
+                                summary_df, tuple(filter_state.items()) + ('summary',),
+                                "podsumowanie", "podsumowanie_kierowcow", "Podsumowanie")
+
+                            st.markdown("---")
+                            st.subheader("📊 Szczegółowe dane")
+                            st.dataframe(df.head(10), use_container_width=True,
+                                         column_order=visible_columns(df))
+
+                            # Wszystkie dane
+                            st.markdown("---")
+                            st.subheader("📋 Wszystkie dane")
+                            render_paged_table(
+                                df, tuple(filter_state.items()), "all_data")
+                        else:
+                            st.header("📊 Wszystkie dane")
+                            st.dataframe(df.head(10), use_container_width=True,
+                                         column_order=visible_columns(df))
+
+                            # Wszystkie dane
+                            st.markdown("---")
+                            st.subheader("📋 Wszystkie dane")
+                            render_paged_table(
+                                df, tuple(filter_state.items()), "all_data")
+
+                with col2:
+                    st.header("💾 Eksport")
+
+                    # Eksport danych - tylko gdy wybrano konkretnego kierowcę
+                    if 'Driver ID:' in df.columns and selected_driver != 'Wszyscy':
+                        # Eksport danych
+                        render_export_buttons(
+                            df, tuple(filter_state.items()) + ('data',),
+                            "dane", "dane", "Dane", horizontal=False)
+                    else:
+                        st.info(
+                            "💡 Wybierz konkretnego kierowcę, aby eksportować szczegółowe dane")
+                        st.info("📋 Użyj przycisków eksportu podsumowania poniżej")
 
-            with col2:
-                st.header("💾 Eksport")
-
-                # Eksport danych - tylko gdy wybrano konkretnego kierowcę
-                if 'Driver ID:' in df.columns and selected_driver != 'Wszyscy':
-                    # Eksport danych
-                    if st.button("Pobierz dane (CSV)"):
-                        csv = df.to_csv(index=False)
-                        st.download_button(
-                            label="📥 Pobierz CSV",
-                            data=csv,
-                            file_name=f"dane_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                            mime="text/csv"
-                        )
+            elif active_view == VIEWS[1]:
+                st.header("🗺️ Mapa wszystkich doręczeń")
 
-                    if st.button("Pobierz dane (Excel)"):
-                        output = io.BytesIO()
-                        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                            df.to_excel(writer, sheet_name='Dane', index=False)
-                        output.seek(0)
-
-                        st.download_button(
-                            label="📥 Pobierz Excel",
-                            data=output.getvalue(),
-                            file_name=f"dane_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                        )
+                if 'GPSX' in df.columns and 'GPSY' in df.columns:
+                    render_fleet_map(df, filter_state)
                 else:
-                    st.info(
-                        "💡 Wybierz konkretnego kierowcę, aby eksportować szczegółowe dane")
-                    st.info("📋 Użyj przycisków eksportu podsumowania poniżej")
-
-            with tab2:
-                # Wyszukiwanie śladu GPS
-                st.header("🔍 Wyszukiwanie śladu GPS")
-
-                if 'Numer' in df.columns and 'GPSX' in df.columns and 'GPSY' in df.columns:
-                    # Pole do wklejenia numeru przesyłki
-                    tracking_number = st.text_input(
-                        "Wklej numer przesyłki:",
-                        placeholder="Wprowadź numer przesyłki...",
-                        help="Wklej numer przesyłki z kolumny 'Numer' aby znaleźć ślad GPS"
-                    )
+                    st.warning("⚠️ Brak wymaganych kolumn: 'GPSX' lub 'GPSY'")
 
-                    if tracking_number:
-                        # Wyszukaj dane dla danego numeru przesyłki
-                        tracking_data = df[df['Numer'].astype(str).str.contains(
-                            str(tracking_number), case=False, na=False)]
-
-                        if len(tracking_data) > 0:
-                            st.success(
-                                f"✅ Znaleziono {len(tracking_data)} rekordów dla numeru: {tracking_number}")
-
-                            # Sprawdź czy są dane GPS
-                            gps_tracking_data = tracking_data[(tracking_data['GPSX'].notna()) &
-                                                              (tracking_data['GPSY'].notna()) &
-                                                              (tracking_data['GPSX'] != '') &
-                                                              (tracking_data['GPSY'] != '')]
-
-                            if len(gps_tracking_data) > 0:
-                                # Wyświetl informacje o śladzie
-                                col1, col2 = st.columns(2)
-
-                                with col1:
-                                    st.subheader("📊 Informacje o śladzie")
-                                    st.metric("Liczba punktów GPS",
-                                              len(gps_tracking_data))
-
-                                    # Wyświetl szczegóły pierwszego rekordu
-                                    if len(gps_tracking_data) > 0:
-                                        first_record = gps_tracking_data.iloc[0]
-                                        st.write(
-                                            f"**Driver ID:** {first_record.get('Driver ID:', 'Brak')}")
-                                        st.write(
-                                            f"**Data:** {first_record.get('DATA', 'Brak')}")
-                                        st.write(
-                                            f"**Miasto:** {first_record.get('City Name', 'Brak')}")
-                                        st.write(
-                                            f"**Exception info:** {first_record.get('Exception info', 'Brak')}")
-
-                                        # Wyświetl informacje o współrzędnych
-                                        st.write(
-                                            f"**Współrzędne X:** {first_record.get('GPSX', 'Brak')}")
-                                        st.write(
-                                            f"**Współrzędne Y:** {first_record.get('GPSY', 'Brak')}")
-
-                                        # Sprawdź format współrzędnych
-                                        gps_x = first_record.get('GPSX', 0)
-                                        gps_y = first_record.get('GPSY', 0)
-                                        try:
-                                            gps_x_num = float(gps_x)
-                                            gps_y_num = float(gps_y)
-                                            if abs(gps_x_num) > 180 or abs(gps_y_num) > 90:
-                                                st.info(
-                                                    "🔍 Format UTM - będzie konwertowane na współrzędne geograficzne")
-                                            else:
-                                                # Sprawdź kolejność współrzędnych
-                                                is_gpsx_lat = (
-                                                    gps_x_num >= 49 and gps_x_num <= 55)
-                                                is_gpsx_lon = (
-                                                    gps_x_num >= 14 and gps_x_num <= 24)
-
-                                                if is_gpsx_lat:
-                                                    st.info(
-                                                        f"🔍 GPSX to szerokość ({gps_x_num:.6f}), GPSY to długość ({gps_y_num:.6f})")
-                                                elif is_gpsx_lon:
-                                                    st.info(
-                                                        f"🔍 GPSX to długość ({gps_x_num:.6f}), GPSY to szerokość ({gps_y_num:.6f})")
-                                                else:
-                                                    st.info(
-                                                        "🔍 Format geograficzny - sprawdzam kolejność...")
-                                        except Exception:
-                                            st.warning(
-                                                "⚠️ Nie można określić formatu współrzędnych")
-
-                                with col2:
-                                    st.subheader("🗺️ Mapa śladu")
-                                    # Utwórz mapę dla tego konkretnego śladu (automatycznie gdy zakładka jest aktywna)
-                                    with st.spinner("🗺️ Ładowanie mapy śladu GPS..."):
-                                        tracking_map = create_gps_map(
-                                            gps_tracking_data)
-                                        if tracking_map:
-                                            st_folium(tracking_map,
-                                                      width=500, height=400)
-                                        else:
-                                            st.warning(
-                                                "⚠️ Nie udało się utworzyć mapy śladu")
-
-                                # Wyświetl tabelę z danymi śladu
-                                st.subheader("📋 Dane śladu")
-                                st.dataframe(gps_tracking_data,
-                                             use_container_width=True)
-
-                                # Eksport śladu
-                                st.subheader("💾 Eksport śladu")
-                                col_export1, col_export2 = st.columns(2)
-
-                                with col_export1:
-                                    if st.button("📥 Pobierz ślad (CSV)"):
-                                        csv_tracking = gps_tracking_data.to_csv(
-                                            index=False)
-                                        st.download_button(
-                                            label="📥 Pobierz CSV",
-                                            data=csv_tracking,
-                                            file_name=f"slad_{tracking_number}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                                            mime="text/csv"
-                                        )
-
-                                with col_export2:
-                                    if st.button("📥 Pobierz ślad (Excel)"):
-                                        output_tracking = io.BytesIO()
-                                        with pd.ExcelWriter(output_tracking, engine='openpyxl') as writer:
-                                            gps_tracking_data.to_excel(
-                                                writer, sheet_name='Slad', index=False)
-                                        output_tracking.seek(0)
-
-                                        st.download_button(
-                                            label="📥 Pobierz Excel",
-                                            data=output_tracking.getvalue(),
-                                            file_name=f"slad_{tracking_number}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                                        )
-                            else:
-                                st.warning(
-                                    "⚠️ Brak danych GPS dla tego numeru przesyłki")
-                                st.info("📋 Dostępne dane bez GPS:")
-                                st.dataframe(
-                                    tracking_data, use_container_width=True)
-                        else:
-                            st.error(
-                                f"❌ Nie znaleziono żadnych rekordów dla numeru: {tracking_number}")
-
-                            # Pokaż sugestie podobnych numerów
-                            all_numbers = df['Numer'].dropna().astype(
-                                str).unique()
-                            similar_numbers = [num for num in all_numbers if str(
-                                tracking_number).lower() in num.lower()]
-
-                            if similar_numbers:
-                                st.info("💡 Możliwe podobne numery:")
-                                # Pokaż maksymalnie 5 sugestii
-                                for num in similar_numbers[:5]:
-                                    st.write(f"- {num}")
-                else:
-                    st.warning(
-                        "⚠️ Brak wymaganych kolumn: 'Numer', 'GPSX' lub 'GPSY'")
+            elif active_view == VIEWS[2]:
+                render_trace_view(df, sheets_data, first_sheet, filter_state)
 
 else:
     # Instrukcje gdy nie ma pliku
@@ -975,10 +1479,12 @@ else:
     ## 🚀 Funkcje aplikacji:
 
     - **📁 Ładowanie plików Excel** - obsługa formatów .xlsx, .xls i .xlsb
+    - **🗂️ Wiele plików naraz** - np. eksporty z całego tygodnia łączone w jeden zbiór (kolumna "Plik źródłowy", bez powtórzonych wierszy)
     - **📅 Wybór dat** - kalendarz z opcjami: wszystkie daty, tylko soboty, niestandardowy wybór (zapamiętuje wybór)
     - **🚗 Wybór Driver ID** - filtrowanie danych według kierowcy z skróconymi nazwami (zapamiętuje wybór)
     - **⚠️ Exception info** - multiselect z zahardkodowanymi wartościami: DR RELEASED, COMM INS REL, SIG OBTAINED
     - **🔍 Wyszukiwanie śladu** - wyszukiwanie pojedynczego śladu GPS po numerze przesyłki z mapą
+    - **🗺️ Mapa floty** - wszystkie przefiltrowane doręczenia na jednej mapie, kolory według Exception info lub kierowcy
     - **📊 Podgląd danych** - wyświetlanie pierwszych 10 wierszy
     - **💾 Eksport** - pobieranie danych w formacie CSV lub Excel
 
@@ -996,9 +1502,13 @@ else:
     - **Sortowanie** - Driver ID są posortowane numerycznie lub alfabetycznie
     - **Tabela podsumowująca** - pokazuje skróconą nazwę + oryginalną w nawiasach
     - **🔍 Wyszukiwanie śladu** - wyszukiwanie pojedynczego śladu GPS po numerze przesyłki z mapą
-    - **📑 Zakładki** - podział na zakładki dla lepszej wydajności i organizacji
+    - **📑 Widoki** - przełącznik Dane / Mapa floty / Wyszukiwanie śladu, liczony jest tylko wybrany widok
+    - **📋 Wyszukiwanie wielu śladów** - lista numerów (wklejona lub z pliku CSV) sprawdzana naraz, ze wspólną mapą i eksportem
     """)
 
+if 'profiler' in st.session_state:
+    render_profiling_panel(st.session_state.profiler)
+
 # Stopka
 st.markdown("---")
 st.markdown(
@@ -0,0 +1,102 @@
+"""Benchmark fix_problematic_columns na syntetycznej ramce 500k wierszy.
+
+Uruchomienie: python benchmarks/bench_fix_problematic_columns.py [liczba_wierszy]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from driver_engine import fix_problematic_columns  # noqa: E402
+
+
+def legacy_fix_problematic_columns(df):
+    """Poprzednia implementacja - apply(type) na każdej komórce"""
+    problematic_columns = ['Street Num', 'Numer', 'Postal', 'Exception',
+                           'OPLD Consignee Name', 'Consignee Name', 'Consignee']
+    for col in df.columns:
+        try:
+            if df[col].dtype == 'object':
+                non_null_values = df[col].dropna()
+                if len(non_null_values) > 0:
+                    types_in_col = non_null_values.apply(type).unique()
+                    if len(types_in_col) > 1:
+                        df[col] = df[col].astype(str)
+        except Exception:
+            try:
+                df[col] = df[col].astype(str)
+            except Exception:
+                pass
+    for col in problematic_columns:
+        if col in df.columns:
+            try:
+                df[col] = df[col].astype(str)
+            except Exception:
+                pass
+    return df
+
+
+def make_frame(n_rows, n_extra_columns=50, seed=0):
+    """Tworzy szeroką ramkę podobną do eksportu kierowców"""
+    rng = np.random.default_rng(seed)
+    mixed = np.where(rng.random(n_rows) < 0.5,
+                     rng.integers(1, 200, n_rows).astype(object),
+                     np.array(['12A', '7B', '3'], dtype=object)[rng.integers(0, 3, n_rows)])
+    data = {
+        'Driver ID:': np.array([f"WRO{i:05d}" for i in range(40)], dtype=object)[rng.integers(0, 40, n_rows)],
+        'Numer': rng.integers(10**11, 10**12, n_rows).astype(str).astype(object),
+        'Street Num': mixed,
+        'Postal': mixed.copy(),
+        'City Name': np.array(['WROCLAW', 'OLESNICA', 'SYCOW'], dtype=object)[rng.integers(0, 3, n_rows)],
+        'DATA': rng.integers(45870, 45900, n_rows).astype(float),
+    }
+    for i in range(n_extra_columns):
+        if i % 3 == 0:
+            data[f'Text {i}'] = np.array(['A', 'B', 'C', None], dtype=object)[rng.integers(0, 4, n_rows)]
+        elif i % 3 == 1:
+            data[f'Mixed {i}'] = mixed.copy()
+        else:
+            data[f'Value {i}'] = rng.random(n_rows)
+    return pd.DataFrame(data)
+
+
+def bench(func, df, repeat=3):
+    """Najlepszy czas z kilku przebiegów (każdy na świeżej kopii)"""
+    best = float('inf')
+    for _ in range(repeat):
+        frame = df.copy()
+        start = time.perf_counter()
+        func(frame)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    df = make_frame(n_rows)
+    print(f"Ramka: {n_rows} wierszy, {len(df.columns)} kolumn")
+
+    legacy = bench(legacy_fix_problematic_columns, df)
+    current = bench(fix_problematic_columns, df)
+
+    # Drugie wywołanie na znormalizowanej ramce (jak w głównym przepływie)
+    normalized = fix_problematic_columns(df.copy())
+    start = time.perf_counter()
+    fix_problematic_columns(normalized)
+    second_call = time.perf_counter() - start
+
+    # Obie implementacje muszą dać ten sam wynik
+    pd.testing.assert_frame_equal(legacy_fix_problematic_columns(df.copy()),
+                                  fix_problematic_columns(df.copy()))
+
+    print(f"apply(type):        {legacy:8.3f} s")
+    print(f"infer_dtype:        {current:8.3f} s  ({legacy / current:.1f}x)")
+    print(f"drugie wywołanie:   {second_call * 1000:8.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""Benchmark silników odczytu skoroszytów na syntetycznych plikach 10k/100k/1M wierszy.
+
+Uruchomienie:
+    python benchmarks/bench_reader_engines.py [--rows 10000 100000 1000000]
+        [--file WŁASNY.xlsb ...] [--engines rows openpyxl] [--used-columns]
+
+Brakujące pliki .xlsx są generowane (benchmarks/synthetic_workbook.py) w --data-dir.
+Pliki .xlsb trzeba podać przez --file (zapisane z Excela). Każdy pomiar działa w osobnym
+procesie: czas odczytu (bez tracemalloc), potem szczyt pamięci Pythona (tracemalloc)
+i - gdzie jest moduł resource - szczytowe RSS procesu.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from driver_engine import (  # noqa: E402
+    READER_ENGINES, USED_COLUMNS, fix_problematic_columns, normalize_sheet, open_reader,
+    pick_reader_engine, projection_options,
+)
+from synthetic_workbook import make_driver_frame, write_workbook  # noqa: E402
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BYTES_PER_MB = 1024 * 1024
+
+
+def load_sheet(data, file_name, engine, columns):
+    """Pierwszy arkusz wybranym silnikiem + normalizacja jak w aplikacji"""
+    reader = open_reader(data, file_name, engine)
+    start = time.perf_counter()
+    df = reader.parse(reader.sheet_names[0], **projection_options(columns))
+    parse_seconds = time.perf_counter() - start
+    df = normalize_sheet(fix_problematic_columns(df))
+    return df, parse_seconds
+
+
+def measure(path, engine, used_columns):
+    """Pomiar w bieżącym procesie (wywoływany w procesie potomnym) - słownik wyników"""
+    columns = USED_COLUMNS if used_columns else None
+    with open(path, 'rb') as f:
+        data = f.read()
+    file_name = os.path.basename(path)
+
+    start = time.perf_counter()
+    df, parse_seconds = load_sheet(data, file_name, engine, columns)
+    total_seconds = time.perf_counter() - start
+    frame_mb = df.memory_usage(deep=True).sum() / BYTES_PER_MB
+    rows = len(df)
+    del df
+
+    tracemalloc.start()
+    load_sheet(data, file_name, engine, columns)
+    peak_mb = tracemalloc.get_traced_memory()[1] / BYTES_PER_MB
+    tracemalloc.stop()
+
+    result = {'parse_seconds': parse_seconds, 'total_seconds': total_seconds,
+              'rows': rows, 'frame_mb': frame_mb, 'peak_mb': peak_mb}
+    if resource is not None:
+        # ru_maxrss: kilobajty na Linuksie, bajty na macOS
+        scale = 1 if sys.platform == 'darwin' else 1024
+        result['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / BYTES_PER_MB
+    return result
+
+
+def measure_in_subprocess(path, engine, used_columns):
+    """Pomiar w świeżym procesie - szczyt pamięci nie zależy od poprzednich pomiarów"""
+    command = [sys.executable, os.path.abspath(__file__), '--measure', path, engine]
+    if used_columns:
+        command.append('--used-columns')
+    output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def synthetic_workbook(data_dir, n_rows, extra_columns):
+    """Ścieżka syntetycznego skoroszytu - generowany tylko, gdy go jeszcze nie ma"""
+    path = os.path.join(data_dir, f'kierowcy_{n_rows}_{extra_columns}.xlsx')
+    if not os.path.exists(path):
+        print(f"Generowanie {path}...", flush=True)
+        write_workbook(make_driver_frame(n_rows, extra_columns), path)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark silników odczytu skoroszytów")
+    parser.add_argument('--rows', type=int, nargs='*', default=[10_000, 100_000, 1_000_000],
+                        help="Rozmiary syntetycznych skoroszytów (domyślnie: 10k 100k 1M)")
+    parser.add_argument('--file', nargs='*', default=[],
+                        help="Dodatkowe skoroszyty do zmierzenia (np. .xlsb z Excela)")
+    parser.add_argument('--engines', nargs='*', choices=sorted(READER_ENGINES),
+                        default=sorted(READER_ENGINES), help="Mierzone silniki (domyślnie: wszystkie)")
+    parser.add_argument('--extra-columns', type=int, default=20,
+                        help="Kolumny nieużywane przez aplikację w plikach syntetycznych")
+    parser.add_argument('--used-columns', action='store_true',
+                        help="Wczytuj tylko USED_COLUMNS (projekcja kolumn)")
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'nozyk_bench'),
+                        help="Folder na wygenerowane skoroszyty")
+    parser.add_argument('--measure', nargs=2, metavar=('PLIK', 'SILNIK'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.measure[0], args.measure[1], args.used_columns)))
+        return
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    paths = [synthetic_workbook(args.data_dir, n_rows, args.extra_columns)
+             for n_rows in args.rows] + args.file
+
+    print(f"\n{'plik':<32} {'MB':>6} {'silnik':<9} {'wiersze':>9} {'odczyt s':>9} "
+          f"{'razem s':>8} {'szczyt MB':>10} {'RSS MB':>8} {'ramka MB':>9}")
+    for path in paths:
+        file_extension = path.split('.')[-1].lower()
+        size = os.path.getsize(path)
+        auto_engine = pick_reader_engine(file_extension, size)
+        for engine in args.engines:
+            if file_extension not in READER_ENGINES[engine]:
+                continue
+            result = measure_in_subprocess(path, engine, args.used_columns)
+            marker = '*' if engine == auto_engine else ' '
+            max_rss = f"{result['max_rss_mb']:8.0f}" if 'max_rss_mb' in result else f"{'-':>8}"
+            print(f"{os.path.basename(path)[:32]:<32} {size / BYTES_PER_MB:6.1f} "
+                  f"{engine + marker:<9} {result['rows']:>9} {result['parse_seconds']:9.2f} "
+                  f"{result['total_seconds']:8.2f} {result['peak_mb']:10.0f} {max_rss} "
+                  f"{result['frame_mb']:9.1f}", flush=True)
+    print("\n* - silnik wybierany przez 'auto' dla tego pliku")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Zgodność silnika 'rows' z pd.read_excel (openpyxl dla .xlsx, pyxlsb dla .xlsb).
+
+Uruchomienie:
+    python benchmarks/check_reader_parity.py [--file WŁASNY.xlsb ...] [--rows 2000]
+
+Bez --file sprawdzany jest syntetyczny skoroszyt .xlsx z trudnymi komórkami (wartości NA
+jako tekst, liczby zapisane jako tekst, wartości logiczne, puste wiersze, powtórzone
+i puste nagłówki). Pliki .xlsb trzeba podać przez --file (zapisane z Excela). Każdy plik
+jest porównywany dla wszystkich kolumn i dla projekcji USED_COLUMNS. Kod wyjścia 1,
+gdy którakolwiek ramka się różni. 'auto' wybiera 'rows' dla dużych .xlsx
+(ROW_READER_MIN_BYTES); .xlsb przejdzie na 'rows' dopiero po zielonym wyniku dla
+eksportów .xlsb z Excela.
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+import openpyxl
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from driver_engine import USED_COLUMNS, PandasReader, RowReader, projection_options  # noqa: E402
+from synthetic_workbook import make_driver_frame, write_workbook  # noqa: E402
+
+# Wartości wpisywane do kolumn 'Exception info' i 'Street Num' co kilka wierszy
+TRICKY_TEXT = ['#N/A', 'NA', 'N/A', 'null', 'None', '', '123', '12A']
+PANDAS_ENGINES = {'xlsx': 'openpyxl', 'xlsb': 'pyxlsb'}
+
+
+def write_tricky_workbook(path, n_rows):
+    """Syntetyczny .xlsx z komórkami, przy których czytniki najłatwiej się rozjeżdżają"""
+    df = make_driver_frame(n_rows, n_extra_columns=4)
+    for i, text in enumerate(TRICKY_TEXT):
+        df.loc[i::len(TRICKY_TEXT) * 3, 'Exception info'] = text
+        df.loc[i + 1::len(TRICKY_TEXT) * 3, 'Street Num'] = text
+    # Kolumna tylko z liczbami zapisanymi jako tekst i kolumna wartości logicznych
+    df['Kod'] = (df.index % 97).astype(str)
+    df['Flaga'] = df.index % 2 == 0
+    df['Mieszana'] = [True if i % 5 == 0 else i for i in range(len(df))]
+    write_workbook(df, path)
+
+    # Pusty i powtórzony nagłówek, puste wiersze w środku i na końcu. cell(value=None)
+    # niczego nie zmienia - komórki czyszczone przez przypisanie .value
+    workbook = openpyxl.load_workbook(path)
+    sheet = workbook.active
+    sheet.cell(row=1, column=2).value = (
+        'Numer' if sheet.cell(row=1, column=2).value != 'Numer' else 'DATA')
+    sheet.cell(row=3, column=sheet.max_column + 1, value='poza nagłówkiem')
+    for row in (10, 11, sheet.max_row + 1, sheet.max_row + 2):
+        for column in range(1, sheet.max_column + 1):
+            sheet.cell(row=row, column=column).value = None
+    # Puste napisy na końcu - wiersze formalnie zapisane, ale bez danych
+    sheet.cell(row=sheet.max_row + 1, column=1).value = ''
+    workbook.save(path)
+    return path
+
+
+def compare(path, columns):
+    """Różnice między silnikiem 'rows' a czytnikiem pandas (pusta lista - zgodne)"""
+    file_extension = path.split('.')[-1].lower()
+    with open(path, 'rb') as f:
+        data = f.read()
+    options = projection_options(columns)
+    expected_reader = PandasReader(data, PANDAS_ENGINES[file_extension])
+    actual_reader = RowReader(data, file_extension)
+
+    problems = []
+    for sheet_name in expected_reader.sheet_names:
+        expected = expected_reader.parse(sheet_name, **options)
+        actual = actual_reader.parse(sheet_name, **options)
+        try:
+            pd.testing.assert_frame_equal(actual, expected)
+        except AssertionError as e:
+            problems.append(f"{sheet_name}: {e}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Zgodność silnika 'rows' z pd.read_excel")
+    parser.add_argument('--file', nargs='*', default=[],
+                        help="Skoroszyty .xlsx/.xlsb do sprawdzenia (np. eksporty z Excela)")
+    parser.add_argument('--rows', type=int, default=2000,
+                        help="Wiersze syntetycznego skoroszytu (domyślnie: 2000)")
+    args = parser.parse_args()
+
+    paths = list(args.file)
+    if not paths:
+        paths.append(write_tricky_workbook(
+            os.path.join(tempfile.gettempdir(), 'nozyk_parity.xlsx'), args.rows))
+
+    failed = False
+    for path in paths:
+        for label, columns in (('wszystkie kolumny', None), ('USED_COLUMNS', USED_COLUMNS)):
+            problems = compare(path, columns)
+            status = 'OK' if not problems else 'RÓŻNICE'
+            print(f"{os.path.basename(path)} ({label}): {status}")
+            for problem in problems:
+                print(f"  {problem}")
+            failed = failed or bool(problems)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Generator syntetycznych skoroszytów kierowców (kolumny jak w eksporcie).
+
+Uruchomienie: python benchmarks/synthetic_workbook.py LICZBA_WIERSZY PLIK.xlsx [--extra-columns N]
+
+Zapisuje tylko .xlsx (openpyxl write-only) - żadna biblioteka Pythona nie zapisuje .xlsb,
+plik .xlsb trzeba zapisać z Excela i podać benchmarkowi przez --file.
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from driver_engine import write_excel_write_only  # noqa: E402
+
+# Data Excela (liczba dni od 1899-12-30) pierwszego dnia eksportu
+FIRST_EXCEL_DAY = 45870
+
+
+def make_driver_frame(n_rows, n_extra_columns=20, n_drivers=400, seed=0):
+    """Ramka jak eksport kierowców: daty/czas jako liczby Excela, współrzędne UTM strefy 33,
+    kolumny z mieszanymi typami i n_extra_columns kolumn nieużywanych przez aplikację"""
+    rng = np.random.default_rng(seed)
+    drivers = np.array([f"WRO{i:05d}XX" for i in range(n_drivers)], dtype=object)
+    cities = np.array(['WROCLAW', 'Wrocław', 'OLESNICA', 'SYCOW', 'OLAWA'], dtype=object)
+    exceptions = np.array(['DR RELEASED', 'COMM INS REL', 'SIG OBTAINED', None], dtype=object)
+    street_nums = np.where(rng.random(n_rows) < 0.7,
+                           rng.integers(1, 200, n_rows).astype(object),
+                           np.array(['12A', '7B', '3/5'], dtype=object)[rng.integers(0, 3, n_rows)])
+
+    data = {
+        'Driver ID:': drivers[rng.integers(0, n_drivers, n_rows)],
+        'DATA': (FIRST_EXCEL_DAY + rng.integers(0, 30, n_rows)).astype(float),
+        'TIME': rng.uniform(7 / 24, 19 / 24, n_rows),
+        'Numer': rng.integers(10**11, 10**12, n_rows),
+        # Okolice Wrocławia (16.7-17.7°E, 50.9-51.3°N) - punkty w zakresie mapy
+        'GPSX': rng.uniform(620000, 690000, n_rows).round(1),
+        'GPSY': rng.uniform(5640000, 5690000, n_rows).round(1),
+        'Exception info': exceptions[rng.integers(0, len(exceptions), n_rows)],
+        'City Name': cities[rng.integers(0, len(cities), n_rows)],
+        'Postal': np.array(['50-001', '56-400', '56-500', '55-200'], dtype=object)[rng.integers(0, 4, n_rows)],
+        'Street Name': np.array([f"Ulica {i}" for i in range(500)], dtype=object)[rng.integers(0, 500, n_rows)],
+        'Street Num': street_nums,
+        'Consignee Name': np.array([f"Odbiorca {i}" for i in range(5000)], dtype=object)[rng.integers(0, 5000, n_rows)],
+    }
+    for i in range(n_extra_columns):
+        if i % 2 == 0:
+            data[f'Extra {i}'] = np.array(['A', 'B', 'C', None], dtype=object)[rng.integers(0, 4, n_rows)]
+        else:
+            data[f'Extra {i}'] = rng.random(n_rows).round(3)
+    return pd.DataFrame(data)
+
+
+def write_workbook(df, path, sheet_name='Dane'):
+    """Zapisuje ramkę jako .xlsx (plik tymczasowy + rename - przerwany zapis nie zostaje)"""
+    if not path.lower().endswith('.xlsx'):
+        raise ValueError("Generator zapisuje tylko pliki .xlsx")
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        write_excel_write_only(df, tmp_path, sheet_name)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Syntetyczny skoroszyt kierowców")
+    parser.add_argument('rows', type=int, help="Liczba wierszy")
+    parser.add_argument('path', help="Plik wynikowy .xlsx")
+    parser.add_argument('--extra-columns', type=int, default=20,
+                        help="Kolumny nieużywane przez aplikację (domyślnie: 20)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    df = make_driver_frame(args.rows, args.extra_columns, seed=args.seed)
+    write_workbook(df, args.path)
+    print(f"{args.path}: {len(df)} wierszy, {len(df.columns)} kolumn, "
+          f"{os.path.getsize(args.path) / (1024 * 1024):.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
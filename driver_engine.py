@@ -0,0 +1,2289 @@
+"""Silnik przetwarzania eksportów kierowców - bez zależności od Streamlit.
+
+Ładowanie i normalizacja skoroszytów, filtrowanie, podsumowanie kierowców i eksport.
+Z tych samych funkcji korzysta aplikacja (app_driver.py) i wsadowe przetwarzanie
+z linii poleceń:
+
+    python driver_engine.py FOLDER_LUB_PLIKI... -o WYNIKI --format csv --workers 4
+"""
+import argparse
+import contextvars
+import functools
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import weakref
+from collections import OrderedDict, deque
+from itertools import chain, islice
+from collections.abc import Mapping
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import date, datetime, time as dt_time
+
+import numpy as np
+import openpyxl
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pandas.io.parsers import TextParser
+
+logger = logging.getLogger(__name__)
+
+# Copy-on-Write: ramki współdzielone między sesjami (CacheRegistry) są rozdawane jako płytkie
+# widoki - zapis do widoku kopiuje tylko zmienianą kolumnę, oryginał zostaje nietknięty
+pd.set_option('mode.copy_on_write', True)
+
+# Obsługiwane rozszerzenia plików
+EXCEL_EXTENSIONS = ['xlsx', 'xls', 'xlsb']
+
+# Wartości Exception info wybierane domyślnie (wszystkie zaznaczone w aplikacji)
+DEFAULT_EXCEPTIONS = ["DR RELEASED", "COMM INS REL", "SIG OBTAINED"]
+
+
+# Profilowanie etapów (opt-in) - czas, szczyt pamięci Pythona i pamięć wynikowej ramki
+PROFILE_MAX_RECORDS = 500
+BYTES_PER_MB = 1024 * 1024
+profile_logger = logging.getLogger(f'{__name__}.profile')
+
+# tracemalloc jest globalny dla procesu - liczba profilerów, które go potrzebują
+# (sesje Streamlit profilują niezależnie), i czy to one go włączyły
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+_tracing_started = False
+
+
+def _acquire_tracing():
+    """Rejestruje profiler korzystający z tracemalloc (pierwszy włącza śledzenie)"""
+    global _tracing_users, _tracing_started
+    with _tracing_lock:
+        if _tracing_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracing_started = True
+        _tracing_users += 1
+
+
+def _release_tracing():
+    """Wyrejestrowuje profiler - ostatni wyłącza tracemalloc, jeśli włączyły go profilery"""
+    global _tracing_users, _tracing_started
+    with _tracing_lock:
+        _tracing_users -= 1
+        if _tracing_users == 0 and _tracing_started:
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+            _tracing_started = False
+
+
+class StageProfiler:
+    """Pomiary etapów przetwarzania: czas (perf_counter), szczyt pamięci (tracemalloc)
+    i pamięć ramki wynikowej (memory_usage(deep=True)).
+
+    Każdy zakończony etap trafia do records i jako linia JSON do loggera driver_engine.profile.
+    """
+
+    def __init__(self, trace_memory=True, max_records=PROFILE_MAX_RECORDS):
+        self.records = deque(maxlen=max_records)
+        self._stack = []
+        # tracemalloc spowalnia cały proces - włączany tylko na czas życia profilerów.
+        # finalize zwalnia go także dla profilera porzuconego bez close() (koniec sesji)
+        self._tracing = None
+        if trace_memory:
+            _acquire_tracing()
+            self._tracing = weakref.finalize(self, _release_tracing)
+
+    @contextmanager
+    def stage(self, name):
+        """Mierzy etap; do zwróconego słownika można wpisać 'frame' (ramka wynikowa)
+        i dowolne dodatkowe pola"""
+        record = {'stage': name, 'depth': len(self._stack),
+                  'started': datetime.now().isoformat(timespec='milliseconds')}
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                # reset_peak kasuje szczyt etapu nadrzędnego - zapamiętaj go wcześniej
+                self._stack[-1]['_peak'] = max(self._stack[-1]['_peak'], peak)
+            tracemalloc.reset_peak()
+            record['_start_memory'] = record['_peak'] = current
+        self._stack.append(record)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = round(time.perf_counter() - start, 6)
+            self._stack.pop()
+            if tracing and tracemalloc.is_tracing():
+                peak = max(record.pop('_peak'), tracemalloc.get_traced_memory()[1])
+                record['peak_mb'] = round((peak - record.pop('_start_memory')) / BYTES_PER_MB, 3)
+                if self._stack:
+                    self._stack[-1]['_peak'] = max(self._stack[-1]['_peak'], peak)
+            frame = record.pop('frame', None)
+            if isinstance(frame, pd.DataFrame):
+                record['rows'] = len(frame)
+                record['frame_mb'] = round(
+                    frame.memory_usage(deep=True).sum() / BYTES_PER_MB, 3)
+            self.records.append(record)
+            profile_logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+    def to_json(self):
+        """Wszystkie pomiary jako dokument JSON (do porównywania wydań)"""
+        return json.dumps({
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'pandas': pd.__version__,
+            'cache_version': CACHE_VERSION,
+            'stages': list(self.records),
+        }, ensure_ascii=False, indent=2, default=str)
+
+    def close(self):
+        """Zwalnia tracemalloc - wyłączany, gdy zamknięto ostatni profiler, który go używał"""
+        if self._tracing is not None:
+            self._tracing()
+
+
+# Profiler bieżącego wątku/sesji - ustawiany przez aplikację albo CLI, domyślnie brak
+_active_profiler = contextvars.ContextVar('active_profiler', default=None)
+
+
+def set_profiler(profiler):
+    """Ustawia profiler dla bieżącego kontekstu (None wyłącza pomiary)"""
+    _active_profiler.set(profiler)
+
+
+def profile_stage(name):
+    """Kontekst mierzący etap aktywnym profilerem; bez profilera nic nie robi"""
+    profiler = _active_profiler.get()
+    if profiler is None:
+        return nullcontext({})
+    return profiler.stage(name)
+
+
+# Wyniki pd.api.types.infer_dtype oznaczające kolumnę z mieszanymi typami
+MIXED_INFERRED_TYPES = {'mixed', 'mixed-integer', 'mixed-integer-float'}
+
+
+def fix_problematic_columns(df):
+    """Naprawia problematyczne kolumny w DataFrame"""
+    # Ramka już znormalizowana - drugie wywołanie nic nie robi
+    if df.attrs.get('columns_fixed'):
+        return df
+
+    # Lista znanych problematycznych kolumn
+    problematic_columns = ['Street Num', 'Numer', 'Postal', 'Exception',
+                           'OPLD Consignee Name', 'Consignee Name', 'Consignee']
+
+    # Sprawdź wszystkie kolumny pod kątem mieszanych typów
+    for col in df.columns:
+        if col in problematic_columns:
+            # I tak zostanie skonwertowana poniżej
+            continue
+        try:
+            # Sprawdź czy kolumna ma mieszane typy danych (inferencja typów w C, bez apply)
+            if df[col].dtype == 'object':
+                inferred_type = pd.api.types.infer_dtype(df[col], skipna=True)
+                if inferred_type in MIXED_INFERRED_TYPES:
+                    # Konwertuj wszystko na string
+                    df[col] = df[col].astype(str)
+        except Exception:
+            # Jeśli nie można sprawdzić typów, po prostu konwertuj na string
+            try:
+                df[col] = df[col].astype(str)
+            except Exception:
+                pass
+
+    # Konwertuj znane problematyczne kolumny
+    for col in problematic_columns:
+        if col in df.columns:
+            try:
+                df[col] = df[col].astype(str)
+            except Exception:
+                pass
+
+    df.attrs['columns_fixed'] = True
+    return df
+
+
+# Współrzędne GPS - elipsoida WGS84 i odwzorowanie UTM
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+UTM_K0 = 0.9996
+UTM_FALSE_EASTING = 500000.0
+UTM_FALSE_NORTHING_SOUTH = 10000000.0
+# Strefa UTM danych (Polska zachodnia i centralna - 33N, południk środkowy 15°)
+UTM_ZONE = 33
+
+# Format współrzędnych w wierszu (wynik coordinate_formats)
+COORDS_INVALID = 0
+COORDS_UTM = 1
+COORDS_LAT_LON = 2      # GPSX = szerokość, GPSY = długość
+COORDS_LON_LAT = 3      # GPSX = długość, GPSY = szerokość
+COORDS_UNKNOWN = 4      # geograficzne, kolejność nieznana - GPSX traktowane jako długość
+# Zakres współrzędnych przystanków (Polska) - punkty spoza niego (np. 0/0 bez fixa GPS)
+# nie trafiają na mapę ani do odcinków tras
+POLAND_LATITUDE = (49, 55)
+POLAND_LONGITUDE = (14, 24)
+
+
+def utm_to_wgs84(easting, northing, zone=UTM_ZONE, northern=True):
+    """Odwrotne odwzorowanie poprzeczne Merkatora (UTM -> szerokość/długość WGS84).
+
+    Szeregi Krügera (rozwinięcie w n = f / (2 - f) do n^3) liczone na całych tablicach
+    numpy; błąd rzędu milimetrów także daleko poza strefą (cała Polska w strefie 33,
+    wschód kraju 9° od południka środkowego). Zwraca (latitude, longitude) w stopniach.
+    """
+    easting = np.asarray(easting, dtype=float)
+    northing = np.asarray(northing, dtype=float)
+
+    n = WGS84_F / (2 - WGS84_F)
+    # Promień prostujący - długość łuku południka podzielona przez 2π
+    radius = WGS84_A / (1 + n) * (1 + n ** 2 / 4 + n ** 4 / 64)
+    beta = (n / 2 - 2 * n ** 2 / 3 + 37 * n ** 3 / 96,
+            n ** 2 / 48 + n ** 3 / 15,
+            17 * n ** 3 / 480)
+    delta = (2 * n - 2 * n ** 2 / 3 - 2 * n ** 3,
+             7 * n ** 2 / 3 - 8 * n ** 3 / 5,
+             56 * n ** 3 / 15)
+
+    y = northing if northern else northing - UTM_FALSE_NORTHING_SOUTH
+    xi = y / (UTM_K0 * radius)
+    eta = (easting - UTM_FALSE_EASTING) / (UTM_K0 * radius)
+
+    # Współrzędne na sferze konforemnej
+    xi_prime = xi.copy()
+    eta_prime = eta.copy()
+    for j, b in enumerate(beta, start=1):
+        xi_prime -= b * np.sin(2 * j * xi) * np.cosh(2 * j * eta)
+        eta_prime -= b * np.cos(2 * j * xi) * np.sinh(2 * j * eta)
+
+    # Szerokość konforemna -> geodezyjna
+    chi = np.arcsin(np.sin(xi_prime) / np.cosh(eta_prime))
+    latitude = chi.copy()
+    for j, d in enumerate(delta, start=1):
+        latitude += d * np.sin(2 * j * chi)
+    longitude = np.arctan2(np.sinh(eta_prime), np.cos(xi_prime))
+
+    central_meridian = (zone - 1) * 6 - 180 + 3
+    return np.degrees(latitude), central_meridian + np.degrees(longitude)
+
+
+def coordinate_formats(gps_x, gps_y):
+    """Format współrzędnych osobno dla każdego wiersza (stałe COORDS_*)"""
+    gps_x = np.asarray(gps_x, dtype=float)
+    gps_y = np.asarray(gps_y, dtype=float)
+    valid = np.isfinite(gps_x) & np.isfinite(gps_y)
+
+    # Duże liczby - UTM; małe - geograficzne, kolejność po zakresie GPSX dla Polski
+    return np.select(
+        [~valid,
+         (np.abs(gps_x) > 180) | (np.abs(gps_y) > 90),
+         (gps_x >= 49) & (gps_x <= 55),
+         (gps_x >= 14) & (gps_x <= 24)],
+        [COORDS_INVALID, COORDS_UTM, COORDS_LAT_LON, COORDS_LON_LAT],
+        default=COORDS_UNKNOWN).astype(np.int8)
+
+
+def in_poland(latitude, longitude):
+    """Maska punktów leżących w zakresie współrzędnych Polski (NaN - poza zakresem)"""
+    latitude = np.asarray(latitude, dtype=float)
+    longitude = np.asarray(longitude, dtype=float)
+    return ((latitude >= POLAND_LATITUDE[0]) & (latitude <= POLAND_LATITUDE[1]) &
+            (longitude >= POLAND_LONGITUDE[0]) & (longitude <= POLAND_LONGITUDE[1]))
+
+
+def add_geographic_coordinates(df):
+    """Dopisuje kolumny latitude/longitude wyliczone z GPSX/GPSY (NaN gdy brak współrzędnych)"""
+    gps_x = pd.to_numeric(df['GPSX'], errors='coerce').to_numpy(dtype=float)
+    gps_y = pd.to_numeric(df['GPSY'], errors='coerce').to_numpy(dtype=float)
+    formats = coordinate_formats(gps_x, gps_y)
+
+    # Domyślnie GPSX = długość, GPSY = szerokość (także gdy kolejności nie da się ustalić)
+    latitude = gps_y.copy()
+    longitude = gps_x.copy()
+
+    lat_lon = formats == COORDS_LAT_LON
+    latitude[lat_lon] = gps_x[lat_lon]
+    longitude[lat_lon] = gps_y[lat_lon]
+
+    utm = formats == COORDS_UTM
+    if utm.any():
+        latitude[utm], longitude[utm] = utm_to_wgs84(gps_x[utm], gps_y[utm])
+
+    invalid = formats == COORDS_INVALID
+    latitude[invalid] = np.nan
+    longitude[invalid] = np.nan
+
+    df['latitude'] = latitude
+    df['longitude'] = longitude
+    return df
+
+
+# Grupowanie punktów mapy - siatka w pikselach Web Mercator na danym poziomie zoomu
+MAP_TILE_SIZE = 256
+MAP_MAX_ZOOM = 18
+CLUSTER_CELL_PIXELS = 24
+
+
+def mercator_pixels(latitude, longitude, zoom):
+    """Współrzędne pikselowe punktów (Web Mercator) na poziomie zoom"""
+    scale = MAP_TILE_SIZE * 2.0 ** zoom
+    sin_lat = np.sin(np.radians(np.clip(latitude, -85.05112878, 85.05112878)))
+    x = (np.asarray(longitude, dtype=float) + 180) / 360 * scale
+    y = (0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * np.pi)) * scale
+    return x, y
+
+
+def cluster_points(latitude, longitude, zoom, cell_pixels=CLUSTER_CELL_PIXELS):
+    """Grupuje punkty w komórki siatki cell_pixels x cell_pixels pikseli na poziomie zoom.
+
+    Zwraca (numer grupy każdego punktu, liczba punktów w grupie,
+    średnia szerokość grupy, średnia długość grupy).
+    """
+    latitude = np.asarray(latitude, dtype=float)
+    longitude = np.asarray(longitude, dtype=float)
+    x, y = mercator_pixels(latitude, longitude, zoom)
+
+    cells_per_row = int(MAP_TILE_SIZE * 2 ** zoom // cell_pixels) + 1
+    cells = ((x // cell_pixels).astype(np.int64) * cells_per_row
+             + (y // cell_pixels).astype(np.int64))
+    _, labels, counts = np.unique(cells, return_inverse=True, return_counts=True)
+
+    cluster_latitude = np.bincount(labels, weights=latitude) / counts
+    cluster_longitude = np.bincount(labels, weights=longitude) / counts
+    return labels, counts, cluster_latitude, cluster_longitude
+
+
+def cluster_points_within(latitude, longitude, max_clusters, max_zoom=MAP_MAX_ZOOM):
+    """Grupowanie na największym zoomie, przy którym grup jest najwyżej max_clusters.
+
+    Liczba grup rośnie z zoomem, więc zoom wybierany jest wyszukiwaniem binarnym.
+    Zwraca (zoom, wynik cluster_points).
+    """
+    low, high = 0, max_zoom
+    best = (0, cluster_points(latitude, longitude, 0))
+    while low <= high:
+        zoom = (low + high) // 2
+        clusters = cluster_points(latitude, longitude, zoom)
+        if len(clusters[1]) <= max_clusters:
+            best = (zoom, clusters)
+            low = zoom + 1
+        else:
+            high = zoom - 1
+    return best
+
+
+# Adresy - znormalizowane miasto i klucz adresu (int64) liczone raz przy ładowaniu
+ADDRESS_COLUMNS = ['Postal', 'City Name', 'Street Name', 'Street Num']
+CITY_KEY_COLUMN = '_city_key'
+ADDRESS_KEY_COLUMN = '_address_key'
+# Kolumny pomocnicze - nie są pokazywane ani eksportowane
+INTERNAL_COLUMNS = [CITY_KEY_COLUMN, ADDRESS_KEY_COLUMN]
+# Litery, których NFKD nie rozkłada na literę bazową + znak diakrytyczny
+TRANSLITERATION = str.maketrans({'ł': 'l', 'Ł': 'L'})
+
+
+def normalize_address_text(values):
+    """Tekst do porównań adresów: bez wielkości liter, nadmiarowych spacji i polskich znaków.
+
+    Normalizacja liczona tylko dla unikalnych wartości; brak wartości -> ''.
+    """
+    codes, uniques = pd.factorize(values)
+    normalized = (pd.Series(np.asarray(uniques, dtype=object), dtype=object).astype(str)
+                  .str.translate(TRANSLITERATION)
+                  .str.normalize('NFKD').str.encode('ascii', 'ignore').str.decode('ascii')
+                  .str.casefold().str.split().str.join(' '))
+    result = np.append(normalized.to_numpy(dtype=object), '')[codes]
+    return pd.Series(result, index=values.index, dtype=object)
+
+
+# Miasto liczone w statystykach osobno (kolumna WROCLAW), porównywane po normalizacji
+HOME_CITY = 'WROCLAW'
+HOME_CITY_KEY = normalize_address_text(pd.Series([HOME_CITY])).iloc[0]
+
+
+def add_address_keys(df):
+    """Dopisuje znormalizowane miasto i klucz adresu (hash znormalizowanych kolumn adresowych).
+
+    Klucz adresu powstaje tylko przy City Name + co najmniej jednej innej kolumnie adresowej.
+    """
+    df[CITY_KEY_COLUMN] = normalize_address_text(df['City Name']).astype('category')
+
+    available_columns = [col for col in ADDRESS_COLUMNS if col in df.columns]
+    if len(available_columns) >= 2:
+        normalized = pd.DataFrame({col: normalize_address_text(df[col])
+                                   for col in available_columns})
+        df[ADDRESS_KEY_COLUMN] = pd.util.hash_pandas_object(
+            normalized, index=False).to_numpy().view(np.int64)
+    elif ADDRESS_KEY_COLUMN in df.columns:
+        df = df.drop(columns=ADDRESS_KEY_COLUMN)
+    return df
+
+
+def visible_columns(df):
+    """Kolumny do wyświetlenia i eksportu (bez kolumn pomocniczych)"""
+    return [col for col in df.columns if col not in INTERNAL_COLUMNS]
+
+
+# Kolumny o niewielu unikalnych wartościach trzymane jako pandas categorical
+CATEGORICAL_COLUMNS = ['Driver ID:', 'City Name', 'Exception info', 'Postal']
+
+
+def add_categories(df):
+    """Kolumny o niewielu unikalnych wartościach jako pandas categorical"""
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns and df[col].dtype == 'object':
+            if df[col].nunique() <= len(df) // 2:
+                df[col] = df[col].astype('category')
+    return df
+
+
+def normalize_sheet(df, categories=True):
+    """Jednorazowa normalizacja arkusza przy ładowaniu: daty/czas z Excela, współrzędne
+    geograficzne, klucze adresów i kolumny kategoryczne (categories=False - bez nich)"""
+    for col in df.columns:
+        if col.upper() == 'DATA' and pd.api.types.is_numeric_dtype(df[col]):
+            # Konwertuj daty Excel na prawidłowe daty
+            df[col] = pd.to_datetime(
+                '1900-01-01') + pd.to_timedelta(df[col] - 2, unit='D')
+        elif col.upper() == 'TIME' and pd.api.types.is_numeric_dtype(df[col]):
+            # Konwertuj czas Excel na prawidłowy czas
+            df[col] = pd.to_datetime(
+                '1900-01-01') + pd.to_timedelta(df[col], unit='D')
+            df[col] = df[col].dt.time
+
+    # Współrzędne geograficzne liczone raz przy ładowaniu, nie przy każdym rysowaniu mapy
+    if 'GPSX' in df.columns and 'GPSY' in df.columns:
+        df = add_geographic_coordinates(df)
+
+    # Klucze adresów - unikalne adresy liczone na liczbach całkowitych
+    if 'City Name' in df.columns:
+        df = add_address_keys(df)
+
+    # Kategorie - mniej pamięci i szybsze ==/isin/value_counts/groupby
+    if categories:
+        df = add_categories(df)
+
+    return df
+
+
+def extract_driver_name(driver_id):
+    """Wyciąga część nazwy Driver ID od 6 do 8 znaku"""
+    driver_str = str(driver_id)
+    if len(driver_str) >= 8:
+        return driver_str[5:8]  # od 6 do 8 znaku (indeksy 5-7)
+    elif len(driver_str) >= 5:
+        return driver_str[5:]   # od 6 znaku do końca
+    else:
+        return driver_str       # cała nazwa jeśli krótsza niż 5 znaków
+
+
+def find_date_column(df):
+    """Zwraca nazwę kolumny z datami (DATA lub zawierającą 'date') albo None"""
+    for col in df.columns:
+        if col.upper() == 'DATA' or 'date' in col.lower():
+            return col
+    return None
+
+
+def address_counts(df, by=None):
+    """Unikalne adresy (klucz adresu + data) w mieście HOME_CITY i łącznie.
+
+    by - kolumna grupująca (np. 'Driver ID:') albo None dla całej ramki. Bez pełnych
+    danych adresowych liczone są wiersze według miasta. Zwraca (w HOME_CITY, łącznie,
+    tryb) - liczby albo Series indeksowane wartościami by; tryb to 'address_date',
+    'address' albo 'rows' (co faktycznie policzono).
+    """
+    if CITY_KEY_COLUMN not in df.columns:
+        # Arkusz wczytany jako tekst (bez normalizacji) - klucze liczone na kopii
+        df = add_address_keys(df.copy())
+
+    keys = pd.DataFrame({'home': (df[CITY_KEY_COLUMN] == HOME_CITY_KEY).to_numpy()})
+    if by is not None:
+        keys['by'] = df[by].to_numpy()
+    mode = 'rows'
+    if ADDRESS_KEY_COLUMN in df.columns:
+        # Adres (+ data) = para liczb całkowitych - drop_duplicates bez porównywania tekstów
+        keys['address'] = df[ADDRESS_KEY_COLUMN].to_numpy()
+        mode = 'address'
+        date_column = find_date_column(df)
+        if date_column:
+            keys['date'] = pd.factorize(df[date_column])[0]
+            mode = 'address_date'
+        keys = keys.drop_duplicates(subset=[col for col in keys.columns if col != 'home'])
+
+    if by is None:
+        return int(keys['home'].sum()), len(keys), mode
+    grouped = keys.groupby('by', sort=False, observed=True)['home']
+    return grouped.sum(), grouped.size(), mode
+
+
+def filter_stage(df, stage, params):
+    """Jeden etap filtrowania: 'date' (kolumna, opcja, daty), 'driver' (Driver ID)
+    lub 'exceptions' (krotka wartości Exception info)"""
+    if stage == 'date':
+        date_column, date_option, selected_dates = params
+        if date_option == "Tylko soboty":
+            # 5 = sobota
+            return df[df[date_column].dt.dayofweek == 5]
+
+        # Porównanie na datetime64 (północ danego dnia) zamiast obiektów date
+        days = df[date_column].dt.normalize()
+        if isinstance(selected_dates, tuple) and len(selected_dates) == 2:
+            start_date, end_date = selected_dates
+            return df[(days >= pd.Timestamp(start_date)) & (days <= pd.Timestamp(end_date))]
+        if isinstance(selected_dates, tuple) and len(selected_dates) == 1:
+            # Zakres w trakcie wybierania - tylko pierwszy dzień
+            selected_dates = selected_dates[0]
+        if selected_dates:
+            return df[days == pd.Timestamp(selected_dates)]
+        return df
+
+    if stage == 'driver':
+        return df[df['Driver ID:'] == params]
+
+    if stage == 'exceptions':
+        return df[df['Exception info'].isin(params)]
+
+    raise ValueError(f"Nieznany etap filtrowania: {stage}")
+
+
+def apply_filters(df, saturdays_only=False, date_range=None, driver=None,
+                  exceptions=DEFAULT_EXCEPTIONS):
+    """Stosuje filtry w kolejności aplikacji: daty -> kierowca -> Exception info"""
+    date_column = find_date_column(df)
+    if date_column is not None:
+        if saturdays_only:
+            df = filter_stage(df, 'date', (date_column, "Tylko soboty", None))
+        elif date_range:
+            df = filter_stage(df, 'date', (date_column, "Niestandardowy wybór", tuple(date_range)))
+
+    if driver is not None and 'Driver ID:' in df.columns:
+        df = filter_stage(df, 'driver', driver)
+
+    if exceptions and 'Exception info' in df.columns:
+        # Jak w aplikacji - filtruj tylko po wartościach obecnych w danych
+        available = [exc for exc in exceptions if exc in df['Exception info'].values]
+        if available:
+            df = filter_stage(df, 'exceptions', tuple(available))
+
+    return df
+
+
+# Trasy kierowców
+EARTH_RADIUS_KM = 6371.0088
+# Przerwa między kolejnymi przystankami dłuższa niż tyle minut liczy się jako przestój
+IDLE_GAP_MINUTES = 30
+NS_PER_MINUTE = 60 * 10 ** 9
+NS_PER_DAY = 24 * 60 * NS_PER_MINUTE
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Odległość po kole wielkim w km (tablice numpy w stopniach)"""
+    lat1, lon1, lat2, lon2 = (np.radians(a) for a in (lat1, lon1, lat2, lon2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2 +
+         np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def stop_timestamps(df, date_column):
+    """Czas przystanku: data z date_column + godzina z TIME (NaT gdy brak daty)"""
+    dates = pd.to_datetime(df[date_column], errors='coerce')
+    if 'TIME' not in df.columns:
+        return dates
+
+    times = df['TIME']
+    if pd.api.types.is_datetime64_any_dtype(times):
+        offsets = times - times.dt.normalize()
+    else:
+        # Obiekty time - sekundy liczone tylko dla unikalnych wartości (najwyżej 86400)
+        codes, uniques = pd.factorize(times)
+        unique_seconds = np.array([
+            value.hour * 3600 + value.minute * 60 + value.second + value.microsecond / 1e6
+            if isinstance(value, dt_time) else np.nan
+            for value in uniques], dtype=float)
+        seconds = np.where(codes >= 0, unique_seconds[codes.clip(min=0)], np.nan)
+        offsets = pd.Series(pd.to_timedelta(seconds, unit='s'), index=df.index)
+    return dates.dt.normalize() + offsets.fillna(pd.Timedelta(0))
+
+
+def route_legs(df):
+    """Przystanki kierowców posortowane po dacie i godzinie, z odcinkiem od poprzedniego.
+
+    Trasa to jeden dzień jednego kierowcy; kolejne wiersze w tym samym miejscu i czasie
+    są jednym przystankiem. Zwraca ramkę (indeks = etykieta pierwszego wiersza przystanku)
+    z kolumnami Driver ID:, timestamp, latitude, longitude, Leg Km i Leg Minutes
+    (NaN dla pierwszego przystanku trasy) albo None, gdy brakuje współrzędnych lub daty.
+    Wiersze ze współrzędnymi spoza Polski (in_poland) są pomijane.
+    """
+    date_column = find_date_column(df)
+    if (date_column is None or 'Driver ID:' not in df.columns
+            or 'latitude' not in df.columns or 'longitude' not in df.columns):
+        return None
+
+    timestamps = stop_timestamps(df, date_column)
+    # Tylko wiarygodne punkty - jeden fix 0/0 w środku dnia dodałby tysiące km do trasy
+    valid = (df['Driver ID:'].notna() & timestamps.notna()).to_numpy() & in_poland(
+        df['latitude'], df['longitude'])
+
+    driver_codes, driver_ids = pd.factorize(df['Driver ID:'][valid])
+    times = timestamps[valid].to_numpy(dtype='datetime64[ns]').view(np.int64)
+    latitude = df['latitude'].to_numpy(dtype=float)[valid]
+    longitude = df['longitude'].to_numpy(dtype=float)[valid]
+    labels = df.index.to_numpy()[valid]
+
+    # Sortowanie: kierowca, potem czas (stabilne - kolejność wierszy w obrębie czasu)
+    order = np.lexsort((times, driver_codes))
+    driver_codes, times, latitude, longitude, labels = (
+        a[order] for a in (driver_codes, times, latitude, longitude, labels))
+
+    # Zwiń kolejne wiersze tego samego przystanku (ten sam kierowca, czas i miejsce)
+    same_stop = ((driver_codes[1:] == driver_codes[:-1]) & (times[1:] == times[:-1]) &
+                 (latitude[1:] == latitude[:-1]) & (longitude[1:] == longitude[:-1]))
+    keep = np.ones(len(times), dtype=bool)
+    keep[1:] = ~same_stop
+    driver_codes, times, latitude, longitude, labels = (
+        a[keep] for a in (driver_codes, times, latitude, longitude, labels))
+
+    same_route = ((driver_codes[1:] == driver_codes[:-1]) &
+                  (times[1:] // NS_PER_DAY == times[:-1] // NS_PER_DAY))
+    leg_km = np.full(len(times), np.nan)
+    leg_minutes = np.full(len(times), np.nan)
+    leg_km[1:] = np.where(same_route, haversine_km(
+        latitude[:-1], longitude[:-1], latitude[1:], longitude[1:]), np.nan)
+    leg_minutes[1:] = np.where(same_route, np.diff(times) / NS_PER_MINUTE, np.nan)
+
+    return pd.DataFrame({
+        'Driver ID:': np.asarray(driver_ids, dtype=object)[driver_codes],
+        'timestamp': times.view('datetime64[ns]'),
+        'latitude': latitude,
+        'longitude': longitude,
+        'Leg Km': leg_km,
+        'Leg Minutes': leg_minutes,
+    }, index=labels)
+
+
+def route_metrics(df):
+    """Metryki tras per kierowca (indeks = Driver ID:): km, godziny tras, średni czas
+    odcinka i przestoje dłuższe niż IDLE_GAP_MINUTES; None gdy brak danych do tras"""
+    legs = route_legs(df)
+    if legs is None:
+        return None
+
+    driver_codes, driver_ids = pd.factorize(legs['Driver ID:'])
+    is_leg = legs['Leg Km'].notna().to_numpy()
+    leg_drivers = driver_codes[is_leg]
+    leg_km = legs['Leg Km'].to_numpy()[is_leg]
+    leg_minutes = legs['Leg Minutes'].to_numpy()[is_leg]
+    idle = leg_minutes > IDLE_GAP_MINUTES
+
+    # Sumy per kierowca jednym bincount zamiast groupby
+    n = len(driver_ids)
+    leg_count = np.bincount(leg_drivers, minlength=n)
+    route_minutes = np.bincount(leg_drivers, weights=leg_minutes, minlength=n)
+    average_minutes = np.divide(route_minutes, leg_count,
+                                out=np.zeros(n), where=leg_count > 0)
+
+    return pd.DataFrame({
+        'Route Km': np.bincount(leg_drivers, weights=leg_km, minlength=n).round(1),
+        'Route Hours': (route_minutes / 60).round(2),
+        'Avg Leg Minutes': average_minutes.round(1),
+        'Idle Gaps': np.bincount(leg_drivers[idle], minlength=n),
+    }, index=pd.Index(np.asarray(driver_ids, dtype=object), name='Driver ID:'))
+
+
+def driver_summary(df):
+    """Podsumowanie wszystkich kierowców jednym przebiegiem groupby"""
+    df = df[df['Driver ID:'].notna()]
+    grouped = df.groupby('Driver ID:', sort=False, observed=True)
+
+    # Kolejność kierowców jak w danych (jak .unique())
+    summary = grouped.size().to_frame('Total Rows')
+
+    # Liczba wyjątków
+    if 'Exception info' in df.columns:
+        has_exception = df['Exception info'].notna() & (df['Exception info'] != '')
+        summary['Exception Count'] = has_exception.groupby(
+            df['Driver ID:'], sort=False, observed=True).sum()
+    else:
+        summary['Exception Count'] = 0
+
+    # Statystyki miast - unikalne adresy w obrębie kierowcy = unikalne (kierowca, adres)
+    if 'City Name' in df.columns:
+        home_addresses, all_addresses, _ = address_counts(df, by='Driver ID:')
+        summary['WROCLAW'] = home_addresses
+        summary['Wioski'] = all_addresses - summary['WROCLAW']
+    else:
+        summary['WROCLAW'] = 0
+        summary['Wioski'] = 0
+
+    # Metryki tras - tylko gdy są współrzędne i data przystanków
+    metrics = route_metrics(df)
+    route_columns = []
+    if metrics is not None:
+        route_columns = list(metrics.columns)
+        # reindex wstawia NaN dla kierowców bez tras - liczniki (np. Idle Gaps) wracają do int
+        count_dtypes = {col: dtype for col, dtype in metrics.dtypes.items()
+                        if pd.api.types.is_integer_dtype(dtype)}
+        metrics = metrics.reindex(summary.index.astype(object)).fillna(0).astype(count_dtypes)
+        for col in route_columns:
+            summary[col] = metrics[col].to_numpy()
+
+    # Skrócona nazwa + oryginalna w nawiasach
+    short_names = summary.index.map(extract_driver_name)
+    summary.insert(0, 'Driver ID', [
+        f"{short} ({driver_id})" for short, driver_id in zip(short_names, summary.index)])
+    summary['Driver ID_short'] = list(short_names)
+    summary = summary[['Driver ID', 'Exception Count', 'WROCLAW', 'Wioski', 'Total Rows'] +
+                      route_columns + ['Driver ID_short']].reset_index(drop=True)
+
+    # Sortuj według skróconych nazw Driver ID alfabetycznie
+    return summary.sort_values('Driver ID_short').drop('Driver ID_short', axis=1)
+
+
+class TrackingIndex:
+    """Indeks numerów przesyłek arkusza do szybkiego wyszukiwania śladu.
+
+    Numery (bez rozróżniania wielkości liter) trzymane są jako posortowana tablica
+    unikalnych wartości z mapą numer -> pozycja i listami wierszy w układzie CSR.
+    Wyszukiwanie fragmentu numeru korzysta z indeksu trigramów (posortowane pary
+    trigram -> numer).
+    """
+
+    def __init__(self, numbers):
+        values = numbers.astype(str)
+        keys = values.str.strip().str.lower()
+        codes, uniques = pd.factorize(keys, sort=True)
+
+        # Wiersze każdego unikalnego numeru: row_labels[offsets[i]:offsets[i + 1]]
+        order = np.argsort(codes, kind='stable')
+        self._row_labels = numbers.index.to_numpy()[order]
+        self._offsets = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+
+        self._keys = np.asarray(uniques, dtype=object)
+        # Numer w oryginalnej postaci (pierwsze wystąpienie) do wyświetlania sugestii
+        self._display = values.to_numpy()[order[self._offsets[:-1]]]
+        self._positions = dict(zip(self._keys.tolist(), range(len(self._keys))))
+        # Ten sam słownik w wersji pandas - złączenie wielu numerów jednym get_indexer
+        self._key_index = pd.Index(self._keys)
+        # Wspólna długość numerów (typowo stała dla numerów przesyłek), None gdy różne
+        key_lengths = pd.Series(self._keys, dtype=object).str.len()
+        self._key_length = (int(key_lengths.iloc[0])
+                            if len(key_lengths) > 0 and key_lengths.nunique() == 1 else None)
+
+        self._build_trigrams()
+
+        # Przybliżony rozmiar w pamięci (tablice + napisy numerów i słownik pozycji) -
+        # liczony raz, indeks się nie zmienia
+        arrays = (self._row_labels, self._offsets, self._keys, self._display,
+                  self._gram_keys, self._gram_ids)
+        strings = sum(map(sys.getsizeof, self._keys.tolist()))
+        self._nbytes = sum(a.nbytes for a in arrays) + 2 * strings + sys.getsizeof(self._positions)
+
+    def memory_bytes(self):
+        """Przybliżony rozmiar indeksu w pamięci (policzony przy budowie)"""
+        return self._nbytes
+
+    def _build_trigrams(self):
+        """Buduje posortowaną listę (trigram, numer) na macierzy bajtów numerów"""
+        encoded = np.array([key.encode('utf-8') for key in self._keys.tolist()])
+        width = encoded.dtype.itemsize
+        if len(encoded) == 0 or width < 3:
+            self._gram_keys = np.empty(0, dtype=np.int32)
+            self._gram_ids = np.empty(0, dtype=np.int64)
+            return
+
+        chars = encoded.view(np.uint8).reshape(len(encoded), width).astype(np.int32)
+        grams = (chars[:, :-2] << 16) | (chars[:, 1:-1] << 8) | chars[:, 2:]
+        # Krótsze numery są dopełnione zerami - takie trigramy pomijamy
+        valid = chars[:, 2:] != 0
+        ids = np.broadcast_to(np.arange(len(encoded))[:, None], grams.shape)
+
+        grams = grams[valid]
+        ids = ids[valid]
+        order = np.argsort(grams, kind='stable')
+        self._gram_keys = grams[order]
+        self._gram_ids = ids[order]
+
+    def _substring_ids(self, query):
+        """Pozycje unikalnych numerów zawierających query (posortowane)"""
+        if len(query) == self._key_length:
+            # Wszystkie numery tej samej długości - wystarczy dokładne trafienie w mapie
+            if query in self._positions:
+                return np.array([self._positions[query]], dtype=np.int64)
+            return np.empty(0, dtype=np.int64)
+
+        query_bytes = query.encode('utf-8')
+        if len(query_bytes) < 3:
+            # Za krótkie na trigramy - skan po unikalnych numerach
+            matches = pd.Series(self._keys).str.contains(query, regex=False)
+            return np.flatnonzero(matches.to_numpy())
+
+        # np.int32 - porównanie z intem Pythona kopiowałoby całą tablicę do int64
+        query_grams = {np.int32((query_bytes[i] << 16) | (query_bytes[i + 1] << 8) | query_bytes[i + 2])
+                       for i in range(len(query_bytes) - 2)}
+        ranges = []
+        for gram in query_grams:
+            lo = np.searchsorted(self._gram_keys, gram, side='left')
+            hi = np.searchsorted(self._gram_keys, gram, side='right')
+            if lo == hi:
+                return np.empty(0, dtype=np.int64)
+            ranges.append((hi - lo, lo, hi))
+
+        # Zacznij od najrzadszego trigramu, potem zawężaj kandydatów (listy są posortowane,
+        # więc przecięcie to searchsorted kandydatów w kolejnej liście)
+        ranges.sort()
+        candidates = np.unique(self._gram_ids[ranges[0][1]:ranges[0][2]])
+        for _, lo, hi in ranges[1:]:
+            posting = self._gram_ids[lo:hi]
+            found = np.searchsorted(posting, candidates).clip(max=len(posting) - 1)
+            candidates = candidates[posting[found] == candidates]
+            if len(candidates) == 0:
+                return candidates
+
+        # Trigramy to warunek konieczny - potwierdź dopasowanie na kandydatach
+        return np.array([i for i in candidates.tolist() if query in self._keys[i]],
+                        dtype=np.int64)
+
+    def _rows(self, ids):
+        """Etykiety wierszy (rosnąco) dla pozycji unikalnych numerów"""
+        if len(ids) == 0:
+            return self._row_labels[:0]
+        ids = np.asarray(ids)
+        starts = self._offsets[ids]
+        counts = self._offsets[ids + 1] - starts
+        # Rozwinięcie zakresów [start, start + count) bez pętli
+        within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        rows = self._row_labels[np.repeat(starts, counts) + within]
+        return np.sort(rows)
+
+    def find(self, query):
+        """Etykiety wierszy, których numer zawiera query (bez rozróżniania wielkości liter)"""
+        query = str(query).strip().lower()
+        if not query or len(self._keys) == 0:
+            return self._row_labels[:0]
+        return self._rows(self._substring_ids(query))
+
+    def find_many(self, queries):
+        """Dokładne dopasowanie wielu numerów naraz.
+
+        Zwraca etykiety wierszy wszystkich znalezionych numerów oraz maskę
+        (dla każdego numeru z queries), czy numer występuje w arkuszu.
+        """
+        keys = pd.Series(list(queries), dtype=object).astype(str).str.strip().str.lower()
+        positions = self._key_index.get_indexer(keys)
+        found = positions >= 0
+        return self._rows(np.unique(positions[found])), found
+
+    def suggest(self, query, limit=5):
+        """Podobne numery: zawierające query albo o najdłuższym wspólnym prefiksie"""
+        query = str(query).strip().lower()
+        if not query or len(self._keys) == 0:
+            return []
+
+        ids = self._substring_ids(query)
+        if len(ids) > 0:
+            return self._display[ids[:limit]].tolist()
+
+        # Sąsiedzi w posortowanej tablicy mają najdłuższy wspólny prefiks z query
+        position = int(np.searchsorted(self._keys, query))
+        neighbours = range(max(position - limit, 0), min(position + limit, len(self._keys)))
+        min_prefix = max(3, len(query) // 2)
+        scored = []
+        for i in neighbours:
+            key = self._keys[i]
+            prefix = 0
+            while prefix < min(len(key), len(query)) and key[prefix] == query[prefix]:
+                prefix += 1
+            if prefix >= min_prefix:
+                scored.append((-prefix, i))
+        return [self._display[i] for _, i in sorted(scored)[:limit]]
+
+
+def parse_tracking_numbers(text, csv_file=None):
+    """Lista numerów przesyłek (bez powtórzeń, w kolejności) z wklejonego tekstu i/lub pliku CSV"""
+    numbers = []
+    if text:
+        numbers.extend(re.split(r'[\s,;]+', text))
+    if csv_file is not None:
+        numbers_df = pd.read_csv(csv_file, dtype=str, header=None, sep=r'[,;\t]', engine='python')
+        # Kolumna 'Numer' jeśli plik ma taki nagłówek, w przeciwnym razie pierwsza kolumna
+        header = [str(value).strip() for value in numbers_df.iloc[0]] if len(numbers_df) else []
+        if 'Numer' in header:
+            numbers.extend(numbers_df.iloc[1:, header.index('Numer')].dropna().tolist())
+        else:
+            numbers.extend(numbers_df.iloc[:, 0].dropna().tolist())
+    numbers = [str(number).strip() for number in numbers]
+    return list(dict.fromkeys(number for number in numbers if number))
+
+
+# Projekcja kolumn przy ładowaniu - aplikacja i CLI korzystają tylko z tych kolumn.
+# nazwa -> typ docelowy przekazywany do czytnika (None = typ z pliku, np. liczby dat Excela)
+USED_COLUMNS = {
+    'Driver ID:': str,
+    'DATA': None,
+    'TIME': None,
+    'Numer': str,
+    'GPSX': None,
+    'GPSY': None,
+    'Exception info': str,
+    'Exception': str,
+    'City Name': str,
+    'Postal': str,
+    'Street Name': str,
+    'Street Num': str,
+    'OPLD Consignee Name': str,
+    'Consignee Name': str,
+    'Consignee': str,
+}
+
+
+def projection_options(columns):
+    """Argumenty parse() wczytujące tylko kolumny ze schematu columns (słownik nazwa -> typ).
+
+    Kolumny z 'date' w nazwie zostają zawsze - po nich find_date_column szuka kolumny dat.
+    """
+    if columns is None:
+        return {}
+    names = set(columns)
+    return {
+        'usecols': lambda col: col in names or 'date' in str(col).lower(),
+        'dtype': {col: dtype for col, dtype in columns.items() if dtype is not None},
+    }
+
+
+def projection_key(columns):
+    """Krótki klucz schematu kolumn - osobny wpis cache dla każdej projekcji"""
+    if columns is None:
+        return None
+    schema = sorted((col, getattr(dtype, '__name__', str(dtype))) for col, dtype in columns.items())
+    return hashlib.sha256(json.dumps(schema).encode('utf-8')).hexdigest()[:12]
+
+
+# Trwały cache skoroszytów (Parquet per arkusz), kluczowany hashem zawartości pliku
+CACHE_DIR = os.environ.get(
+    'NOZYK_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'workbooks'))
+# Zmień przy każdej zmianie normalizacji danych przy ładowaniu albo zawartości eksportów
+# (pliki eksportu leżą w katalogu wersji) - stare wpisy przestaną pasować
+CACHE_VERSION = 4
+# Podkatalog plików eksportu w katalogu wersji (budżet EXPORT_FILES, nie prune_disk_cache)
+EXPORT_DIR_NAME = 'exports'
+# Budżet cache na dysku (MB) dla skoroszytów i zbiorów strumieniowych bieżącej wersji
+DISK_CACHE_MAX_MB = float(os.environ.get('NOZYK_DISK_CACHE_MAX_MB', 10240))
+# Skoroszyty i zbiory korzystające z katalogów cache: id -> obiekt (słabe referencje -
+# wpis znika z obiektem; Mapping nie jest hashowalne, stąd słownik po id)
+_disk_cache_users = weakref.WeakValueDictionary()
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def temporary_path(path):
+    """Unikalny plik tymczasowy obok path - zapis, a potem os.replace(tmp, path).
+
+    Sesje Streamlit to wątki jednego procesu, więc sam PID w nazwie nie wystarcza:
+    dwa równoczesne zapisy tej samej ścieżki muszą pisać do różnych plików.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                    prefix=f'{os.path.basename(path)}.', suffix='.tmp')
+    os.close(fd)
+    return tmp_path
+
+
+def frame_nbytes(df):
+    """Rozmiar ramki w pamięci w bajtach (z napisami w kolumnach object)"""
+    return int(df.memory_usage(deep=True).sum())
+
+
+class MemorySized:
+    """Rozmiar obiektu w pamięci liczony przyrostowo (memory_bytes() bez mierzenia).
+
+    CacheRegistry ustawia on_resize, żeby dowiadywać się o zmianach rozmiaru (np. leniwie
+    wczytany arkusz) w chwili zmiany, a nie przy każdym odczycie z cache.
+    """
+
+    _nbytes = 0
+    on_resize = None
+
+    def memory_bytes(self):
+        return self._nbytes
+
+    def _add_bytes(self, nbytes):
+        self._nbytes += nbytes
+        if self.on_resize is not None:
+            self.on_resize(self._nbytes)
+
+
+def file_content_hash(file):
+    """Liczy SHA-256 zawartości pliku, czytając go kawałkami"""
+    digest = hashlib.sha256()
+    file.seek(0)
+    while True:
+        chunk = file.read(HASH_CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+# Czytniki skoroszytów: silnik -> obsługiwane rozszerzenia plików
+#   pyxlsb / openpyxl / xlrd - pd.ExcelFile z danym silnikiem (openpyxl w trybie read-only)
+#   rows - surowe iterowanie wierszy (openpyxl iter_rows / pyxlsb rows), kolumny budowane od razu
+READER_ENGINES = {
+    'pyxlsb': {'xlsb'},
+    'openpyxl': {'xlsx'},
+    'xlrd': {'xls'},
+    'rows': {'xlsx', 'xlsb'},
+}
+# 'auto': .xls - xlrd, .xlsb - pyxlsb, .xlsx od ROW_READER_MIN_BYTES - iterowanie wierszy,
+# mniejsze .xlsx - openpyxl. Wiersze są szybsze o 20-40% od ~10k wierszy (1.7 MB) przy tej
+# samej pamięci (benchmarks/bench_reader_engines.py), a check_reader_parity.py przechodzi
+# dla .xlsx. .xlsb zostaje przy pyxlsb, dopóki parzystość nie jest sprawdzona na eksportach
+# z Excela (--file)
+ROW_READER_MIN_BYTES = 1 * BYTES_PER_MB
+
+
+def pick_reader_engine(file_extension, size, engine='auto'):
+    """Silnik odczytu dla pliku: podany wprost albo dobrany po rozszerzeniu i rozmiarze"""
+    if engine != 'auto':
+        if file_extension not in READER_ENGINES.get(engine, ()):
+            raise ValueError(f"Silnik {engine} nie obsługuje plików .{file_extension}")
+        return engine
+    if file_extension == 'xls':
+        return 'xlrd'
+    if file_extension == 'xlsb':
+        return 'pyxlsb'
+    return 'rows' if size >= ROW_READER_MIN_BYTES else 'openpyxl'
+
+
+class PandasReader:
+    """Arkusze przez pd.ExcelFile - jeden otwarty uchwyt dla wszystkich arkuszy"""
+
+    def __init__(self, data, engine):
+        self._excel_file = pd.ExcelFile(io.BytesIO(data), engine=engine)
+        self.sheet_names = list(self._excel_file.sheet_names)
+
+    def parse(self, sheet_name, usecols=None, dtype=None):
+        return self._excel_file.parse(sheet_name, usecols=usecols, dtype=dtype)
+
+
+def column_names(header):
+    """Nazwy kolumn z wiersza nagłówka jak w pandas: 'Unnamed: i' dla pustych, '.1' dla powtórzeń"""
+    names = []
+    seen = {}
+    for position, name in enumerate(header):
+        name = f'Unnamed: {position}' if name is None or name == '' else name
+        base = name
+        while name in seen:
+            seen[base] += 1
+            name = f'{base}.{seen[base]}'
+        seen[name] = 0
+        names.append(name)
+    return names
+
+
+def excel_cell_value(value):
+    """Wartość komórki jak w czytnikach Excela pandas: pusta -> '', liczba całkowita
+    zapisana jako float -> int"""
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def row_has_values(row):
+    """Czy surowy wiersz arkusza ma choć jedną niepustą komórkę"""
+    return any(value is not None and value != '' for value in row)
+
+
+def frame_from_rows(rows, usecols=None, dtype=None):
+    """Buduje ramkę z iteratora wierszy (pierwszy wiersz to nagłówek).
+
+    Wartości kolumn spoza usecols są pomijane od razu przy iterowaniu. Pozostałe trafiają
+    do TextParser - tego samego parsera co pd.read_excel - więc wartości NA ('#N/A', 'NA',
+    'null'...), liczby zapisane jako tekst i wartości logiczne dają te same typy.
+    """
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        return pd.DataFrame()
+    names = column_names([excel_cell_value(value) for value in header])
+    keep = [position for position, name in enumerate(names) if usecols is None or usecols(name)]
+
+    data = []
+    last_non_empty = 0
+    for row in rows:
+        data.append([excel_cell_value(row[position]) if position < len(row) else ''
+                     for position in keep])
+        # Pusty wiersz = pusty w całym arkuszu, nie tylko w wybranych kolumnach
+        if row_has_values(row):
+            last_non_empty = len(data)
+    # Puste wiersze na końcu arkusza nie są danymi (jak w pandas)
+    del data[last_non_empty:]
+
+    return TextParser(data, names=[names[position] for position in keep], header=None,
+                      dtype=dtype, skip_blank_lines=False).read()
+
+
+# Wartości komórek z błędem formuły (openpyxl read-only oddaje je jako tekst)
+EXCEL_ERROR_CODES = frozenset(openpyxl.cell.cell.ERROR_CODES)
+
+
+class RowReader:
+    """Surowe iterowanie wierszy: openpyxl iter_rows (read-only) dla .xlsx, pyxlsb dla .xlsb"""
+
+    def __init__(self, data, file_extension):
+        self._file_extension = file_extension
+        if file_extension == 'xlsb':
+            import pyxlsb
+            self._workbook = pyxlsb.open_workbook(io.BytesIO(data))
+            self.sheet_names = list(self._workbook.sheets)
+        else:
+            self._workbook = openpyxl.load_workbook(
+                io.BytesIO(data), read_only=True, data_only=True)
+            self.sheet_names = list(self._workbook.sheetnames)
+
+    def iter_rows(self, sheet_name):
+        """Wiersze arkusza jako listy/krotki wartości, jeden po drugim (pierwszy to nagłówek)"""
+        if self._file_extension == 'xlsb':
+            with self._workbook.get_sheet(sheet_name) as sheet:
+                for row in sheet.rows():
+                    yield [cell.v for cell in row]
+        else:
+            for row in self._workbook[sheet_name].iter_rows(values_only=True):
+                # Komórki z błędem formuły (np. #DIV/0!) - NaN jak w czytniku openpyxl pandas
+                yield [np.nan if isinstance(value, str) and value in EXCEL_ERROR_CODES else value
+                       for value in row]
+
+    def parse(self, sheet_name, usecols=None, dtype=None):
+        return frame_from_rows(self.iter_rows(sheet_name), usecols, dtype)
+
+
+def open_reader(data, file_name, engine='auto'):
+    """Otwiera czytnik skoroszytu wybranym (lub dobranym automatycznie) silnikiem"""
+    file_extension = file_name.split('.')[-1].lower()
+    engine = pick_reader_engine(file_extension, len(data), engine)
+    if engine == 'rows':
+        return RowReader(data, file_extension)
+    return PandasReader(data, engine)
+
+
+class SheetMapping(MemorySized, Mapping):
+    """Arkusze w pamięci (LazyWorkbook, MergedWorkbook) - wspólne ramki rozdawane jako płytkie
+    widoki i indeksy numerów przesyłek budowane raz na arkusz.
+
+    Podklasa ustawia _lock, _tracking_indexes i sheet_names oraz implementuje
+    _sheet(sheet_name) - wspólną ramkę arkusza (KeyError, gdy arkusza nie ma).
+    """
+
+    def tracking_index(self, sheet_name):
+        """Indeks numerów przesyłek arkusza (budowany raz, None gdy brak kolumny 'Numer')"""
+        with self._lock:
+            if sheet_name not in self._tracking_indexes:
+                dataframe = self._sheet(sheet_name)
+                index = TrackingIndex(dataframe['Numer']) if 'Numer' in dataframe.columns else None
+                self._tracking_indexes[sheet_name] = index
+                if index is not None:
+                    self._add_bytes(index.memory_bytes())
+            return self._tracking_indexes[sheet_name]
+
+    def __getitem__(self, sheet_name):
+        # Płytki widok - bez kopii danych, zmiany nie trafiają do wspólnej ramki
+        return self._sheet(sheet_name).copy(deep=False)
+
+    def __iter__(self):
+        return iter(list(self.sheet_names))
+
+    def __len__(self):
+        return len(self.sheet_names)
+
+
+class LazyWorkbook(SheetMapping):
+    """Arkusze skoroszytu wczytywane z jednego otwartego pliku, leniwie na żądanie"""
+
+    def __init__(self, data, file_name, cache_dir=None, on_warning=None, on_error=None,
+                 columns=None, engine='auto'):
+        # Surowe bajty pliku - uchwyt otwierany jest tylko raz i współdzielony przez arkusze
+        self._data = data
+        self.file_name = file_name
+        # Schemat kolumn (USED_COLUMNS) albo None - wszystkie kolumny
+        self._parse_options = projection_options(columns)
+        # Silnik odczytu (READER_ENGINES) albo 'auto' - dobór po rozszerzeniu i rozmiarze
+        self._engine = engine
+        self._reader = None
+        self._sheets = {}
+        # Pamięć: surowe bajty pliku + wczytane arkusze i indeksy (dodawane przy wczytaniu)
+        self._nbytes = len(data)
+        self._tracking_indexes = {}
+        # Skoroszyt współdzielony przez sesje - arkusz i indeks budowane tylko raz
+        self._lock = threading.RLock()
+        self._cache_dir = cache_dir
+        if cache_dir is not None:
+            # Katalog w użyciu - prune_disk_cache go nie usunie
+            self.disk_cache_dir = cache_dir
+            _disk_cache_users[id(self)] = self
+        # Komunikaty o problemach z arkuszami (aplikacja przekazuje st.warning/st.error)
+        self._on_warning = on_warning or logger.warning
+        self._on_error = on_error or logger.error
+
+        # Lista arkuszy z cache (bez otwierania pliku Excel) albo z samego skoroszytu
+        manifest = self._read_manifest()
+        if manifest is not None:
+            self.sheet_names = list(manifest['sheet_names'])
+        else:
+            self.sheet_names = list(self._open().sheet_names)
+            self._write_manifest()
+        self._all_sheet_names = list(self.sheet_names)
+
+    def _open(self):
+        """Zwraca otwarty czytnik skoroszytu (otwiera go przy pierwszym użyciu)"""
+        if self._reader is None:
+            self._reader = open_reader(self._data, self.file_name, self._engine)
+        return self._reader
+
+    def _read_manifest(self):
+        """Czyta listę arkuszy zapisaną w cache, None gdy jej nie ma"""
+        if self._cache_dir is None:
+            return None
+        try:
+            with open(os.path.join(self._cache_dir, 'manifest.json'), encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if manifest.get('version') != CACHE_VERSION:
+            return None
+        return manifest
+
+    def _write_manifest(self):
+        """Zapisuje listę arkuszy do cache (błędy zapisu są ignorowane)"""
+        if self._cache_dir is None:
+            return
+        manifest = {'version': CACHE_VERSION, 'file_name': self.file_name,
+                    'sheet_names': self.sheet_names}
+        path = os.path.join(self._cache_dir, 'manifest.json')
+        tmp_path = None
+        try:
+            os.makedirs(self._cache_dir, exist_ok=True)
+            tmp_path = temporary_path(path)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError:
+            if tmp_path is not None:
+                remove_file(tmp_path)
+
+    def _sheet_cache_path(self, sheet_name):
+        """Ścieżka pliku Parquet arkusza (po pozycji - nazwy arkuszy nie muszą być poprawnymi nazwami plików)"""
+        position = self._all_sheet_names.index(sheet_name)
+        return os.path.join(self._cache_dir, f'sheet_{position}.parquet')
+
+    def _read_cached_sheet(self, sheet_name):
+        """Wczytuje znormalizowany arkusz z cache, None gdy go nie ma"""
+        if self._cache_dir is None:
+            return None
+        path = self._sheet_cache_path(sheet_name)
+        if not os.path.exists(path):
+            return None
+        try:
+            dataframe = pd.read_parquet(path)
+        except Exception:
+            return None
+        dataframe.attrs['columns_fixed'] = True
+        return dataframe
+
+    def _write_cached_sheet(self, sheet_name, dataframe):
+        """Zapisuje znormalizowany arkusz do cache (błędy zapisu są ignorowane)"""
+        if self._cache_dir is None:
+            return
+        path = self._sheet_cache_path(sheet_name)
+        tmp_path = None
+        try:
+            tmp_path = temporary_path(path)
+            dataframe.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, path)
+        except Exception:
+            # Np. kolumna z typem, którego Arrow nie obsługuje - arkusz po prostu nie trafi do cache
+            if tmp_path is not None:
+                remove_file(tmp_path)
+
+    def load(self, sheet_name):
+        """Wczytuje arkusz z cache lub z otwartego uchwytu, zwraca None gdy się nie udało"""
+        with self._lock:
+            return self._load(sheet_name)
+
+    def _load(self, sheet_name):
+        if sheet_name in self._sheets:
+            return self._sheets[sheet_name]
+
+        with profile_stage('cache_read') as record:
+            dataframe = record['frame'] = self._read_cached_sheet(sheet_name)
+        if dataframe is not None:
+            self._store(sheet_name, dataframe)
+            return dataframe
+
+        reader = self._open()
+        try:
+            with profile_stage('parse') as record:
+                dataframe = record['frame'] = reader.parse(
+                    sheet_name, **self._parse_options)
+            # Napraw problematyczne kolumny
+            with profile_stage('fix_problematic_columns') as record:
+                dataframe = record['frame'] = fix_problematic_columns(dataframe)
+            with profile_stage('normalize_sheet') as record:
+                dataframe = record['frame'] = normalize_sheet(dataframe)
+            with profile_stage('cache_write'):
+                self._write_cached_sheet(sheet_name, dataframe)
+        except Exception as e:
+            self._on_warning(f"⚠️ Problem z arkuszem {sheet_name}: {str(e)}")
+            # Spróbuj załadować z domyślnymi ustawieniami
+            try:
+                dataframe = reader.parse(
+                    sheet_name, **{**self._parse_options, 'dtype': str})
+            except Exception:
+                self._on_error(f"❌ Nie udało się załadować arkusza {sheet_name}")
+                # Arkusz, którego nie da się wczytać, znika z listy
+                self.sheet_names.remove(sheet_name)
+                return None
+
+        self._store(sheet_name, dataframe)
+        return dataframe
+
+    def _store(self, sheet_name, dataframe):
+        self._sheets[sheet_name] = dataframe
+        self._add_bytes(frame_nbytes(dataframe))
+
+    def _sheet(self, sheet_name):
+        if sheet_name not in self.sheet_names:
+            raise KeyError(sheet_name)
+        dataframe = self.load(sheet_name)
+        if dataframe is None:
+            raise KeyError(sheet_name)
+        return dataframe
+
+
+def open_workbook(data, file_name, file_hash=None, use_cache=True,
+                  on_warning=None, on_error=None, columns=None, engine='auto'):
+    """Otwiera skoroszyt (z trwałego cache, jeśli jest) i od razu wczytuje pierwszy arkusz.
+
+    columns - schemat kolumn do wczytania (np. USED_COLUMNS), None wczytuje wszystkie.
+    engine - silnik odczytu z READER_ENGINES albo 'auto'.
+    """
+    cache_dir = None
+    if use_cache:
+        if file_hash is None:
+            file_hash = file_content_hash(io.BytesIO(data))
+        cache_name = file_hash if columns is None else f'{file_hash}_{projection_key(columns)}'
+        # Silniki mogą różnić się wynikiem - osobny wpis cache dla każdego
+        file_extension = file_name.split('.')[-1].lower()
+        cache_name = f'{cache_name}_{pick_reader_engine(file_extension, len(data), engine)}'
+        cache_dir = os.path.join(CACHE_DIR, f'v{CACHE_VERSION}', cache_name)
+        touch_cache_dir(cache_dir)
+
+    workbook = LazyWorkbook(data, file_name, cache_dir=cache_dir,
+                            on_warning=on_warning, on_error=on_error, columns=columns,
+                            engine=engine)
+
+    # Wczytaj pierwszy arkusz, który da się załadować (z niego korzysta aplikacja)
+    for sheet_name in list(workbook.sheet_names):
+        if workbook.load(sheet_name) is not None:
+            break
+
+    return workbook
+
+
+# Łączenie wielu skoroszytów (np. eksporty z całego tygodnia)
+SOURCE_COLUMN = 'Plik źródłowy'
+MERGED_SHEET_NAME = 'Połączone pliki'
+# Wiersze powtarzające się w kilku plikach rozpoznawane po tych kolumnach
+DEDUP_COLUMNS = ['Numer', 'DATA', 'TIME', 'Driver ID:']
+
+
+def load_first_sheet(data, file_name, file_hash=None, use_cache=True, columns=None,
+                     engine='auto'):
+    """Wczytuje pierwszy arkusz skoroszytu i zwraca (ramka albo None, komunikaty).
+
+    Komunikaty są zbierane zamiast wyświetlane - funkcja działa w wątkach roboczych.
+    """
+    messages = []
+    workbook = open_workbook(
+        data, file_name, file_hash=file_hash, use_cache=use_cache, columns=columns,
+        engine=engine, on_warning=lambda message: messages.append((logging.WARNING, message)),
+        on_error=lambda message: messages.append((logging.ERROR, message)))
+    if len(workbook) == 0:
+        return None, messages
+    return workbook[next(iter(workbook))], messages
+
+
+def merge_sheets(frames):
+    """Łączy ramki z wielu plików w jedną z kolumną pliku źródłowego i bez duplikatów.
+
+    frames to lista (nazwa pliku, ramka); z powtórzonych wierszy zostaje pierwszy.
+    Zwraca (połączona ramka, liczba usuniętych duplikatów).
+    """
+    merged = pd.concat(
+        [dataframe.assign(**{SOURCE_COLUMN: file_name}) for file_name, dataframe in frames],
+        ignore_index=True)
+
+    dedup_columns = [col for col in DEDUP_COLUMNS if col in merged.columns]
+    duplicates = 0
+    if dedup_columns:
+        total_rows = len(merged)
+        merged = merged.drop_duplicates(subset=dedup_columns).reset_index(drop=True)
+        duplicates = total_rows - len(merged)
+
+    # Kategorie z różnych plików łączą się w object - znormalizuj ponownie całość
+    merged.attrs.pop('columns_fixed', None)
+    with profile_stage('fix_problematic_columns') as record:
+        merged = record['frame'] = fix_problematic_columns(merged)
+    with profile_stage('normalize_sheet') as record:
+        merged = record['frame'] = normalize_sheet(merged)
+    merged[SOURCE_COLUMN] = merged[SOURCE_COLUMN].astype('category')
+    return merged, duplicates
+
+
+class MergedWorkbook(SheetMapping):
+    """Pierwsze arkusze wielu skoroszytów połączone w jeden arkusz (interfejs jak LazyWorkbook)"""
+
+    def __init__(self, dataframe, file_names, duplicates=0):
+        self.file_names = file_names
+        self.duplicates = duplicates
+        self.sheet_names = [MERGED_SHEET_NAME]
+        self._sheets = {MERGED_SHEET_NAME: dataframe}
+        self._nbytes = frame_nbytes(dataframe)
+        self._tracking_indexes = {}
+        self._lock = threading.Lock()
+
+    def _sheet(self, sheet_name):
+        return self._sheets[sheet_name]
+
+
+def open_merged_workbook(files, use_cache=True, max_workers=None,
+                         on_warning=None, on_error=None, columns=None, engine='auto'):
+    """Wczytuje równolegle pierwsze arkusze wielu skoroszytów i łączy je w jeden zbiór.
+
+    files to lista (bajty, nazwa pliku, hash zawartości albo None). Wątki zamiast procesów:
+    ramki nie są kopiowane między procesami, a odczyt z cache Parquet zwalnia GIL.
+    """
+    on_warning = on_warning or logger.warning
+    on_error = on_error or logger.error
+    max_workers = max_workers or min(len(files), os.cpu_count() or 1)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(
+            lambda file: load_first_sheet(file[0], file[1], file[2], use_cache, columns, engine),
+            files))
+
+    frames = []
+    for (_, file_name, _), (dataframe, messages) in zip(files, results):
+        # Komunikaty z wątków wyświetlane w wątku wywołującym
+        for level, message in messages:
+            (on_error if level >= logging.ERROR else on_warning)(f"{file_name}: {message}")
+        if dataframe is None:
+            on_error(f"❌ Pominięto plik {file_name} - brak arkusza do wczytania")
+        else:
+            frames.append((file_name, dataframe))
+
+    if not frames:
+        return None
+
+    merged, duplicates = merge_sheets(frames)
+    return MergedWorkbook(merged, [file_name for file_name, _ in frames], duplicates)
+
+
+# Ładowanie strumieniowe - skoroszyty większe niż pamięć. Wiersze czytane po kolei,
+# zapisywane jako grupy wierszy Parquet; filtry wykonywane jako skan pyarrow.
+STREAM_CHUNK_ROWS = 50000
+STREAM_DIR_NAME = 'stream'
+# Numer wiersza w arkuszu - indeks ramki po skanie (jak przy zwykłym ładowaniu)
+ROW_COLUMN = '_row'
+STREAM_FLOAT_COLUMNS = ['GPSX', 'GPSY', 'latitude', 'longitude']
+
+
+def stream_arrow_type(col):
+    """Stały typ kolumny w pliku strumieniowym - wszystkie kawałki muszą mieć ten sam schemat"""
+    if col.upper() == 'DATA':
+        return pa.timestamp('ns')
+    if col.upper() == 'TIME':
+        return pa.time64('us')
+    if col in STREAM_FLOAT_COLUMNS:
+        return pa.float64()
+    if col in (ADDRESS_KEY_COLUMN, ROW_COLUMN):
+        return pa.int64()
+    return pa.string()
+
+
+def time_objects(values):
+    """Kolumna TIME jako obiekty time albo None (konwersja tylko unikalnych wartości)"""
+    codes, uniques = pd.factorize(values)
+    uniques = np.array([value if isinstance(value, dt_time) else None for value in uniques]
+                       + [None], dtype=object)
+    return uniques[codes]
+
+
+def stream_chunk_table(frame, first_row, schema=None):
+    """Normalizuje kawałek arkusza i zamienia go na tabelę Arrow o stałym schemacie"""
+    frame = fix_problematic_columns(frame)
+    frame = normalize_sheet(frame, categories=False)
+    frame.columns = [str(col) for col in frame.columns]
+    for col in frame.columns:
+        arrow_type = stream_arrow_type(col)
+        if arrow_type == pa.timestamp('ns'):
+            frame[col] = pd.to_datetime(frame[col], errors='coerce')
+        elif arrow_type == pa.time64('us'):
+            frame[col] = time_objects(frame[col])
+        elif arrow_type == pa.float64():
+            frame[col] = pd.to_numeric(frame[col], errors='coerce')
+        elif arrow_type == pa.string() and frame[col].dtype != 'object':
+            # np. kategoria _city_key albo liczby w kolumnie spoza schematu
+            frame[col] = frame[col].astype(object).where(frame[col].notna(), None)
+            frame[col] = frame[col].map(lambda value: value if value is None else str(value))
+    frame.insert(0, ROW_COLUMN, np.arange(first_row, first_row + len(frame), dtype=np.int64))
+    if schema is None:
+        schema = pa.schema([(col, stream_arrow_type(col)) for col in frame.columns])
+    return frame, pa.Table.from_pandas(frame, schema=schema, preserve_index=False)
+
+
+class StreamedDataset(MemorySized, Mapping):
+    """Pierwszy arkusz zapisany strumieniowo w Parquet (interfejs jak LazyWorkbook).
+
+    Metadane (zakres dat, kierowcy, wartości Exception info) zbierane są przy zapisie,
+    więc lista filtrów nie wymaga wczytania danych. scan() wczytuje tylko wiersze
+    spełniające filtry.
+    """
+
+    def __init__(self, dataset_dir):
+        # Dane czytane z dysku przy każdym skanie - katalog nie może zniknąć (prune_disk_cache)
+        self.disk_cache_dir = os.path.dirname(dataset_dir)
+        _disk_cache_users[id(self)] = self
+        with open(os.path.join(dataset_dir, 'dataset.json'), encoding='utf-8') as f:
+            metadata = json.load(f)
+        self.file_name = metadata['file_name']
+        self.sheet_name = metadata['sheet_name']
+        self.sheet_names = [self.sheet_name]
+        self.columns = metadata['columns']
+        self.rows = metadata['rows']
+        self.date_column = metadata['date_column']
+        self.min_date = date.fromisoformat(metadata['min_date']) if metadata['min_date'] else None
+        self.max_date = date.fromisoformat(metadata['max_date']) if metadata['max_date'] else None
+        self.drivers = metadata['drivers']
+        self.exceptions = metadata['exceptions']
+        self._dataset = ds.dataset(os.path.join(dataset_dir, 'data.parquet'), format='parquet')
+        self._tracking_index = None
+        self._lock = threading.Lock()
+
+    def scan(self, stages=(), columns=None):
+        """Ramka z wierszami spełniającymi etapy filtrowania ((etap, parametry) jak w
+        filter_stage) - filtr wykonywany przez pyarrow przy odczycie"""
+        if columns is not None:
+            columns = [ROW_COLUMN] + [col for col in columns if col != ROW_COLUMN]
+        table = self._dataset.to_table(columns=columns, filter=stream_filter_expression(stages))
+        df = table.to_pandas().set_index(ROW_COLUMN)
+        df.index.name = None
+        df = add_categories(df)
+        if CITY_KEY_COLUMN in df.columns:
+            df[CITY_KEY_COLUMN] = df[CITY_KEY_COLUMN].astype('category')
+        df.attrs['columns_fixed'] = True
+        return df
+
+    def tracking_index(self, sheet_name):
+        """Indeks numerów przesyłek z samej kolumny 'Numer' (None gdy jej brak)"""
+        if sheet_name not in self.sheet_names:
+            raise KeyError(sheet_name)
+        with self._lock:
+            if self._tracking_index is None and 'Numer' in self.columns:
+                self._tracking_index = TrackingIndex(self.scan(columns=['Numer'])['Numer'])
+                # W pamięci jest tylko indeks - dane zostają w Parquet na dysku
+                self._add_bytes(self._tracking_index.memory_bytes())
+            return self._tracking_index
+
+    def __getitem__(self, sheet_name):
+        # Cały arkusz - tylko dla zgodności z interfejsem, aplikacja używa scan()
+        if sheet_name not in self.sheet_names:
+            raise KeyError(sheet_name)
+        return self.scan()
+
+    def __iter__(self):
+        return iter(self.sheet_names)
+
+    def __len__(self):
+        return len(self.sheet_names)
+
+
+def stream_filter_expression(stages):
+    """Wyrażenie filtra pyarrow równoważne etapom filter_stage (None - bez filtra)"""
+    expression = None
+    for stage, params in stages:
+        if stage == 'date':
+            date_column, date_option, selected_dates = params
+            field = ds.field(date_column)
+            if date_option == "Tylko soboty":
+                # day_of_week: poniedziałek = 0, sobota = 5
+                condition = pc.day_of_week(field) == 5
+            else:
+                if isinstance(selected_dates, tuple) and len(selected_dates) == 1:
+                    selected_dates = selected_dates[0]
+                if isinstance(selected_dates, tuple) and len(selected_dates) == 2:
+                    start_date, end_date = selected_dates
+                elif selected_dates:
+                    start_date = end_date = selected_dates
+                else:
+                    continue
+                start = pa.scalar(pd.Timestamp(start_date), pa.timestamp('ns'))
+                end = pa.scalar(pd.Timestamp(end_date) + pd.Timedelta(days=1), pa.timestamp('ns'))
+                condition = (field >= start) & (field < end)
+        elif stage == 'driver':
+            condition = ds.field('Driver ID:') == params
+        elif stage == 'exceptions':
+            condition = ds.field('Exception info').isin(list(params))
+        else:
+            raise ValueError(f"Nieznany etap filtrowania: {stage}")
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def stream_filter_stages(dataset, saturdays_only=False, date_range=None, driver=None,
+                         exceptions=DEFAULT_EXCEPTIONS):
+    """Etapy filtrowania jak w apply_filters, dobrane z metadanych StreamedDataset"""
+    stages = []
+    if dataset.date_column is not None:
+        if saturdays_only:
+            stages.append(('date', (dataset.date_column, "Tylko soboty", None)))
+        elif date_range:
+            stages.append(('date', (dataset.date_column, "Niestandardowy wybór",
+                                    tuple(date_range))))
+    if driver is not None and 'Driver ID:' in dataset.columns:
+        stages.append(('driver', driver))
+    if exceptions and 'Exception info' in dataset.columns:
+        available = [exc for exc in exceptions if exc in dataset.exceptions]
+        if available:
+            stages.append(('exceptions', tuple(available)))
+    return stages
+
+
+def stream_workbook(data, file_name, dataset_dir, columns=None, chunk_rows=STREAM_CHUNK_ROWS):
+    """Zapisuje pierwszy arkusz strumieniowo do dataset_dir/data.parquet (grupa wierszy na
+    kawałek chunk_rows wierszy) z metadanymi filtrów w dataset.json.
+
+    W pamięci jest naraz tylko jeden kawałek arkusza (plus bajty pliku).
+    """
+    file_extension = file_name.split('.')[-1].lower()
+    if file_extension not in READER_ENGINES['rows']:
+        raise ValueError(f"Ładowanie strumieniowe nie obsługuje plików .{file_extension}")
+    reader = RowReader(data, file_extension)
+    sheet_name = reader.sheet_names[0]
+    rows = reader.iter_rows(sheet_name)
+    header = next(rows, None)
+    if header is None:
+        raise ValueError(f"Arkusz {sheet_name} jest pusty")
+
+    # Wszystkie kolumny poza typowanymi (daty, czas, współrzędne) jako tekst - stały schemat
+    names = column_names(header)
+    usecols = projection_options(columns).get('usecols')
+    dtype = {name: str for name in names if stream_arrow_type(str(name)) == pa.string()}
+
+    os.makedirs(dataset_dir, exist_ok=True)
+    path = os.path.join(dataset_dir, 'data.parquet')
+    tmp_path = temporary_path(path)
+    writer = None
+    row_count = 0
+    date_column = None
+    min_date = max_date = None
+    drivers = set()
+    exceptions = set()
+    # Puste wiersze z końca kawałka - odkładane, dopóki nie wiadomo, czy za nimi są dane
+    blank_rows = 0
+    try:
+        while True:
+            raw = list(islice(rows, chunk_rows))
+            # frame_from_rows usuwa puste wiersze z końca - na granicy kawałków przesunęłoby
+            # to numerację _row. Trafiają do następnego kawałka przed jego pierwszy niepusty
+            # wiersz, a na końcu arkusza są pomijane (jak w pandas)
+            filled = len(raw)
+            while filled and not row_has_values(raw[filled - 1]):
+                filled -= 1
+            if filled:
+                chunk = [()] * blank_rows + raw[:filled]
+                blank_rows = len(raw) - filled
+            else:
+                chunk = []
+                blank_rows += len(raw)
+            if not chunk and writer is not None:
+                if raw:
+                    continue
+                break
+            frame = frame_from_rows(chain([header], chunk), usecols, dtype)
+            frame, table = stream_chunk_table(
+                frame, row_count, None if writer is None else writer.schema)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, table.schema)
+                date_column = find_date_column(frame)
+            writer.write_table(table, row_group_size=chunk_rows)
+            row_count += len(frame)
+
+            # Metadane filtrów zbierane z każdego kawałka
+            if date_column is not None and frame[date_column].notna().any():
+                chunk_min = frame[date_column].min().date()
+                chunk_max = frame[date_column].max().date()
+                min_date = chunk_min if min_date is None else min(min_date, chunk_min)
+                max_date = chunk_max if max_date is None else max(max_date, chunk_max)
+            if 'Driver ID:' in frame.columns:
+                drivers.update(frame['Driver ID:'].dropna().unique().tolist())
+            if 'Exception info' in frame.columns:
+                exceptions.update(frame['Exception info'].dropna().unique().tolist())
+            if not raw:
+                break
+        writer.close()
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            if writer is not None:
+                writer.close()
+            os.remove(tmp_path)
+
+    metadata = {
+        'version': CACHE_VERSION,
+        'file_name': file_name,
+        'sheet_name': sheet_name,
+        'columns': [col for col in writer.schema.names if col != ROW_COLUMN],
+        'rows': row_count,
+        'date_column': date_column,
+        'min_date': min_date.isoformat() if min_date else None,
+        'max_date': max_date.isoformat() if max_date else None,
+        'drivers': sorted(drivers),
+        'exceptions': sorted(exceptions),
+    }
+    # Metadane na końcu - ich obecność oznacza kompletny zbiór
+    metadata_path = os.path.join(dataset_dir, 'dataset.json')
+    tmp_path = temporary_path(metadata_path)
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(metadata, f, ensure_ascii=False)
+        os.replace(tmp_path, metadata_path)
+    finally:
+        remove_file(tmp_path)
+    return StreamedDataset(dataset_dir)
+
+
+def open_streamed_workbook(data, file_name, file_hash=None, columns=None,
+                           chunk_rows=STREAM_CHUNK_ROWS):
+    """Zbiór strumieniowy pliku z cache (po hashu zawartości) albo zapisany od nowa"""
+    if file_hash is None:
+        file_hash = file_content_hash(io.BytesIO(data))
+    cache_name = file_hash if columns is None else f'{file_hash}_{projection_key(columns)}'
+    dataset_dir = os.path.join(CACHE_DIR, f'v{CACHE_VERSION}', cache_name, STREAM_DIR_NAME)
+    touch_cache_dir(os.path.dirname(dataset_dir))
+    try:
+        with open(os.path.join(dataset_dir, 'dataset.json'), encoding='utf-8') as f:
+            if json.load(f).get('version') == CACHE_VERSION:
+                return StreamedDataset(dataset_dir)
+    except (OSError, ValueError):
+        pass
+    with profile_stage('stream_ingest'):
+        return stream_workbook(data, file_name, dataset_dir, columns, chunk_rows)
+
+
+def artifact_nbytes(value):
+    """Przybliżony rozmiar obiektu w pamięci (bajty) dla budżetu CacheRegistry"""
+    if hasattr(value, 'memory_bytes'):
+        return value.memory_bytes()
+    if isinstance(value, pd.DataFrame):
+        return frame_nbytes(value)
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        return sum(artifact_nbytes(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class CacheRegistry:
+    """Wspólny dla całego procesu cache z budżetem bajtów i usuwaniem najdawniej używanych.
+
+    Sesje pytające o ten sam klucz (np. hash zawartości pliku) dostają ten sam obiekt -
+    dane są w pamięci raz. Skoroszyty oddają ramki jako płytkie widoki tylko do odczytu
+    (Copy-on-Write), więc w sesji zostaje tylko stan filtrów. Równoczesne żądania tego
+    samego klucza czekają na jedno ładowanie.
+
+    Każdy wpis ma rozmiar w bajtach (funkcja size, domyślnie artifact_nbytes). Gdy suma
+    przekroczy max_bytes, usuwane są najdawniej używane wpisy (poza ostatnio dodanym) i
+    wywoływane ich on_evict. Obiekty MemorySized (skoroszyty wczytujące arkusze leniwie)
+    same zgłaszają zmianę rozmiaru przez on_resize.
+    """
+
+    def __init__(self, max_bytes=None, name='cache'):
+        # None - bez limitu
+        self.max_bytes = max_bytes
+        self.name = name
+        self._lock = threading.Lock()
+        # klucz -> {'value', 'nbytes', 'on_evict'}, od najdawniej do ostatnio użytego
+        self._entries = OrderedDict()
+        self._loading = {}
+        self._nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, loader, size=artifact_nbytes, on_evict=None):
+        """Obiekt dla klucza; przy pierwszym żądaniu ładowany przez loader() (None nie
+        trafia do cache). on_evict(value) jest wywoływane po usunięciu wpisu"""
+        value = self._lookup(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            key_lock = self._loading.setdefault(key, threading.Lock())
+        with key_lock:
+            # Inna sesja mogła załadować klucz w czasie oczekiwania
+            value = self._lookup(key, count_miss=True)
+            if value is not None:
+                return value
+            try:
+                value = loader()
+                if value is not None:
+                    self.put(key, value, size(value), on_evict)
+            finally:
+                # Dopiero po put - żądanie w międzyczasie czeka na key_lock i trafia w cache
+                # zamiast ładować drugi raz; przy wyjątku tylko sprzątanie
+                with self._lock:
+                    self._loading.pop(key, None)
+            return value
+
+    def _lookup(self, key, count_miss=False):
+        """Wartość z cache (oznaczona jako ostatnio użyta) albo None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                if count_miss:
+                    self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry['value']
+
+    def put(self, key, value, nbytes, on_evict=None):
+        """Dodaje (albo zastępuje) wpis o rozmiarze nbytes i usuwa wpisy ponad budżet"""
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._nbytes -= old['nbytes']
+            self._entries[key] = {'value': value, 'nbytes': nbytes, 'on_evict': on_evict}
+            self._nbytes += nbytes
+            evicted = self._evict()
+        if isinstance(value, MemorySized):
+            value.on_resize = functools.partial(self.resize, key, value=value)
+        self._finish_evictions(evicted)
+
+    def resize(self, key, nbytes, value=None):
+        """Aktualizuje rozmiar wpisu (np. skoroszyt wczytał kolejny arkusz). value - tylko gdy
+        wpis to wciąż ten obiekt (usunięty z cache skoroszyt nie zmienia nowego wpisu)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry['nbytes'] == nbytes:
+                return
+            if value is not None and entry['value'] is not value:
+                return
+            self._nbytes += nbytes - entry['nbytes']
+            entry['nbytes'] = nbytes
+            evicted = self._evict()
+        self._finish_evictions(evicted)
+
+    def _evict(self):
+        """Usuwa najdawniej używane wpisy ponad budżet (wywoływane pod blokadą)"""
+        evicted = []
+        if self.max_bytes is None:
+            return evicted
+        # Ostatnio użyty wpis zostaje, nawet gdy sam przekracza budżet
+        while self._nbytes > self.max_bytes and len(self._entries) > 1:
+            key, entry = self._entries.popitem(last=False)
+            self._nbytes -= entry['nbytes']
+            self.evictions += 1
+            evicted.append((key, entry))
+        return evicted
+
+    def _finish_evictions(self, evicted):
+        """Loguje usunięte wpisy i wywołuje ich on_evict (już bez blokady)"""
+        for key, entry in evicted:
+            logger.info("%s: usunięto %s (%.1f MB)", self.name, key, entry['nbytes'] / BYTES_PER_MB)
+            if entry['on_evict'] is not None:
+                try:
+                    entry['on_evict'](entry['value'])
+                except Exception as e:
+                    logger.warning("%s: błąd przy usuwaniu %s: %s", self.name, key, e)
+
+    def discard(self, key):
+        """Usuwa wpis (sesje, które mają obiekt, zachowują swoje referencje)"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._nbytes -= entry['nbytes']
+        if entry is not None:
+            self._finish_evictions([(key, entry)])
+
+    def stats(self):
+        """Liczniki cache: wpisy, bajty, budżet, trafienia, chybienia, usunięcia"""
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._nbytes,
+                    'max_bytes': self.max_bytes, 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions}
+
+    def keys(self):
+        """Klucze wpisów (kopia - cache może się zmieniać w trakcie iteracji)"""
+        with self._lock:
+            return list(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+def remove_file(path):
+    """Usuwa plik, jeśli jeszcze istnieje (on_evict dla plików w cache)"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def directory_nbytes(path):
+    """Łączny rozmiar plików w katalogu (rekurencyjnie)"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def prune_disk_cache(max_bytes=None):
+    """Sprząta trwały cache w CACHE_DIR i zwraca liczbę usuniętych katalogów.
+
+    Usuwa katalogi starszych wersji (v1, v2...) i katalog eksportów sprzed wersjonowania,
+    a w bieżącej wersji - najdawniej używane skoroszyty i zbiory strumieniowe (mtime
+    katalogu), dopóki suma przekracza max_bytes (domyślnie DISK_CACHE_MAX_MB). Katalogi
+    otwarte przez żywe skoroszyty/zbiory zostają.
+    """
+    if max_bytes is None:
+        max_bytes = int(DISK_CACHE_MAX_MB * BYTES_PER_MB)
+    current = f'v{CACHE_VERSION}'
+    try:
+        names = os.listdir(CACHE_DIR)
+    except FileNotFoundError:
+        return 0
+
+    removed = 0
+    for name in names:
+        if name != current and (re.fullmatch(r'v\d+', name) or name == EXPORT_DIR_NAME):
+            shutil.rmtree(os.path.join(CACHE_DIR, name), ignore_errors=True)
+            logger.info("cache dyskowy: usunięto %s (stara wersja)", name)
+            removed += 1
+
+    in_use = {os.path.abspath(user.disk_cache_dir) for user in list(_disk_cache_users.values())}
+    entries = []
+    try:
+        with os.scandir(os.path.join(CACHE_DIR, current)) as scan:
+            for entry in scan:
+                if entry.is_dir() and entry.name != EXPORT_DIR_NAME:
+                    entries.append((entry.stat().st_mtime, entry.path, directory_nbytes(entry.path)))
+    except FileNotFoundError:
+        return removed
+
+    total = sum(nbytes for _, _, nbytes in entries)
+    for _, path, nbytes in sorted(entries):
+        if total <= max_bytes:
+            break
+        if os.path.abspath(path) in in_use:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        logger.info("cache dyskowy: usunięto %s (%.1f MB)", path, nbytes / BYTES_PER_MB)
+        total -= nbytes
+        removed += 1
+    return removed
+
+
+def touch_cache_dir(path):
+    """Oznacza katalog cache jako ostatnio użyty (kolejność usuwania w prune_disk_cache)"""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+# Budżety cache (MB) - po przekroczeniu usuwane są najdawniej używane wpisy
+CACHE_MAX_MB = float(os.environ.get('NOZYK_CACHE_MAX_MB', 2048))
+EXPORT_CACHE_MAX_MB = float(os.environ.get('NOZYK_EXPORT_CACHE_MAX_MB', 1024))
+
+# Cache procesu - jeden na serwer Streamlit, współdzielony przez wszystkie sesje:
+# zbiory danych i mapy w pamięci oraz gotowe pliki eksportu na dysku (osobny budżet)
+CACHE = CacheRegistry(max_bytes=int(CACHE_MAX_MB * BYTES_PER_MB), name='cache')
+EXPORT_FILES = CacheRegistry(max_bytes=int(EXPORT_CACHE_MAX_MB * BYTES_PER_MB), name='exports')
+
+
+# Eksport
+EXPORT_CHUNK_ROWS = 50000
+# format: rozszerzenie pliku
+EXPORT_EXTENSIONS = {'csv': 'csv', 'xlsx': 'xlsx', 'parquet': 'parquet'}
+
+
+def write_csv_chunked(df, path):
+    """Zapisuje CSV kawałkami po EXPORT_CHUNK_ROWS wierszy (bez budowania całego tekstu w pamięci)"""
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        # range(0, 1) dla pustej ramki - zapisze sam nagłówek
+        for start in range(0, max(len(df), 1), EXPORT_CHUNK_ROWS):
+            df.iloc[start:start + EXPORT_CHUNK_ROWS].to_csv(
+                f, index=False, header=(start == 0))
+
+
+def write_excel_write_only(df, path, sheet_name):
+    """Zapisuje Excel przez openpyxl w trybie write-only (wiersze strumieniowo, bez modelu komórek)"""
+    workbook = openpyxl.Workbook(write_only=True)
+    worksheet = workbook.create_sheet(sheet_name)
+    worksheet.append([str(col) for col in df.columns])
+    for start in range(0, len(df), EXPORT_CHUNK_ROWS):
+        chunk = df.iloc[start:start + EXPORT_CHUNK_ROWS].astype(object)
+        # NaN/NaT jako puste komórki
+        chunk = chunk.where(chunk.notna(), None)
+        for row in chunk.itertuples(index=False, name=None):
+            worksheet.append(row)
+    workbook.save(path)
+
+
+def write_export(df, path, export_format, sheet_name='Dane'):
+    """Zapisuje ramkę do pliku w formacie csv, xlsx lub parquet (bez kolumn pomocniczych)"""
+    if any(col in df.columns for col in INTERNAL_COLUMNS):
+        df = df[visible_columns(df)]
+    if export_format == 'csv':
+        write_csv_chunked(df, path)
+    elif export_format == 'xlsx':
+        write_excel_write_only(df, path, sheet_name)
+    elif export_format == 'parquet':
+        df.to_parquet(path, index=False)
+    else:
+        raise ValueError(f"Nieznany format eksportu: {export_format}")
+
+
+# Przetwarzanie wsadowe (CLI)
+def find_workbooks(paths):
+    """Pliki Excel z podanych ścieżek (foldery przeszukiwane bez podfolderów)"""
+    workbooks = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                full_path = os.path.join(path, name)
+                if os.path.isfile(full_path) and name.split('.')[-1].lower() in EXCEL_EXTENSIONS:
+                    workbooks.append(full_path)
+        else:
+            workbooks.append(path)
+    return workbooks
+
+
+def process_workbook(path, output_dir, export_format='csv', filters=None, use_cache=True,
+                     profile=False, columns=USED_COLUMNS, engine='auto', stream=False):
+    """Ładuje skoroszyt, filtruje pierwszy arkusz i zapisuje podsumowanie kierowców.
+
+    Funkcja wykonywana w procesach roboczych - zwraca słownik ze statystykami
+    (z profile=True także pomiary etapów w kluczu 'profile'). stream=True - ładowanie
+    strumieniowe, w pamięci tylko przefiltrowane wiersze; wiersze czyta zawsze silnik
+    'rows', a z use_cache=False zbiór Parquet powstaje w katalogu tymczasowym.
+    """
+    if stream and engine not in ('auto', 'rows'):
+        raise ValueError(f"Ładowanie strumieniowe czyta wiersze silnikiem rows, nie {engine}")
+    profiler = StageProfiler() if profile else None
+    set_profiler(profiler)
+    stream_dir = None
+    try:
+        start = time.perf_counter()
+        with profile_stage('read'):
+            with open(path, 'rb') as f:
+                data = f.read()
+
+        if stream:
+            with profile_stage('load'):
+                if use_cache:
+                    dataset = open_streamed_workbook(data, os.path.basename(path), columns=columns)
+                else:
+                    # Bez trwałego cache - zbiór tylko na czas przetwarzania, usuwany w finally
+                    stream_dir = tempfile.mkdtemp(prefix='nozyk_stream_')
+                    with profile_stage('stream_ingest'):
+                        dataset = stream_workbook(data, os.path.basename(path),
+                                                  os.path.join(stream_dir, STREAM_DIR_NAME),
+                                                  columns)
+            if 'Driver ID:' not in dataset.columns:
+                raise ValueError("Brak kolumny 'Driver ID:'")
+            row_count = dataset.rows
+            with profile_stage('filter') as record:
+                filtered = record['frame'] = dataset.scan(
+                    stream_filter_stages(dataset, **(filters or {})))
+        else:
+            with profile_stage('load'):
+                workbook = open_workbook(data, os.path.basename(path), use_cache=use_cache,
+                                         columns=columns, engine=engine)
+            if len(workbook) == 0:
+                raise ValueError("Nie udało się załadować żadnego arkusza")
+            first_sheet = next(iter(workbook))
+            df = workbook[first_sheet]
+            if 'Driver ID:' not in df.columns:
+                raise ValueError("Brak kolumny 'Driver ID:'")
+            row_count = len(df)
+
+            with profile_stage('filter') as record:
+                filtered = record['frame'] = apply_filters(df, **(filters or {}))
+        with profile_stage('summary') as record:
+            summary = record['frame'] = driver_summary(filtered)
+
+        stem = os.path.splitext(os.path.basename(path))[0]
+        output_path = os.path.join(
+            output_dir, f"{stem}_podsumowanie.{EXPORT_EXTENSIONS[export_format]}")
+        with profile_stage('export'):
+            write_export(summary, output_path, export_format, sheet_name='Podsumowanie')
+
+        result = {
+            'path': path,
+            'output_path': output_path,
+            'bytes': len(data),
+            'rows': row_count,
+            'filtered_rows': len(filtered),
+            'drivers': len(summary),
+            'seconds': time.perf_counter() - start,
+        }
+        if profiler is not None:
+            result['profile'] = list(profiler.records)
+        return result
+    finally:
+        # Proces roboczy obsługuje kolejne pliki - nie zostawiaj aktywnego profilera
+        set_profiler(None)
+        if profiler is not None:
+            profiler.close()
+        if stream_dir is not None:
+            shutil.rmtree(stream_dir, ignore_errors=True)
+
+
+def parse_args(argv=None):
+    """Argumenty linii poleceń"""
+    parser = argparse.ArgumentParser(
+        description="Wsadowe podsumowanie kierowców dla wielu skoroszytów Excel")
+    parser.add_argument('inputs', nargs='+',
+                        help="Pliki .xlsx/.xls/.xlsb lub foldery z takimi plikami")
+    parser.add_argument('-o', '--output-dir', default='podsumowania',
+                        help="Folder na pliki wynikowe (domyślnie: podsumowania)")
+    parser.add_argument('-f', '--format', choices=sorted(EXPORT_EXTENSIONS), default='csv',
+                        help="Format podsumowań (domyślnie: csv)")
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(),
+                        help="Liczba procesów roboczych (domyślnie: liczba CPU)")
+    parser.add_argument('--saturdays-only', action='store_true',
+                        help="Tylko soboty")
+    parser.add_argument('--date-from', type=date.fromisoformat,
+                        help="Data początkowa (RRRR-MM-DD)")
+    parser.add_argument('--date-to', type=date.fromisoformat,
+                        help="Data końcowa (RRRR-MM-DD)")
+    parser.add_argument('--driver', help="Tylko podany Driver ID")
+    parser.add_argument('--exceptions', nargs='*', default=DEFAULT_EXCEPTIONS,
+                        help="Wartości Exception info (bez wartości - bez filtra)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Nie używaj trwałego cache Parquet")
+    parser.add_argument('--engine', choices=['auto'] + sorted(READER_ENGINES), default='auto',
+                        help="Silnik odczytu skoroszytów (domyślnie: auto - rows dla .xlsx od "
+                             f"{ROW_READER_MIN_BYTES / BYTES_PER_MB:.0f} MB, poza tym czytnik "
+                             "pandas dla typu pliku)")
+    parser.add_argument('--stream', action='store_true',
+                        help="Ładowanie strumieniowe przez Parquet (pliki większe niż pamięć, "
+                             "tylko .xlsx/.xlsb; silnik rows, z --no-cache w katalogu "
+                             "tymczasowym)")
+    parser.add_argument('--all-columns', action='store_true',
+                        help="Wczytuj wszystkie kolumny (domyślnie tylko używane - USED_COLUMNS)")
+    parser.add_argument('--profile', metavar='PLIK',
+                        help="Zapisz pomiary etapów (czas, pamięć) jako linie JSON do pliku")
+    args = parser.parse_args(argv)
+    if args.stream and args.engine not in ('auto', 'rows'):
+        parser.error(f"--stream czyta wiersze silnikiem rows - nie można użyć --engine {args.engine}")
+    return args
+
+
+def main(argv=None):
+    """Przetwarza skoroszyty równolegle w puli procesów i raportuje przepustowość"""
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s %(message)s')
+    args = parse_args(argv)
+
+    workbooks = find_workbooks(args.inputs)
+    if not workbooks:
+        print("Brak plików do przetworzenia", file=sys.stderr)
+        return 1
+
+    date_range = None
+    if args.date_from or args.date_to:
+        date_range = (args.date_from or args.date_to, args.date_to or args.date_from)
+    filters = {
+        'saturdays_only': args.saturdays_only,
+        'date_range': date_range,
+        'driver': args.driver,
+        'exceptions': args.exceptions,
+    }
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    start = time.perf_counter()
+    results = []
+    failures = 0
+
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        futures = {
+            executor.submit(process_workbook, path, args.output_dir, args.format,
+                            filters, not args.no_cache, bool(args.profile),
+                            None if args.all_columns else USED_COLUMNS, args.engine,
+                            args.stream): path
+            for path in workbooks
+        }
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                failures += 1
+                print(f"❌ {path}: {e}", file=sys.stderr)
+                continue
+            results.append(result)
+            print(f"✅ {path}: {result['rows']} wierszy, {result['drivers']} kierowców, "
+                  f"{result['seconds']:.2f} s -> {result['output_path']}")
+
+    elapsed = time.perf_counter() - start
+    if not args.no_cache:
+        prune_disk_cache()
+    if args.profile:
+        # Jedna linia JSON na plik - do porównywania wydań
+        with open(args.profile, 'a', encoding='utf-8') as f:
+            for result in results:
+                f.write(json.dumps({
+                    'created': datetime.now().isoformat(timespec='seconds'),
+                    'path': result['path'],
+                    'rows': result['rows'],
+                    'pandas': pd.__version__,
+                    'cache_version': CACHE_VERSION,
+                    'stages': result['profile'],
+                }, ensure_ascii=False, default=str) + '\n')
+
+    total_rows = sum(result['rows'] for result in results)
+    total_mb = sum(result['bytes'] for result in results) / (1024 * 1024)
+    print(f"\nPrzetworzono {len(results)}/{len(workbooks)} plików w {elapsed:.2f} s "
+          f"({len(results) / elapsed:.2f} plików/s, {total_rows / elapsed:,.0f} wierszy/s, "
+          f"{total_mb / elapsed:.2f} MB/s)")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())